@@ -1,17 +1,33 @@
+import importlib.util
+import os
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-import sqlite3
-import csv
 from datetime import datetime, date
 import threading
 import time
-import serial
-from adafruit_fingerprint import Adafruit_Fingerprint
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.units import inch
+from attendance import TodayAttendance
+from cache import UserCache
+from database import Database
+from events import ATTENDANCE_CHANGES, CHECK_IN, CHECK_OUT, UNKNOWN, EventBus, record_attendance
+from export import CSV_COLUMNS, ExportCancelled, ExportJob, progress_text, write_columnar, write_csv
+from journal import ScanJournal
+from migrations import migrate
+from report_cache import ReportCache
+from reports import ReportJobs, ReportScheduler, summary_report
+from scan_daemon import ScanClient, daemon_running
+from scanner import ScanPipeline
+from sensor import MAX_FINGER_ID, copy_template, open_readers, reader_status
+from stats import LiveStatistics, user_statistics
+from treeview import TreeUpdater
+from virtualtable import KeysetSource, VirtualTable
+
+# Rows of the recent attendance display
+RECENT_ROWS = 15
+
+# Users tab rows; sortable columns must not be NULL for keyset pagination
+USERS_QUERY = """SELECT finger_id, name, COALESCE(age, '') AS age, COALESCE(department, '') AS department
+                 FROM users"""
+
 
 class FingerprintAttendanceGUI:
     def __init__(self, root):
@@ -23,42 +39,66 @@ class FingerprintAttendanceGUI:
         # Initialize sensor variables
         self.uart = None
         self.finger = None
+        self.scan_fingers = {}
         self.sensor_connected = False
+        self.scan_client = None
        
         # Initialize database
+        self.db = Database()
         self.init_db()
        
+        # Keep registered users in memory for the scan path
+        self.user_cache = UserCache(self.db)
+        self.user_cache.load()
+        self.sensor_status = "Ready"
+       
+        # Today's check-in/check-out state, rebuilt from the database
+        self.today_attendance = TodayAttendance(self.db)
+        self.today_attendance.load()
+       
+        # Scan outcomes are published as attendance events, which the
+        # recent attendance list and the statistics apply to what they show
+        self.events = EventBus()
+        self.live_stats = LiveStatistics(self.db, history=True)
+        self.user_summary = {}
+        self.today_status = {}
+       
         # Create GUI first
         self.create_widgets()
+        for handler, kinds in ((self.show_attendance_event, None),
+                               (self.apply_recent_attendance, ATTENDANCE_CHANGES),
+                               (self.apply_statistics, ATTENDANCE_CHANGES)):
+            self.events.subscribe(lambda event, handler=handler: self.root.after(0, handler, event), kinds)
        
         # Initialize fingerprint sensor in background
         self.init_sensor_background()
        
-        # Start attendance scanning thread
+        # Attendance scan pipeline, started from the attendance tab
         self.scanning = False
-        self.scan_thread = None
+        self.scan_pipeline = None
+       
+        # Matches are journaled before they are recorded, so a failed
+        # database write does not lose them; opened with the first
+        # pipeline, as the scanning daemon uses the same file
+        self.journal = None
+       
+        # Background export in progress, if any
+        self.export_job = None
+       
+        # PDF reports are rendered by worker processes and cached; the
+        # end-of-shift reports are pre-rendered while nothing else runs
+        self.report_cache = ReportCache(self.db)
+        self.report_jobs = ReportJobs(self.db.path, cache=self.report_cache,
+                                      on_change=lambda job: self.root.after(0, self.report_job_changed, job))
+        self.report_scheduler = ReportScheduler(self.report_jobs, (summary_report,),
+                                                idle=lambda: self.export_job is None).start()
+        self.closing = False
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
        
     def init_db(self):
-        """Initialize database tables"""
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS users (
-            finger_id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL,
-            age INTEGER,
-            department TEXT)''')
-
-        c.execute('''CREATE TABLE IF NOT EXISTS attendance (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            finger_id INTEGER,
-            name TEXT,
-            department TEXT,
-            check_in_time TIMESTAMP,
-            check_out_time TIMESTAMP,
-            date DATE,
-            status TEXT DEFAULT 'present')''')
-        conn.commit()
-        conn.close()
+        """Initialize database tables and apply pending schema migrations"""
+        with self.db.transaction() as c:
+            migrate(c)
    
     def create_widgets(self):
         """Create main GUI widgets"""
@@ -97,7 +137,7 @@ class FingerprintAttendanceGUI:
         fields_frame = tk.Frame(form_frame, bg='white')
         fields_frame.pack(pady=10)
        
-        tk.Label(fields_frame, text="Fingerprint ID (0-127):", bg='white').grid(row=0, column=0, sticky='e', padx=5, pady=5)
+        tk.Label(fields_frame, text=f"Fingerprint ID (0-{MAX_FINGER_ID}):", bg='white').grid(row=0, column=0, sticky='e', padx=5, pady=5)
         self.fid_entry = tk.Entry(fields_frame, width=20)
         self.fid_entry.grid(row=0, column=1, padx=5, pady=5)
        
@@ -161,6 +201,7 @@ class FingerprintAttendanceGUI:
         self.recent_tree.heading('Check-out', text='Check-out Time')
         self.recent_tree.heading('Status', text='Status')
         self.recent_tree.pack(pady=10, padx=10, fill='both', expand=True)
+        self.recent_updater = TreeUpdater(self.recent_tree)
        
         # Refresh button
         refresh_button = tk.Button(recent_frame, text="Refresh", command=self.refresh_recent_attendance,
@@ -185,6 +226,22 @@ class FingerprintAttendanceGUI:
         # Stats display
         self.stats_text = tk.Text(stats_frame, height=10, width=70, bg='#f9f9f9')
         self.stats_text.pack(pady=10)
+
+        # Export filters; empty dates export the whole history
+        export_filters = tk.Frame(stats_frame, bg='white')
+        export_filters.pack(pady=5)
+        tk.Label(export_filters, text="From (YYYY-MM-DD):", bg='white').pack(side=tk.LEFT, padx=5)
+        self.export_start_var = tk.StringVar()
+        tk.Entry(export_filters, textvariable=self.export_start_var, width=12).pack(side=tk.LEFT)
+        tk.Label(export_filters, text="To:", bg='white').pack(side=tk.LEFT, padx=5)
+        self.export_end_var = tk.StringVar()
+        tk.Entry(export_filters, textvariable=self.export_end_var, width=12).pack(side=tk.LEFT)
+        tk.Label(export_filters, text="Department:", bg='white').pack(side=tk.LEFT, padx=5)
+        self.export_dept_var = tk.StringVar(value='All')
+        self.export_dept_combo = ttk.Combobox(export_filters, textvariable=self.export_dept_var, width=15)
+        self.export_dept_combo['values'] = ['All'] + [row[0] for row in self.db.query(
+            "SELECT DISTINCT department FROM users WHERE department IS NOT NULL ORDER BY department")]
+        self.export_dept_combo.pack(side=tk.LEFT)
        
         # Buttons frame
         buttons_frame = tk.Frame(stats_frame, bg='white')
@@ -206,17 +263,64 @@ class FingerprintAttendanceGUI:
                                      bg='#FF9800', fg='white', font=("Arial", 10, "bold"))
         export_csv_button.pack(side=tk.LEFT, padx=5)
        
+        export_parquet_button = tk.Button(buttons_frame, text="Export to Parquet",
+                                         command=self.export_parquet,
+                                         bg='#9C27B0', fg='white', font=("Arial", 10, "bold"))
+        export_parquet_button.pack(side=tk.LEFT, padx=5)
+       
+        self.cancel_export_button = tk.Button(buttons_frame, text="Cancel Export",
+                                              command=self.cancel_export, state=tk.DISABLED,
+                                              bg='#f44336', fg='white', font=("Arial", 10, "bold"))
+        self.cancel_export_button.pack(side=tk.LEFT, padx=5)
+
+        # Report jobs rendered in the background
+        jobs_frame = tk.Frame(reports_frame, bg='white', relief=tk.RAISED, bd=2)
+        jobs_frame.pack(pady=10, padx=20, fill='both', expand=True)
+       
+        tk.Label(jobs_frame, text="Report Jobs", font=("Arial", 14, "bold"),
+                bg='white').pack(pady=5)
+       
+        self.jobs_tree = ttk.Treeview(jobs_frame, columns=('Report', 'Status', 'Pages', 'File'),
+                                      show='headings', height=4)
+        for column, width in (('Report', 200), ('Status', 100), ('Pages', 60), ('File', 400)):
+            self.jobs_tree.heading(column, text=column)
+            self.jobs_tree.column(column, width=width)
+        self.jobs_tree.pack(padx=10, fill='both', expand=True)
+       
+        jobs_buttons = tk.Frame(jobs_frame, bg='white')
+        jobs_buttons.pack(pady=5)
+        tk.Button(jobs_buttons, text="Cancel Job", command=self.cancel_report_job,
+                 bg='#f44336', fg='white', font=("Arial", 10, "bold")).pack(side=tk.LEFT, padx=5)
+        tk.Button(jobs_buttons, text="Clear Finished", command=self.clear_report_jobs,
+                 bg='#9E9E9E', fg='white', font=("Arial", 10, "bold")).pack(side=tk.LEFT, padx=5)
+       
+        # Load statistics; scans then update them as they happen
+        self.refresh_statistics()
+       
     def init_sensor_background(self):
         """Initialize fingerprint sensor in background thread"""
+        # A scanning daemon owns the sensor when one is running
+        if daemon_running():
+            self.sensor_status = "Connecting to scanning daemon..."
+            self.status_bar.config(text=self.sensor_status)
+            self.scan_client = ScanClient(self.daemon_event).start()
+            return
         def init_sensor():
             try:
-                self.uart = serial.Serial("/dev/serial0", baudrate=57600, timeout=1)
-                self.finger = Adafruit_Fingerprint(self.uart)
+                readers = open_readers(db=self.db)
+                connected = [reader for reader in readers if reader.finger is not None]
+                if not connected:
+                    raise readers[0].error
+                # Every reader scans; fingers are enrolled on the first
+                self.uart, self.finger = connected[0].uart, connected[0].finger
+                self.scan_fingers = {reader.name: reader.finger for reader in connected}
                 self.sensor_connected = True
-                self.root.after(0, lambda: self.status_bar.config(text="Fingerprint sensor connected"))
+                self.sensor_status = reader_status(readers)
+                self.root.after(0, lambda: self.status_bar.config(text=self.sensor_status))
             except Exception as e:
                 self.sensor_connected = False
-                self.root.after(0, lambda: self.status_bar.config(text=f"Sensor not connected: {e}"))
+                self.sensor_status = f"Sensor not connected: {e}"
+                self.root.after(0, lambda: self.status_bar.config(text=self.sensor_status))
                 self.root.after(0, lambda: messagebox.showwarning("Sensor Warning",
                     f"Fingerprint sensor not connected: {e}\nYou can still use the GUI to view data."))
        
@@ -237,13 +341,14 @@ class FingerprintAttendanceGUI:
         tk.Label(list_frame, text="Registered Users", font=("Arial", 16, "bold"),
                 bg='white').pack(pady=10)
        
-        # Treeview for users
-        self.users_tree = ttk.Treeview(list_frame, columns=('ID', 'Name', 'Age', 'Department'), show='headings')
-        self.users_tree.heading('ID', text='Fingerprint ID')
-        self.users_tree.heading('Name', text='Name')
-        self.users_tree.heading('Age', text='Age')
-        self.users_tree.heading('Department', text='Department')
-        self.users_tree.pack(pady=10, padx=10, fill='both', expand=True)
+        # Users table; only the visible rows are loaded
+        self.users_table = VirtualTable(list_frame, [
+            ('finger_id', 'Fingerprint ID', None), ('name', 'Name', None),
+            ('age', 'Age', None), ('department', 'Department', None)], bg='white')
+        self.users_table.pack(pady=10, padx=10, fill='both', expand=True)
+        self.users_table.set_source(KeysetSource(
+            self.db, USERS_QUERY, columns=('finger_id', 'name', 'age', 'department'),
+            key='finger_id', sort='finger_id'))
        
         # Refresh users button
         refresh_users_button = tk.Button(list_frame, text="Refresh Users",
@@ -266,8 +371,8 @@ class FingerprintAttendanceGUI:
                 messagebox.showerror("Error", "Please fill all fields")
                 return
            
-            if finger_id < 0 or finger_id > 127:
-                messagebox.showerror("Error", "Fingerprint ID must be between 0 and 127")
+            if finger_id < 0 or finger_id > MAX_FINGER_ID:
+                messagebox.showerror("Error", f"Fingerprint ID must be between 0 and {MAX_FINGER_ID}")
                 return
            
             if not self.sensor_connected:
@@ -281,6 +386,14 @@ class FingerprintAttendanceGUI:
                     self.refresh_users()
                 return
            
+            if self.scan_client is not None:
+                # The daemon owns the sensor: it enrolls the finger and adds the user
+                self.reg_status.config(text="Place finger on sensor...", fg='blue')
+                if not self.scan_client.send('enroll', finger_id=finger_id, name=name, age=age,
+                                             department=department):
+                    self.reg_status.config(text="Scanning daemon not reachable", fg='red')
+                return
+           
             self.reg_status.config(text="Please place finger on sensor...", fg='blue')
             self.root.update()
            
@@ -356,6 +469,10 @@ class FingerprintAttendanceGUI:
             if self.finger.store_model(finger_id) != 0x00:
                 return False
            
+            # The other readers search their own libraries
+            copy_template(self.finger, [finger for finger in self.scan_fingers.values()
+                                        if finger is not self.finger], finger_id)
+           
             return True
         except Exception as e:
             print(f"Enrollment error: {e}")
@@ -363,12 +480,11 @@ class FingerprintAttendanceGUI:
    
     def add_user(self, finger_id, name, age, department):
         """Add user to database"""
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?)",
-                  (finger_id, name, age, department))
-        conn.commit()
-        conn.close()
+        self.db.execute("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?)",
+                        (finger_id, name, age, department))
+        self.user_cache.put(finger_id, name, age, department)
+        if self.scan_client is not None:
+            self.scan_client.send('user_changed', finger_id=finger_id)
    
     def clear_registration_form(self):
         """Clear registration form"""
@@ -379,8 +495,14 @@ class FingerprintAttendanceGUI:
    
     def toggle_scanning(self):
         """Toggle attendance scanning"""
+        if self.scan_client is not None:
+            # The daemon scans; the button follows its status events
+            if not self.scan_client.send('stop' if self.scanning else 'start'):
+                messagebox.showerror("Error", "Scanning daemon not reachable")
+            return
         if self.scanning:
             self.scanning = False
+            self.scan_pipeline.stop()
             self.scan_button.config(text="Start Scanning", bg='#2196F3')
             self.att_status.config(text="Scanning stopped")
         else:
@@ -392,516 +514,391 @@ class FingerprintAttendanceGUI:
             self.scan_button.config(text="Stop Scanning", bg='#f44336')
             self.att_status.config(text="Scanning for fingerprints...")
            
-            # Start scanning thread
-            self.scan_thread = threading.Thread(target=self.scan_attendance_thread)
-            self.scan_thread.daemon = True
-            self.scan_thread.start()
+            # Start scan pipeline
+            self.start_scanning_thread()
+   
+    def start_scanning_thread(self):
+        """Start the fingerprint scan pipeline in background threads"""
+        if not self.scanning or (self.scan_pipeline is not None and self.scan_pipeline.running):
+            return
+        if self.scan_pipeline is not None and not self.scan_pipeline.finished():
+            # A stopped pipeline is still recording from the journal; two
+            # at once would apply its entries twice
+            self.root.after(50, self.start_scanning_thread)
+            return
+        self.open_journal()
+        self.scan_pipeline = ScanPipeline(self.scan_fingers,
+                                          lambda finger_id, confidence, reader, scanned_at:
+                                              self.mark_attendance(finger_id, reader, scanned_at),
+                                          self.show_scan_result, journal=self.journal)
+        self.scan_pipeline.start()
    
-    def scan_attendance_thread(self):
-        """Scan for attendance in separate thread"""
-        while self.scanning:
+    def show_scan_result(self, kind, data):
+        """Show the outcome of a scan (pipeline notify stage)"""
+        if kind in ('recorded', 'unknown'):
+            self.events.publish_scan(kind, data)
+        elif kind == 'no_match':
+            self.root.after(0, lambda: self.att_status.config(
+                text="Fingerprint not recognized"))
+        elif kind == 'error':
+            print(f"Scan error: {data}")
+   
+    def open_journal(self):
+        """Open the scan journal; scans are recorded without it if it cannot be opened"""
+        if self.journal is None:
             try:
-                if not self.sensor_connected or not self.finger:
-                    time.sleep(1)
-                    continue
-                   
-                if self.finger.get_image() == 0x00:
-                    if self.finger.image_2_tz(1) == 0x00:
-                        if self.finger.finger_search() == 0x00:
-                            finger_id = self.finger.finger_id
-                            result = self.mark_attendance(finger_id)
-                            if result:
-                                action, user = result
-                                if action == "check_in":
-                                    self.root.after(0, lambda: self.att_status.config(
-                                        text=f"Check-in recorded for {user[1]} ({user[3]})"))
-                                elif action == "check_out":
-                                    self.root.after(0, lambda: self.att_status.config(
-                                        text=f"Check-out recorded for {user[1]} ({user[3]})"))
-                                elif action == "already_checked_out":
-                                    self.root.after(0, lambda: self.att_status.config(
-                                        text=f"{user[1]} already completed today's attendance"))
-                                self.root.after(0, self.refresh_recent_attendance)
-                            else:
-                                self.root.after(0, lambda: self.att_status.config(
-                                    text="Unknown fingerprint detected"))
-                            time.sleep(2)  # Prevent multiple scans
-                        else:
-                            self.root.after(0, lambda: self.att_status.config(
-                                text="Fingerprint not recognized"))
-                            time.sleep(1)
-                time.sleep(0.1)
+                self.journal = ScanJournal()
             except Exception as e:
-                print(f"Scan error: {e}")
-                time.sleep(1)
+                print(f"Scan journal error: {e}")
    
-    def mark_attendance(self, finger_id):
+    def mark_attendance(self, finger_id, reader=None, scanned_at=None):
         """Mark attendance for user with check-in/check-out logic"""
         user = self.get_user(finger_id)
         if not user:
             return None
        
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-       
-        # Get today's date
-        today = date.today().strftime('%Y-%m-%d')
-       
-        # Check if user has any attendance record for today
-        c.execute("SELECT * FROM attendance WHERE finger_id = ? AND date = ?", (finger_id, today))
-        today_record = c.fetchone()
-       
-        if today_record is None:
-            # No record for today - this is check-in
-            c.execute("""INSERT INTO attendance (finger_id, name, department, check_in_time, date, status)
-                         VALUES (?, ?, ?, ?, ?, 'checked_in')""",
-                      (finger_id, user[1], user[3], datetime.now().strftime('%Y-%m-%d %H:%M:%S'), today))
-            conn.commit()
-            conn.close()
-            return ("check_in", user)
-       
-        elif today_record[5] is None:  # check_out_time is None
-            # Has check-in but no check-out - this is check-out
-            c.execute("""UPDATE attendance SET check_out_time = ?, status = 'completed'
-                         WHERE finger_id = ? AND date = ?""",
-                      (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), finger_id, today))
-            conn.commit()
-            conn.close()
-            return ("check_out", user)
-       
+        # Decide check-in/check-out from today's in-memory state
+        return record_attendance(self.today_attendance, user, reader, scanned_at)
+   
+    def show_attendance_event(self, event):
+        """Show an attendance event on the attendance tab; called on the Tk thread"""
+        if event.kind == CHECK_IN:
+            self.att_status.config(text=f"Check-in recorded for {event.name} ({event.department})")
+        elif event.kind == CHECK_OUT:
+            self.att_status.config(text=f"Check-out recorded for {event.name} ({event.department})")
+        elif event.kind == UNKNOWN:
+            self.att_status.config(text="Unknown fingerprint detected")
         else:
-            # Already has both check-in and check-out for today
-            conn.close()
-            return ("already_checked_out", user)
+            self.att_status.config(text=f"{event.name} already completed today's attendance")
    
     def get_user(self, finger_id):
         """Get user by fingerprint ID"""
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("SELECT * FROM users WHERE finger_id = ?", (finger_id,))
-        user = c.fetchone()
-        conn.close()
+        user = self.user_cache.get(finger_id)
+        self.root.after(0, self.update_cache_status)
         return user
    
+    def daemon_event(self, kind, data):
+        """Handle an event from the scanning daemon (scan client thread)"""
+        if kind == 'status':
+            self.root.after(0, self.show_daemon_status, data)
+        elif kind == 'enroll':
+            self.root.after(0, self.show_enroll_progress, data)
+        elif kind == 'disconnected':
+            self.sensor_connected = False
+            self.sensor_status = "Scanning daemon not reachable, reconnecting..."
+            self.root.after(0, lambda: self.status_bar.config(text=self.sensor_status))
+        else:
+            self.show_scan_result(kind, data)
+
+    def show_daemon_status(self, status):
+        """Follow the daemon's scanning state; called on the Tk thread"""
+        self.sensor_connected = status['sensor_ready']
+        self.scanning = status['scanning']
+        self.sensor_status = f"Scanning daemon: {status['sensor']}"
+        self.status_bar.config(text=self.sensor_status)
+        if self.scanning:
+            self.scan_button.config(text="Stop Scanning", bg='#f44336')
+            self.att_status.config(text="Scanning for fingerprints...", fg='blue')
+        else:
+            self.scan_button.config(text="Start Scanning", bg='#2196F3')
+            self.att_status.config(text="Sensor busy enrolling" if status['enrolling'] else "Scanning stopped",
+                                   fg='black')
+
+    def show_enroll_progress(self, event):
+        """Show the daemon's enrollment prompts; called on the Tk thread"""
+        if not event['done']:
+            self.reg_status.config(text=event['message'], fg='blue')
+        elif event['ok']:
+            self.reg_status.config(text=event['message'], fg='green')
+            self.clear_registration_form()
+            self.refresh_users()
+        else:
+            self.reg_status.config(text=event['message'], fg='red')
+
+    def update_cache_status(self):
+        """Show user cache hit/miss counters, and per-reader counts with several readers, in the status bar"""
+        text = f"{self.sensor_status} | {self.user_cache.summary()}"
+        if self.scan_pipeline is not None and len(self.scan_pipeline.readers) > 1:
+            text += f" | {self.scan_pipeline.summary()}"
+        self.status_bar.config(text=text)
+   
     def refresh_recent_attendance(self):
         """Refresh recent attendance display"""
-        # Clear existing items
-        for item in self.recent_tree.get_children():
-            self.recent_tree.delete(item)
-       
-        # Get recent attendance
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("""SELECT name, department, check_in_time, check_out_time, status
-                     FROM attendance ORDER BY check_in_time DESC LIMIT 15""")
-        rows = c.fetchall()
-        conn.close()
-       
-        # Add to treeview
+        # Scans arriving within one frame share a single refresh
+        self.recent_updater.request(self.load_recent_attendance)
+   
+    def apply_recent_attendance(self, event):
+        """Show a check-in or check-out in the recent attendance display; called on the Tk thread"""
+        self.recent_updater.put(event.record_id, (
+            event.name, event.department, event.check_in.split()[1][:5],
+            event.check_out.split()[1][:5] if event.check_out else "Not yet",
+            "Completed" if event.status == 'completed' else "Checked In"))
+        # Keep the latest RECENT_ROWS, as loaded
+        self.recent_updater.remove(*self.recent_updater.keys()[RECENT_ROWS:])
+   
+    def load_recent_attendance(self):
+        """Latest attendance rows for the recent attendance display"""
+        rows = self.db.query("""SELECT id, name, department, check_in_time, check_out_time, status
+                     FROM attendance ORDER BY check_in_time DESC LIMIT ?""", (RECENT_ROWS,))
+       
+        tree_rows = []
         for row in rows:
-            name, dept, check_in, check_out, status = row
+            record_id, name, dept, check_in, check_out, status = row
             check_in_display = check_in.split()[1][:5] if check_in else "N/A"  # Show only HH:MM
             check_out_display = check_out.split()[1][:5] if check_out else "Not yet"
            
-            # Color code based on status
-            item_id = self.recent_tree.insert('', 'end', values=(name, dept, check_in_display, check_out_display, status))
-           
             if status == 'completed':
-                self.recent_tree.set(item_id, 'Status', 'Completed')
+                status = 'Completed'
             elif status == 'checked_in':
-                self.recent_tree.set(item_id, 'Status', 'Checked In')
+                status = 'Checked In'
+            tree_rows.append((record_id, (name, dept, check_in_display, check_out_display, status)))
+        return tree_rows
    
     def refresh_users(self):
         """Refresh users display"""
-        # Clear existing items
-        for item in self.users_tree.get_children():
-            self.users_tree.delete(item)
-       
-        # Get users
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("SELECT * FROM users ORDER BY finger_id")
-        rows = c.fetchall()
-        conn.close()
-       
-        # Add to treeview
-        for row in rows:
-            self.users_tree.insert('', 'end', values=row)
+        self.users_table.refresh()
    
     def refresh_statistics(self):
         """Refresh attendance statistics"""
-        self.stats_text.delete(1.0, tk.END)
-       
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-       
-        # Total registered users
-        c.execute("SELECT COUNT(*) FROM users")
-        total_users = c.fetchone()[0]
-       
-        # Total attendance records
-        c.execute("SELECT COUNT(*) FROM attendance")
-        total_attendance = c.fetchone()[0]
-       
-        # Today's attendance
-        today = date.today().strftime('%Y-%m-%d')
-        c.execute("SELECT COUNT(*) FROM attendance WHERE date = ?", (today,))
-        today_attendance = c.fetchone()[0]
-       
-        # Today's completed attendance (both check-in and check-out)
-        c.execute("SELECT COUNT(*) FROM attendance WHERE date = ? AND status = 'completed'", (today,))
-        today_completed = c.fetchone()[0]
-       
-        # Today's checked-in only
-        c.execute("SELECT COUNT(*) FROM attendance WHERE date = ? AND status = 'checked_in'", (today,))
-        today_checked_in = c.fetchone()[0]
-       
-        # Attendance by department
-        c.execute("SELECT department, COUNT(*) FROM attendance GROUP BY department")
-        dept_attendance = c.fetchall()
+        # Today's figures and all-time records per department
+        stats = self.live_stats.load()
        
         # User attendance summary with working hours
-        c.execute("""
-            SELECT u.name, u.department,
-                   COUNT(a.finger_id) as days_present,
-                   SUM(CASE WHEN a.status = 'completed' THEN 1 ELSE 0 END) as days_completed,
-                   AVG(CASE WHEN a.check_in_time IS NOT NULL AND a.check_out_time IS NOT NULL
-                       THEN (julianday(a.check_out_time) - julianday(a.check_in_time)) * 24
-                       ELSE NULL END) as avg_hours
-            FROM users u
-            LEFT JOIN attendance a ON u.finger_id = a.finger_id
-            GROUP BY u.finger_id
-            ORDER BY days_present DESC
-        """)
-        user_summary = c.fetchall()
+        self.user_summary = {user.finger_id: user for user in user_statistics(self.db)}
        
         # Today's status
-        c.execute("""
-            SELECT u.name, u.department, a.check_in_time, a.check_out_time, a.status
+        rows = self.db.query("""
+            SELECT u.finger_id, u.name, u.department, a.check_in_time, a.check_out_time, a.status
             FROM users u
             LEFT JOIN attendance a ON u.finger_id = a.finger_id AND a.date = ?
-            ORDER BY a.check_in_time DESC
-        """, (today,))
-        today_status = c.fetchall()
-       
-        conn.close()
+        """, (stats.day.strftime('%Y-%m-%d'),))
+        self.today_status = {row[0]: tuple(row[1:]) for row in rows}
+        self.show_statistics()
+   
+    def apply_statistics(self, event):
+        """Count a check-in or check-out in the statistics; called on the Tk thread"""
+        if not self.live_stats.apply(event):
+            # The day has changed, or a new department
+            self.refresh_statistics()
+            return
+        self.today_status[event.finger_id] = (event.name, event.department, event.check_in,
+                                              event.check_out, event.status)
+        user = self.user_summary.get(event.finger_id)
+        if user is not None and event.kind == CHECK_IN:
+            self.user_summary[event.finger_id] = user._replace(days_present=user.days_present + 1)
+        elif user is not None:
+            # Every completed day has worked hours
+            hours = event.worked_seconds / 3600.0
+            self.user_summary[event.finger_id] = user._replace(
+                days_completed=user.days_completed + 1,
+                avg_hours=((user.avg_hours or 0) * user.days_completed + hours) / (user.days_completed + 1))
+        self.show_statistics()
+   
+    def show_statistics(self):
+        """Display the live statistics"""
+        stats = self.live_stats.stats
+        self.stats_text.delete(1.0, tk.END)
        
         # Display statistics
-        stats = f"=== ATTENDANCE STATISTICS ===\n\n"
-        stats += f"Total Registered Users: {total_users}\n"
-        stats += f"Total Attendance Records: {total_attendance}\n"
-        stats += f"Today's Attendance: {today_attendance}\n"
-        stats += f"Today's Completed (Check-in + Check-out): {today_completed}\n"
-        stats += f"Today's Checked-in Only: {today_checked_in}\n"
-        stats += f"Today's Absent: {total_users - today_attendance}\n\n"
-       
-        stats += "=== TODAY'S STATUS ===\n"
-        stats += f"{'Name':<20} {'Department':<15} {'Check-in':<10} {'Check-out':<10} {'Status':<12}\n"
-        stats += "-" * 75 + "\n"
+        text = f"=== ATTENDANCE STATISTICS ===\n\n"
+        text += f"Total Registered Users: {stats.total_users}\n"
+        text += f"Total Attendance Records: {stats.total_records}\n"
+        text += f"Today's Attendance: {stats.present}\n"
+        text += f"Today's Completed (Check-in + Check-out): {stats.completed}\n"
+        text += f"Today's Checked-in Only: {stats.checked_in}\n"
+        text += f"Today's Absent: {stats.absent}\n\n"
+       
+        text += "=== TODAY'S STATUS ===\n"
+        text += f"{'Name':<20} {'Department':<15} {'Check-in':<10} {'Check-out':<10} {'Status':<12}\n"
+        text += "-" * 75 + "\n"
+        # Latest check-in first, absent users last
+        today_status = sorted(self.today_status.values(), key=lambda row: row[2] or '', reverse=True)
         for name, dept, check_in, check_out, status in today_status:
             if name:  # Only show users with records today
                 check_in_time = check_in.split()[1][:5] if check_in else "N/A"
                 check_out_time = check_out.split()[1][:5] if check_out else "N/A"
                 status_display = status if status else "Absent"
-                stats += f"{name:<20} {dept:<15} {check_in_time:<10} {check_out_time:<10} {status_display:<12}\n"
-        stats += "\n"
-       
-        stats += "=== DEPARTMENT WISE ATTENDANCE ===\n"
-        for dept, count in dept_attendance:
-            stats += f"{dept}: {count} records\n"
-        stats += "\n"
-       
-        stats += "=== USER ATTENDANCE SUMMARY ===\n"
-        stats += f"{'Name':<20} {'Department':<15} {'Days Present':<12} {'Days Completed':<15} {'Avg Hours':<10}\n"
-        stats += "-" * 80 + "\n"
-        for name, dept, days_present, days_completed, avg_hours in user_summary:
-            avg_hours_display = f"{avg_hours:.1f}" if avg_hours else "N/A"
-            stats += f"{name:<20} {dept:<15} {days_present:<12} {days_completed:<15} {avg_hours_display:<10}\n"
-       
-        self.stats_text.insert(1.0, stats)
+                text += f"{name:<20} {dept:<15} {check_in_time:<10} {check_out_time:<10} {status_display:<12}\n"
+        text += "\n"
+       
+        text += "=== DEPARTMENT WISE ATTENDANCE ===\n"
+        for dept in stats.departments:
+            if dept.records:
+                text += f"{dept.department}: {dept.records} records\n"
+        text += "\n"
+       
+        text += "=== USER ATTENDANCE SUMMARY ===\n"
+        text += f"{'Name':<20} {'Department':<15} {'Days Present':<12} {'Days Completed':<15} {'Avg Hours':<10}\n"
+        text += "-" * 80 + "\n"
+        for user in sorted(self.user_summary.values(), key=lambda user: user.days_present, reverse=True):
+            avg_hours_display = f"{user.avg_hours:.1f}" if user.avg_hours else "N/A"
+            text += f"{user.name:<20} {user.department:<15} {user.days_present:<12} {user.days_completed:<15} {avg_hours_display:<10}\n"
+       
+        self.stats_text.insert(1.0, text)
    
     def export_pdf(self):
         """Export attendance report to PDF"""
-        try:
-            filename = filedialog.asksaveasfilename(
-                defaultextension=".pdf",
-                filetypes=[("PDF files", "*.pdf"), ("All files", "*.*")]
-            )
-           
-            if filename:
-                conn = sqlite3.connect("users.db")
-                c = conn.cursor()
-                
-                # Get all necessary data
-                # Basic statistics
-                c.execute("SELECT COUNT(*) FROM users")
-                total_users = c.fetchone()[0]
-                
-                c.execute("SELECT COUNT(*) FROM attendance")
-                total_attendance = c.fetchone()[0]
-                
-                today = date.today().strftime('%Y-%m-%d')
-                c.execute("SELECT COUNT(*) FROM attendance WHERE date = ?", (today,))
-                today_attendance = c.fetchone()[0]
-                
-                c.execute("SELECT COUNT(*) FROM attendance WHERE date = ? AND status = 'completed'", (today,))
-                today_completed = c.fetchone()[0]
-                
-                c.execute("SELECT COUNT(*) FROM attendance WHERE date = ? AND status = 'checked_in'", (today,))
-                today_checked_in = c.fetchone()[0]
-                
-                # Today's detailed status
-                c.execute("""
-                    SELECT u.name, u.department, a.check_in_time, a.check_out_time, a.status
-                    FROM users u
-                    LEFT JOIN attendance a ON u.finger_id = a.finger_id AND a.date = ?
-                    ORDER BY u.name
-                """, (today,))
-                today_status = c.fetchall()
-                
-                # Department wise attendance
-                c.execute("SELECT department, COUNT(*) FROM attendance GROUP BY department")
-                dept_attendance = c.fetchall()
-                
-                # User attendance summary
-                c.execute("""
-                    SELECT u.name, u.department,
-                           COUNT(a.finger_id) as days_present,
-                           SUM(CASE WHEN a.status = 'completed' THEN 1 ELSE 0 END) as days_completed,
-                           AVG(CASE WHEN a.check_in_time IS NOT NULL AND a.check_out_time IS NOT NULL
-                               THEN (julianday(a.check_out_time) - julianday(a.check_in_time)) * 24
-                               ELSE NULL END) as avg_hours
-                    FROM users u
-                    LEFT JOIN attendance a ON u.finger_id = a.finger_id
-                    GROUP BY u.finger_id
-                    ORDER BY days_present DESC
-                """)
-                user_summary = c.fetchall()
-                
-                # Recent attendance records
-                c.execute("""
-                    SELECT name, department, check_in_time, check_out_time, status, date
-                    FROM attendance 
-                    ORDER BY check_in_time DESC 
-                    LIMIT 20
-                """)
-                recent_attendance = c.fetchall()
-                
-                conn.close()
-                
-                # Create PDF document
-                doc = SimpleDocTemplate(filename, pagesize=A4)
-                story = []
-                styles = getSampleStyleSheet()
-                
-                # Custom styles
-                title_style = ParagraphStyle(
-                    'CustomTitle',
-                    parent=styles['Heading1'],
-                    fontSize=18,
-                    spaceAfter=30,
-                    alignment=1,  # Center alignment
-                    textColor=colors.darkblue
-                )
-                
-                heading_style = ParagraphStyle(
-                    'CustomHeading',
-                    parent=styles['Heading2'],
-                    fontSize=14,
-                    spaceAfter=12,
-                    textColor=colors.darkblue
-                )
-                
-                # Title
-                story.append(Paragraph("Fingerprint Attendance System Report", title_style))
-                story.append(Paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['Normal']))
-                story.append(Spacer(1, 20))
-                
-                # Summary Statistics
-                story.append(Paragraph("Summary Statistics", heading_style))
-                summary_data = [
-                    ['Metric', 'Value'],
-                    ['Total Registered Users', str(total_users)],
-                    ['Total Attendance Records', str(total_attendance)],
-                    ['Today\'s Attendance', str(today_attendance)],
-                    ['Today\'s Completed (Check-in + Check-out)', str(today_completed)],
-                    ['Today\'s Checked-in Only', str(today_checked_in)],
-                    ['Today\'s Absent', str(total_users - today_attendance)]
-                ]
-                
-                summary_table = Table(summary_data)
-                summary_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                    ('FONTSIZE', (0, 0), (-1, 0), 12),
-                    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                    ('GRID', (0, 0), (-1, -1), 1, colors.black)
-                ]))
-                story.append(summary_table)
-                story.append(Spacer(1, 20))
-                
-                # Today's Status
-                story.append(Paragraph("Today's Attendance Status", heading_style))
-                today_data = [['Name', 'Department', 'Check-in', 'Check-out', 'Status']]
-                
-                for name, dept, check_in, check_out, status in today_status:
-                    if name:  # Only show users with records
-                        check_in_time = check_in.split()[1][:5] if check_in else "N/A"
-                        check_out_time = check_out.split()[1][:5] if check_out else "N/A"
-                        status_display = status if status else "Absent"
-                        today_data.append([name, dept or "N/A", check_in_time, check_out_time, status_display])
-                
-                if len(today_data) > 1:
-                    today_table = Table(today_data)
-                    today_table.setStyle(TableStyle([
-                        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                        ('FONTSIZE', (0, 0), (-1, 0), 10),
-                        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                        ('FONTSIZE', (0, 1), (-1, -1), 8)
-                    ]))
-                    story.append(today_table)
-                else:
-                    story.append(Paragraph("No attendance records for today.", styles['Normal']))
-                story.append(Spacer(1, 20))
-                
-                # Department wise attendance
-                if dept_attendance:
-                    story.append(Paragraph("Department-wise Attendance", heading_style))
-                    dept_data = [['Department', 'Total Records']]
-                    for dept, count in dept_attendance:
-                        dept_data.append([dept or "N/A", str(count)])
-                    
-                    dept_table = Table(dept_data)
-                    dept_table.setStyle(TableStyle([
-                        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                        ('FONTSIZE', (0, 0), (-1, 0), 10),
-                        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-                    ]))
-                    story.append(dept_table)
-                    story.append(Spacer(1, 20))
-                
-                # User attendance summary
-                story.append(Paragraph("User Attendance Summary", heading_style))
-                user_data = [['Name', 'Department', 'Days Present', 'Days Completed', 'Avg Hours']]
-                
-                for name, dept, days_present, days_completed, avg_hours in user_summary:
-                    avg_hours_display = f"{avg_hours:.1f}" if avg_hours else "N/A"
-                    user_data.append([
-                        name, 
-                        dept or "N/A", 
-                        str(days_present), 
-                        str(days_completed), 
-                        avg_hours_display
-                    ])
-                
-                user_table = Table(user_data)
-                user_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                    ('FONTSIZE', (0, 0), (-1, 0), 10),
-                    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                    ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                    ('FONTSIZE', (0, 1), (-1, -1), 8)
-                ]))
-                story.append(user_table)
-                story.append(Spacer(1, 20))
-                
-                # Recent attendance records
-                story.append(Paragraph("Recent Attendance Records (Last 20)", heading_style))
-                recent_data = [['Name', 'Department', 'Date', 'Check-in', 'Check-out', 'Status']]
-                
-                for name, dept, check_in, check_out, status, date_record in recent_attendance:
-                    check_in_time = check_in.split()[1][:5] if check_in else "N/A"
-                    check_out_time = check_out.split()[1][:5] if check_out else "N/A"
-                    recent_data.append([
-                        name, 
-                        dept or "N/A", 
-                        date_record, 
-                        check_in_time, 
-                        check_out_time, 
-                        status or "N/A"
-                    ])
-                
-                recent_table = Table(recent_data)
-                recent_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                    ('FONTSIZE', (0, 0), (-1, 0), 9),
-                    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                    ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                    ('FONTSIZE', (0, 1), (-1, -1), 7)
-                ]))
-                story.append(recent_table)
-                
-                # Build PDF
-                doc.build(story)
-                messagebox.showinfo("Success", f"PDF report exported successfully to:\n{filename}")
-                
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to export PDF: {str(e)}")
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".pdf",
+            filetypes=[("PDF files", "*.pdf"), ("All files", "*.*")]
+        )
+       
+        if filename:
+            self.submit_report("Attendance report", summary_report, filename)
     
     def export_csv(self):
-        """Export attendance data to CSV"""
+        """Export attendance data to CSV in the background"""
         try:
-            filename = filedialog.asksaveasfilename(
-                defaultextension=".csv",
-                filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
-            )
-           
-            if filename:
-                conn = sqlite3.connect("users.db")
-                c = conn.cursor()
-                
-                # Get all attendance data with user details
-                c.execute("""
-                    SELECT u.name, u.department, a.check_in_time, a.check_out_time, 
-                           a.date, a.status,
-                           CASE WHEN a.check_in_time IS NOT NULL AND a.check_out_time IS NOT NULL
-                               THEN printf('%.2f', (julianday(a.check_out_time) - julianday(a.check_in_time)) * 24)
-                               ELSE 'N/A' END as hours_worked
-                    FROM users u
-                    LEFT JOIN attendance a ON u.finger_id = a.finger_id
-                    ORDER BY a.date DESC, a.check_in_time DESC
-                """)
-                
-                rows = c.fetchall()
-                conn.close()
-                
-                # Write to CSV
-                with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-                    writer = csv.writer(csvfile)
-                    
-                    # Write header
-                    writer.writerow(['Name', 'Department', 'Check-in Time', 'Check-out Time', 
-                                   'Date', 'Status', 'Hours Worked'])
-                    
-                    # Write data
-                    for row in rows:
-                        writer.writerow(row)
-                
-                messagebox.showinfo("Success", f"CSV file exported successfully to:\n{filename}")
-                
+            start, end, department = self.export_filters()
+        except ValueError:
+            messagebox.showerror("Error", "Export dates must be in YYYY-MM-DD format")
+            return
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
+        )
+        if filename:
+            key = self.report_cache.key('csv', start, end, department)
+            if self.report_cache.copy(key, filename):
+                self.status_bar.config(text="CSV export copied from the report cache")
+                messagebox.showinfo("Success", f"Attendance data exported successfully to:\n{filename}")
+                return
+            self.run_export("Exporting CSV", filename, write_csv, CSV_COLUMNS, start, end, department,
+                            cache_key=key)
+
+    def export_parquet(self):
+        """Export the attendance history as month-partitioned Parquet files in the background"""
+        try:
+            start, end, department = self.export_filters()
+        except ValueError:
+            messagebox.showerror("Error", "Export dates must be in YYYY-MM-DD format")
+            return
+        if importlib.util.find_spec("pyarrow") is None:
+            messagebox.showerror("Error", "Parquet export requires pyarrow: pip install pyarrow")
+            return
+        directory = filedialog.askdirectory(title="Choose a folder for the Parquet export")
+        if directory:
+            directory = os.path.join(directory, f"attendance_{date.today().strftime('%Y_%m_%d')}")
+            self.run_export("Exporting Parquet", directory, write_columnar, 'parquet',
+                            start, end, department)
+
+    def submit_report(self, title, report, filename, *args):
+        """Render a report in a worker process and list it under Report Jobs"""
+        job = self.report_jobs.submit(title, report, filename, *args)
+        self.status_bar.config(text=f"{title} queued")
+        return job
+
+    def report_job_changed(self, job):
+        """Show a job's progress; called on the Tk thread"""
+        state = "Done (cached)" if job.cached else job.state.capitalize()
+        values = (job.title, state, job.pages, job.filename)
+        if self.jobs_tree.exists(job.id):
+            self.jobs_tree.item(job.id, values=values)
+        else:
+            self.jobs_tree.insert('', 'end', iid=job.id, values=values)
+        if job.state == 'running':
+            self.status_bar.config(text=f"{job.title}: page {job.pages}")
+        elif job.state == 'done':
+            self.status_bar.config(text=f"{job.title} saved to {job.filename}")
+            messagebox.showinfo("Success", f"{job.title} exported successfully to:\n{job.filename}")
+        elif job.state == 'failed':
+            self.status_bar.config(text=f"{job.title} failed")
+            messagebox.showerror("Error", f"Failed to export {job.title}: {job.error}")
+        elif job.state == 'cancelled':
+            self.status_bar.config(text=f"{job.title} cancelled")
+
+    def cancel_report_job(self):
+        for item in self.jobs_tree.selection():
+            job = next((job for job in self.report_jobs.jobs if str(job.id) == item), None)
+            if job is not None:
+                self.report_jobs.cancel(job)
+
+    def clear_report_jobs(self):
+        self.report_jobs.clear_finished()
+        remaining = {str(job.id) for job in self.report_jobs.jobs}
+        self.jobs_tree.delete(*[item for item in self.jobs_tree.get_children() if item not in remaining])
+
+    def export_filters(self):
+        """Return the (start, end, department) export filters, validating the dates"""
+        start = self.export_start_var.get().strip() or None
+        end = self.export_end_var.get().strip() or None
+        for value in (start, end):
+            if value:
+                datetime.strptime(value, '%Y-%m-%d')
+        department = self.export_dept_var.get()
+        return start, end, None if department in ('', 'All') else department
+
+    def run_export(self, label, filename, target, *args, cache_key=None):
+        """Run target(db, filename, *args) in the background, showing its progress in the status bar.
+
+        With a cache_key the finished file is added to the report cache.
+        """
+        if self.export_job is not None and self.export_job.running():
+            messagebox.showwarning("Export", "An export is already running")
+            return
+
+        def on_progress(done, total, elapsed):
+            text = progress_text(label, done, total, elapsed)
+            self.root.after(0, lambda: self.status_bar.config(text=text))
+
+        def on_done(result, error):
+            if error is None and cache_key is not None:
+                try:
+                    self.report_cache.put(cache_key, filename)
+                except Exception as e:
+                    print(f"Report cache error: {e}")
+            self.root.after(0, lambda: self.export_finished(label, filename, result, error))
+
+        self.cancel_export_button.config(state=tk.NORMAL)
+        self.status_bar.config(text=f"{label}...")
+        self.export_job = ExportJob(target, self.db, filename, *args,
+                                    on_progress=on_progress, on_done=on_done).start()
+
+    def export_finished(self, label, filename, result, error):
+        self.export_job = None
+        self.cancel_export_button.config(state=tk.DISABLED)
+        if isinstance(error, ExportCancelled):
+            self.status_bar.config(text=f"{label} cancelled")
+        elif error is not None:
+            self.status_bar.config(text=f"{label} failed")
+            messagebox.showerror("Error", f"Failed to export: {error}")
+        else:
+            self.status_bar.config(text=f"{label}: {result:,} rows written")
+            messagebox.showinfo("Success", f"{result:,} rows exported successfully to:\n{filename}")
+
+    def cancel_export(self):
+        if self.export_job is not None:
+            self.export_job.cancel()
+
+    def on_close(self):
+        """Hide the window and shut down in the background; the window is destroyed afterwards"""
+        if self.closing:
+            return
+        self.closing = True
+        self.root.withdraw()
+        # The threads shut down here pass results to Tk until they
+        # finish, so the Tk thread keeps running its event loop meanwhile
+        threading.Thread(target=self.shutdown, name="shutdown").start()
+
+    def shutdown(self):
+        """Stop scanning, exports and report workers, then close the journal and the database"""
+        try:
+            if self.scan_pipeline is not None:
+                # Matches already captured are still recorded
+                self.scan_pipeline.stop(wait=True)
+            if self.scan_client is not None:
+                self.scan_client.close()
+            if self.export_job is not None:
+                self.export_job.cancel()
+                self.export_job.join()
+            self.report_scheduler.stop()
+            self.report_jobs.shutdown()
+            if self.journal is not None:
+                self.journal.close()
+            self.db.close()
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to export CSV: {str(e)}")
+            print(f"Shutdown error: {e}")
+        self.root.after(0, self.root.destroy)
 
 # Add this method to complete the class if needed
 def main():
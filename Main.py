@@ -1,18 +1,38 @@
+import importlib.util
+import os
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-import sqlite3
-import csv
-from datetime import datetime, date, timedelta
+from datetime import datetime, date
 import threading
-import time
-import serial
-from adafruit_fingerprint import Adafruit_Fingerprint
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.units import inch
 from tkcalendar import DateEntry  # You may need to install: pip install tkcalendar
+from attendance import TodayAttendance
+from cache import UserCache
+from database import Database
+from events import ATTENDANCE_CHANGES, CHECK_IN, CHECK_OUT, UNKNOWN, EventBus, record_attendance
+from export import ExportCancelled, ExportJob, progress_text, write_columnar, write_csv
+from journal import ScanJournal
+from migrations import migrate
+from report_cache import ReportCache
+from reports import ReportJobs, ReportScheduler, daily_report, datewise_report
+from scan_daemon import ScanClient, daemon_running
+from scanner import ScanPipeline
+from sensor import MAX_FINGER_ID, copy_template, open_readers, reader_status
+from stats import LiveStatistics
+from treeview import TreeUpdater
+from virtualtable import KeysetSource, VirtualTable
+
+# Columns of the CSV export: (heading, SQL expression over users u / attendance a)
+CSV_COLUMNS = [('Name', 'u.name'), ('Department', 'u.department'), ('Date', 'a.date'),
+               ('Check-in Time', 'a.check_in_time'), ('Check-out Time', 'a.check_out_time'),
+               ('Status', 'a.status')]
+
+# Report cache name of this CSV export, which has no Hours Worked column
+CSV_CACHE_NAME = 'csv_without_hours'
+
+# Users tab rows; sortable columns must not be NULL for keyset pagination
+USERS_QUERY = """SELECT finger_id, name, COALESCE(age, '') AS age, COALESCE(department, '') AS department
+                 FROM users"""
+
 
 class FingerprintAttendanceGUI:
     def __init__(self, root):
@@ -24,42 +44,66 @@ class FingerprintAttendanceGUI:
         # Initialize sensor variables
         self.uart = None
         self.finger = None
+        self.scan_fingers = {}
         self.sensor_connected = False
+        self.scan_client = None
        
         # Initialize database
+        self.db = Database()
         self.init_db()
        
+        # Keep registered users in memory for the scan path
+        self.user_cache = UserCache(self.db)
+        self.user_cache.load()
+        self.sensor_status = "Ready"
+       
+        # Today's check-in/check-out state, rebuilt from the database
+        self.today_attendance = TodayAttendance(self.db)
+        self.today_attendance.load()
+       
+        # Scan outcomes are published as attendance events, which the
+        # tables and statistics apply to what they show
+        self.events = EventBus()
+        self.live_stats = LiveStatistics(self.db)
+        self.datewise_stats = None
+       
         # Create GUI first
         self.create_widgets()
+        for handler, kinds in ((self.show_attendance_event, None),
+                               (self.apply_recent_attendance, ATTENDANCE_CHANGES),
+                               (self.apply_statistics, ATTENDANCE_CHANGES),
+                               (self.apply_datewise_attendance, ATTENDANCE_CHANGES)):
+            self.events.subscribe(lambda event, handler=handler: self.root.after(0, handler, event), kinds)
        
         # Initialize fingerprint sensor in background
         self.init_sensor_background()
        
-        # Start attendance scanning thread
+        # Attendance scan pipeline, started from the attendance tab
         self.scanning = False
-        self.scan_thread = None
+        self.scan_pipeline = None
+       
+        # Matches are journaled before they are recorded, so a failed
+        # database write does not lose them; opened with the first
+        # pipeline, as the scanning daemon uses the same file
+        self.journal = None
+       
+        # Background export in progress, if any
+        self.export_job = None
+       
+        # PDF reports are rendered by worker processes and cached; the
+        # end-of-shift reports are pre-rendered while nothing else runs
+        self.report_cache = ReportCache(self.db)
+        self.report_jobs = ReportJobs(self.db.path, cache=self.report_cache,
+                                      on_change=lambda job: self.root.after(0, self.report_job_changed, job))
+        self.report_scheduler = ReportScheduler(self.report_jobs, (daily_report, datewise_report),
+                                                idle=lambda: self.export_job is None).start()
+        self.closing = False
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
        
     def init_db(self):
-        """Initialize database tables"""
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS users (
-            finger_id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL,
-            age INTEGER,
-            department TEXT)''')
-
-        c.execute('''CREATE TABLE IF NOT EXISTS attendance (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            finger_id INTEGER,
-            name TEXT,
-            department TEXT,
-            check_in_time TIMESTAMP,
-            check_out_time TIMESTAMP,
-            date DATE,
-            status TEXT DEFAULT 'present')''')
-        conn.commit()
-        conn.close()
+        """Initialize database tables and apply pending schema migrations"""
+        with self.db.transaction() as c:
+            migrate(c)
    
     def create_widgets(self):
         """Create main GUI widgets"""
@@ -99,7 +143,7 @@ class FingerprintAttendanceGUI:
         fields_frame = tk.Frame(form_frame, bg='white')
         fields_frame.pack(pady=10)
        
-        tk.Label(fields_frame, text="Fingerprint ID (0-127):", bg='white').grid(row=0, column=0, sticky='e', padx=5, pady=5)
+        tk.Label(fields_frame, text=f"Fingerprint ID (0-{MAX_FINGER_ID}):", bg='white').grid(row=0, column=0, sticky='e', padx=5, pady=5)
         self.fid_entry = tk.Entry(fields_frame, width=20)
         self.fid_entry.grid(row=0, column=1, padx=5, pady=5)
        
@@ -163,6 +207,7 @@ class FingerprintAttendanceGUI:
         self.recent_tree.heading('Check-out', text='Check-out Time')
         self.recent_tree.heading('Status', text='Status')
         self.recent_tree.pack(pady=10, padx=10, fill='both', expand=True)
+        self.recent_updater = TreeUpdater(self.recent_tree)
        
         # Refresh button
         refresh_button = tk.Button(recent_frame, text="Refresh", command=self.refresh_recent_attendance,
@@ -236,31 +281,12 @@ class FingerprintAttendanceGUI:
         self.datewise_summary = tk.Label(display_frame, text="", bg='white', font=("Arial", 11))
         self.datewise_summary.pack(pady=5)
         
-        # Treeview for date-wise attendance
-        self.datewise_tree = ttk.Treeview(display_frame, columns=('Name', 'Department', 'Date', 'Check-in', 'Check-out', 'Status', 'Hours'), show='headings')
-        self.datewise_tree.heading('Name', text='Name')
-        self.datewise_tree.heading('Department', text='Department')
-        self.datewise_tree.heading('Date', text='Date')
-        self.datewise_tree.heading('Check-in', text='Check-in Time')
-        self.datewise_tree.heading('Check-out', text='Check-out Time')
-        self.datewise_tree.heading('Status', text='Status')
-        self.datewise_tree.heading('Hours', text='Hours Worked')
-        
-        # Configure column widths
-        self.datewise_tree.column('Name', width=120)
-        self.datewise_tree.column('Department', width=100)
-        self.datewise_tree.column('Date', width=80)
-        self.datewise_tree.column('Check-in', width=80)
-        self.datewise_tree.column('Check-out', width=80)
-        self.datewise_tree.column('Status', width=80)
-        self.datewise_tree.column('Hours', width=80)
-        
-        # Add scrollbar
-        scrollbar = ttk.Scrollbar(display_frame, orient=tk.VERTICAL, command=self.datewise_tree.yview)
-        self.datewise_tree.configure(yscrollcommand=scrollbar.set)
-        
-        self.datewise_tree.pack(side=tk.LEFT, pady=10, padx=10, fill='both', expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        # Date-wise attendance table; only the visible rows are loaded
+        self.datewise_table = VirtualTable(display_frame, [
+            ('name', 'Name', 120), ('department', 'Department', 100), ('date', 'Date', 80),
+            ('check_in', 'Check-in Time', 80), ('check_out', 'Check-out Time', 80),
+            ('status', 'Status', 80), ('hours', 'Hours Worked', 80)], bg='white')
+        self.datewise_table.pack(pady=10, padx=10, fill='both', expand=True)
         
         # Load department options
         self.load_department_options()
@@ -271,111 +297,77 @@ class FingerprintAttendanceGUI:
 
     def load_department_options(self):
         """Load department options for filter"""
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("SELECT DISTINCT department FROM users WHERE department IS NOT NULL ORDER BY department")
-        departments = [row[0] for row in c.fetchall()]
-        conn.close()
+        departments = [row[0] for row in self.db.query(
+            "SELECT DISTINCT department FROM users WHERE department IS NOT NULL ORDER BY department")]
         
         self.dept_filter_combo['values'] = ['All'] + departments
         self.dept_filter_combo.set('All')
 
     def filter_datewise_attendance(self):
         """Filter and display date-wise attendance"""
-        # Clear existing items
-        for item in self.datewise_tree.get_children():
-            self.datewise_tree.delete(item)
-        
         selected_date = self.date_entry.get_date().strftime('%Y-%m-%d')
         selected_dept = self.dept_filter_var.get()
         selected_status = self.status_filter_var.get()
         
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        
-        # Build query based on filters
+        # One row per user with the attendance of the selected date
         query = """
-            SELECT u.name, u.department, a.date, a.check_in_time, a.check_out_time, a.status,
-                   CASE WHEN a.check_in_time IS NOT NULL AND a.check_out_time IS NOT NULL
-                       THEN printf('%.2f', (julianday(a.check_out_time) - julianday(a.check_in_time)) * 24)
-                       ELSE 'N/A' END as hours_worked,
-                   CASE WHEN a.finger_id IS NULL THEN 'Absent' ELSE COALESCE(a.status, 'Present') END as display_status
+            SELECT u.finger_id, u.name, COALESCE(u.department, 'N/A') AS department, ? AS date,
+                   COALESCE(substr(a.check_in_time, 12, 5), 'N/A') AS check_in,
+                   COALESCE(substr(a.check_out_time, 12, 5), 'N/A') AS check_out,
+                   CASE WHEN a.id IS NULL THEN 'Absent'
+                        WHEN a.status = 'completed' THEN 'Completed'
+                        WHEN a.status = 'checked_in' THEN 'Checked In'
+                        ELSE a.status END AS status,
+                   CASE WHEN a.worked_seconds IS NOT NULL
+                       THEN printf('%.2f', a.worked_seconds / 3600.0)
+                       ELSE 'N/A' END AS hours
             FROM users u
             LEFT JOIN attendance a ON u.finger_id = a.finger_id AND a.date = ?
         """
-        params = [selected_date]
+        params = [selected_date, selected_date]
         
         # Add department filter
         if selected_dept != 'All':
             query += " WHERE u.department = ?"
             params.append(selected_dept)
         
-        query += " ORDER BY u.name"
+        # Count statistics over every user of the department
+        self.datewise_stats = LiveStatistics(self.db, None if selected_dept == 'All' else selected_dept)
+        self.datewise_stats.load(self.date_entry.get_date())
         
-        c.execute(query, params)
-        rows = c.fetchall()
+        # Apply status filter
+        if selected_status == 'Present':
+            query = f"SELECT * FROM ({query}) WHERE status != 'Absent'"
+        elif selected_status != 'All':
+            query = f"SELECT * FROM ({query}) WHERE status = ?"
+            params.append(selected_status)
         
-        # Count statistics
-        present_count = 0
-        absent_count = 0
-        completed_count = 0
-        checked_in_count = 0
+        self.datewise_table.set_source(KeysetSource(
+            self.db, query, params,
+            columns=('name', 'department', 'date', 'check_in', 'check_out', 'status', 'hours'),
+            key='finger_id', sort='name'))
         
-        # Add to treeview and count statistics
-        for row in rows:
-            name, dept, date_val, check_in, check_out, status, hours, display_status = row
-            
-            # Format display values
-            check_in_display = check_in.split()[1][:5] if check_in else "N/A"
-            check_out_display = check_out.split()[1][:5] if check_out else "N/A"
-            
-            # Determine final status for display
-            if status == 'completed':
-                final_status = 'Completed'
-                completed_count += 1
-                present_count += 1
-            elif status == 'checked_in':
-                final_status = 'Checked In'
-                checked_in_count += 1
-                present_count += 1
-            elif status is None:
-                final_status = 'Absent'
-                absent_count += 1
-            else:
-                final_status = status
-                present_count += 1
-            
-            # Apply status filter
-            if selected_status != 'All':
-                if selected_status == 'Present' and final_status == 'Absent':
-                    continue
-                elif selected_status == 'Absent' and final_status != 'Absent':
-                    continue
-                elif selected_status == 'Checked In' and final_status != 'Checked In':
-                    continue
-                elif selected_status == 'Completed' and final_status != 'Completed':
-                    continue
-            
-            # Add to treeview
-            item_id = self.datewise_tree.insert('', 'end', values=(
-                name, dept or 'N/A', selected_date, check_in_display, check_out_display, final_status, hours
-            ))
-            
-            # Color code based on status
-            if final_status == 'Absent':
-                self.datewise_tree.set(item_id, 'Status', 'Absent')
-            elif final_status == 'Completed':
-                self.datewise_tree.set(item_id, 'Status', 'Completed')
-            elif final_status == 'Checked In':
-                self.datewise_tree.set(item_id, 'Status', 'Checked In')
-        
-        conn.close()
-        
-        # Update summary
-        total_users = len(rows)
-        summary_text = f"Date: {selected_date} | Total Users: {total_users} | Present: {present_count} | Absent: {absent_count} | Completed: {completed_count} | Checked In Only: {checked_in_count}"
+        self.show_datewise_summary()
+
+    def show_datewise_summary(self):
+        """Show the date-wise figures above the table"""
+        stats = self.datewise_stats.stats
+        summary_text = f"Date: {stats.day.strftime('%Y-%m-%d')} | Total Users: {stats.total_users} | Present: {stats.present} | Absent: {stats.absent} | Completed: {stats.completed} | Checked In Only: {stats.checked_in}"
         self.datewise_summary.config(text=summary_text)
 
+    def apply_datewise_attendance(self, event):
+        """Apply a check-in or check-out to the date-wise tab; called on the Tk thread"""
+        if self.datewise_stats is None or not self.datewise_stats.apply(event):
+            # Another date is selected, or a department added since
+            return
+        self.show_datewise_summary()
+        worked = event.worked_seconds
+        self.datewise_table.patch(event.finger_id, {
+            'check_in': event.check_in[11:16],
+            'check_out': event.check_out[11:16] if event.check_out else 'N/A',
+            'status': 'Completed' if event.status == 'completed' else 'Checked In',
+            'hours': f"{worked / 3600.0:.2f}" if worked is not None else 'N/A'})
+
     def clear_datewise_filter(self):
         """Clear date-wise filters"""
         self.date_entry.set_date(date.today())
@@ -389,129 +381,15 @@ class FingerprintAttendanceGUI:
         selected_dept = self.dept_filter_var.get()
         selected_status = self.status_filter_var.get()
         
-        try:
-            filename = filedialog.asksaveasfilename(
-                defaultextension=".pdf",
-                filetypes=[("PDF files", "*.pdf"), ("All files", "*.*")],
-                initialname=f"attendance_report_{selected_date}.pdf"
-            )
-            
-            if filename:
-                self.generate_datewise_pdf_report(filename, selected_date, selected_dept, selected_status)
-                messagebox.showinfo("Success", f"Date-wise report exported successfully to:\n{filename}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to export date-wise report: {str(e)}")
-
-    def generate_datewise_pdf_report(self, filename, selected_date, selected_dept, selected_status):
-        """Generate PDF report for date-wise attendance"""
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        
-        # Get filtered data
-        query = """
-            SELECT u.name, u.department, a.date, a.check_in_time, a.check_out_time, a.status,
-                   CASE WHEN a.check_in_time IS NOT NULL AND a.check_out_time IS NOT NULL
-                       THEN printf('%.2f', (julianday(a.check_out_time) - julianday(a.check_in_time)) * 24)
-                       ELSE 'N/A' END as hours_worked,
-                   CASE WHEN a.finger_id IS NULL THEN 'Absent' ELSE COALESCE(a.status, 'Present') END as display_status
-            FROM users u
-            LEFT JOIN attendance a ON u.finger_id = a.finger_id AND a.date = ?
-        """
-        params = [selected_date]
-        
-        if selected_dept != 'All':
-            query += " WHERE u.department = ?"
-            params.append(selected_dept)
-        
-        query += " ORDER BY u.name"
-        
-        c.execute(query, params)
-        rows = c.fetchall()
-        conn.close()
-        
-        # Create PDF
-        doc = SimpleDocTemplate(filename, pagesize=A4)
-        story = []
-        styles = getSampleStyleSheet()
-        
-        # Title
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=18,
-            spaceAfter=30,
-            alignment=1,
-            textColor=colors.darkblue
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".pdf",
+            filetypes=[("PDF files", "*.pdf"), ("All files", "*.*")],
+            initialfile=f"attendance_report_{selected_date}.pdf"
         )
         
-        story.append(Paragraph("Date-wise Attendance Report", title_style))
-        story.append(Paragraph(f"Date: {selected_date}", styles['Normal']))
-        story.append(Paragraph(f"Department Filter: {selected_dept}", styles['Normal']))
-        story.append(Paragraph(f"Status Filter: {selected_status}", styles['Normal']))
-        story.append(Paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['Normal']))
-        story.append(Spacer(1, 20))
-        
-        # Statistics
-        present_count = sum(1 for row in rows if row[7] != 'Absent')
-        absent_count = sum(1 for row in rows if row[7] == 'Absent')
-        completed_count = sum(1 for row in rows if row[5] == 'completed')
-        checked_in_count = sum(1 for row in rows if row[5] == 'checked_in')
-        
-        stats_data = [
-            ['Metric', 'Count'],
-            ['Total Users', str(len(rows))],
-            ['Present', str(present_count)],
-            ['Absent', str(absent_count)],
-            ['Completed (Check-in + Check-out)', str(completed_count)],
-            ['Checked In Only', str(checked_in_count)]
-        ]
-        
-        stats_table = Table(stats_data)
-        stats_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        story.append(stats_table)
-        story.append(Spacer(1, 20))
-        
-        # Detailed attendance table
-        story.append(Paragraph("Detailed Attendance Records", styles['Heading2']))
-        
-        table_data = [['Name', 'Department', 'Check-in', 'Check-out', 'Status', 'Hours']]
-        
-        for row in rows:
-            name, dept, date_val, check_in, check_out, status, hours, display_status = row
-            
-            check_in_display = check_in.split()[1][:5] if check_in else "N/A"
-            check_out_display = check_out.split()[1][:5] if check_out else "N/A"
-            
-            final_status = 'Completed' if status == 'completed' else 'Checked In' if status == 'checked_in' else 'Absent' if status is None else status
-            
-            table_data.append([
-                name, dept or 'N/A', check_in_display, check_out_display, final_status, hours
-            ])
-        
-        detail_table = Table(table_data)
-        detail_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTSIZE', (0, 1), (-1, -1), 8)
-        ]))
-        story.append(detail_table)
-        
-        doc.build(story)
+        if filename:
+            self.submit_report(f"Date-wise report {selected_date}", datewise_report, filename,
+                               selected_date, selected_dept, selected_status)
        
     def create_reports_tab(self):
         """Create reports tab"""
@@ -528,6 +406,22 @@ class FingerprintAttendanceGUI:
         # Stats display
         self.stats_text = tk.Text(stats_frame, height=12, width=80, bg='#f9f9f9')
         self.stats_text.pack(pady=10)
+
+        # Export filters; empty dates export the whole history
+        export_filters = tk.Frame(stats_frame, bg='white')
+        export_filters.pack(pady=5)
+        tk.Label(export_filters, text="From (YYYY-MM-DD):", bg='white').pack(side=tk.LEFT, padx=5)
+        self.export_start_var = tk.StringVar()
+        tk.Entry(export_filters, textvariable=self.export_start_var, width=12).pack(side=tk.LEFT)
+        tk.Label(export_filters, text="To:", bg='white').pack(side=tk.LEFT, padx=5)
+        self.export_end_var = tk.StringVar()
+        tk.Entry(export_filters, textvariable=self.export_end_var, width=12).pack(side=tk.LEFT)
+        tk.Label(export_filters, text="Department:", bg='white').pack(side=tk.LEFT, padx=5)
+        self.export_dept_var = tk.StringVar(value='All')
+        self.export_dept_combo = ttk.Combobox(export_filters, textvariable=self.export_dept_var, width=15)
+        self.export_dept_combo['values'] = ['All'] + [row[0] for row in self.db.query(
+            "SELECT DISTINCT department FROM users WHERE department IS NOT NULL ORDER BY department")]
+        self.export_dept_combo.pack(side=tk.LEFT)
        
         # Buttons frame
         buttons_frame = tk.Frame(stats_frame, bg='white')
@@ -549,17 +443,64 @@ class FingerprintAttendanceGUI:
                                      bg='#FF9800', fg='white', font=("Arial", 10, "bold"))
         export_csv_button.pack(side=tk.LEFT, padx=5)
        
+        export_parquet_button = tk.Button(buttons_frame, text="Export to Parquet",
+                                         command=self.export_parquet,
+                                         bg='#9C27B0', fg='white', font=("Arial", 10, "bold"))
+        export_parquet_button.pack(side=tk.LEFT, padx=5)
+       
+        self.cancel_export_button = tk.Button(buttons_frame, text="Cancel Export",
+                                              command=self.cancel_export, state=tk.DISABLED,
+                                              bg='#f44336', fg='white', font=("Arial", 10, "bold"))
+        self.cancel_export_button.pack(side=tk.LEFT, padx=5)
+
+        # Report jobs rendered in the background
+        jobs_frame = tk.Frame(reports_frame, bg='white', relief=tk.RAISED, bd=2)
+        jobs_frame.pack(pady=10, padx=20, fill='both', expand=True)
+       
+        tk.Label(jobs_frame, text="Report Jobs", font=("Arial", 14, "bold"),
+                bg='white').pack(pady=5)
+       
+        self.jobs_tree = ttk.Treeview(jobs_frame, columns=('Report', 'Status', 'Pages', 'File'),
+                                      show='headings', height=4)
+        for column, width in (('Report', 200), ('Status', 100), ('Pages', 60), ('File', 400)):
+            self.jobs_tree.heading(column, text=column)
+            self.jobs_tree.column(column, width=width)
+        self.jobs_tree.pack(padx=10, fill='both', expand=True)
+       
+        jobs_buttons = tk.Frame(jobs_frame, bg='white')
+        jobs_buttons.pack(pady=5)
+        tk.Button(jobs_buttons, text="Cancel Job", command=self.cancel_report_job,
+                 bg='#f44336', fg='white', font=("Arial", 10, "bold")).pack(side=tk.LEFT, padx=5)
+        tk.Button(jobs_buttons, text="Clear Finished", command=self.clear_report_jobs,
+                 bg='#9E9E9E', fg='white', font=("Arial", 10, "bold")).pack(side=tk.LEFT, padx=5)
+       
+        # Load statistics; scans then update them as they happen
+        self.refresh_statistics()
+       
     def init_sensor_background(self):
         """Initialize fingerprint sensor in background thread"""
+        # A scanning daemon owns the sensor when one is running
+        if daemon_running():
+            self.sensor_status = "Connecting to scanning daemon..."
+            self.status_bar.config(text=self.sensor_status)
+            self.scan_client = ScanClient(self.daemon_event).start()
+            return
         def init_sensor():
             try:
-                self.uart = serial.Serial("/dev/serial0", baudrate=57600, timeout=1)
-                self.finger = Adafruit_Fingerprint(self.uart)
+                readers = open_readers(db=self.db)
+                connected = [reader for reader in readers if reader.finger is not None]
+                if not connected:
+                    raise readers[0].error
+                # Every reader scans; fingers are enrolled on the first
+                self.uart, self.finger = connected[0].uart, connected[0].finger
+                self.scan_fingers = {reader.name: reader.finger for reader in connected}
                 self.sensor_connected = True
-                self.root.after(0, lambda: self.status_bar.config(text="Fingerprint sensor connected"))
+                self.sensor_status = reader_status(readers)
+                self.root.after(0, lambda: self.status_bar.config(text=self.sensor_status))
             except Exception as e:
                 self.sensor_connected = False
-                self.root.after(0, lambda: self.status_bar.config(text=f"Sensor not connected: {e}"))
+                self.sensor_status = f"Sensor not connected: {e}"
+                self.root.after(0, lambda: self.status_bar.config(text=self.sensor_status))
                 self.root.after(0, lambda: messagebox.showwarning("Sensor Warning",
                     f"Fingerprint sensor not connected: {e}\nYou can still use the GUI to view data."))
        
@@ -580,13 +521,15 @@ class FingerprintAttendanceGUI:
         tk.Label(list_frame, text="Registered Users", font=("Arial", 16, "bold"),
                 bg='white').pack(pady=10)
        
-        # Treeview for users
-        self.users_tree = ttk.Treeview(list_frame, columns=('ID', 'Name', 'Age', 'Department'), show='headings')
-        self.users_tree.heading('ID', text='Fingerprint ID')
-        self.users_tree.heading('Name', text='Name')
-        self.users_tree.heading('Age', text='Age')
-        self.users_tree.heading('Department', text='Department')
-        self.users_tree.pack(pady=10, padx=10, fill='both', expand=True)
+        # Users table; only the visible rows are loaded
+        self.users_table = VirtualTable(list_frame, [
+            ('finger_id', 'Fingerprint ID', None), ('name', 'Name', None),
+            ('age', 'Age', None), ('department', 'Department', None)], bg='white')
+        self.users_table.pack(pady=10, padx=10, fill='both', expand=True)
+        self.users_tree = self.users_table.tree
+        self.users_table.set_source(KeysetSource(
+            self.db, USERS_QUERY, columns=('finger_id', 'name', 'age', 'department'),
+            key='finger_id', sort='name'))
        
         # Buttons frame
         users_buttons_frame = tk.Frame(list_frame, bg='white')
@@ -615,18 +558,7 @@ class FingerprintAttendanceGUI:
    
     def refresh_users(self):
         """Refresh users list"""
-        # Clear existing items
-        for item in self.users_tree.get_children():
-            self.users_tree.delete(item)
-       
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("SELECT finger_id, name, age, department FROM users ORDER BY name")
-        users = c.fetchall()
-        conn.close()
-       
-        for user in users:
-            self.users_tree.insert('', 'end', values=user)
+        self.users_table.refresh()
    
     def delete_user(self):
         """Delete selected user"""
@@ -640,12 +572,20 @@ class FingerprintAttendanceGUI:
         name = user_data[1]
        
         if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete user '{name}'?\nThis will also delete all their attendance records."):
-            conn = sqlite3.connect("users.db")
-            c = conn.cursor()
-            c.execute("DELETE FROM users WHERE finger_id = ?", (finger_id,))
-            c.execute("DELETE FROM attendance WHERE finger_id = ?", (finger_id,))
-            conn.commit()
-            conn.close()
+            def delete(c):
+                c.execute("DELETE FROM users WHERE finger_id = ?", (finger_id,))
+                c.execute("DELETE FROM attendance WHERE finger_id = ?", (finger_id,))
+                c.execute("DELETE FROM templates WHERE finger_id = ?", (finger_id,))
+           
+            self.db.write(delete)
+            # Host-side matching keeps the templates in memory as well
+            matcher = getattr(self.finger, "matcher", None)
+            if matcher is not None:
+                matcher.remove(finger_id)
+            self.user_cache.remove(finger_id)
+            self.today_attendance.forget(finger_id)
+            if self.scan_client is not None:
+                self.scan_client.send('user_changed', finger_id=finger_id)
            
             messagebox.showinfo("Success", f"User '{name}' has been deleted")
             self.refresh_users()
@@ -707,12 +647,11 @@ class FingerprintAttendanceGUI:
                 messagebox.showerror("Error", "Age must be a valid number")
                 return
            
-            conn = sqlite3.connect("users.db")
-            c = conn.cursor()
-            c.execute("UPDATE users SET name = ?, age = ?, department = ? WHERE finger_id = ?",
-                     (new_name, new_age, new_dept, finger_id))
-            conn.commit()
-            conn.close()
+            self.db.execute("UPDATE users SET name = ?, age = ?, department = ? WHERE finger_id = ?",
+                            (new_name, new_age, new_dept, finger_id))
+            self.user_cache.put(finger_id, new_name, new_age, new_dept)
+            if self.scan_client is not None:
+                self.scan_client.send('user_changed', finger_id=finger_id)
            
             messagebox.showinfo("Success", "User details updated successfully")
             edit_window.destroy()
@@ -747,8 +686,8 @@ class FingerprintAttendanceGUI:
        
         try:
             finger_id = int(finger_id)
-            if finger_id < 0 or finger_id > 127:
-                messagebox.showerror("Error", "Fingerprint ID must be between 0 and 127")
+            if finger_id < 0 or finger_id > MAX_FINGER_ID:
+                messagebox.showerror("Error", f"Fingerprint ID must be between 0 and {MAX_FINGER_ID}")
                 return
         except ValueError:
             messagebox.showerror("Error", "Fingerprint ID must be a valid number")
@@ -761,16 +700,20 @@ class FingerprintAttendanceGUI:
             return
        
         # Check if finger ID already exists
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("SELECT name FROM users WHERE finger_id = ?", (finger_id,))
-        existing_user = c.fetchone()
-        conn.close()
+        existing_user = self.db.query_one("SELECT name FROM users WHERE finger_id = ?", (finger_id,))
        
         if existing_user:
             messagebox.showerror("Error", f"Fingerprint ID {finger_id} is already registered to {existing_user[0]}")
             return
        
+        if self.scan_client is not None:
+            # The daemon owns the sensor: it enrolls the finger and adds the user
+            self.reg_status.config(text="Place finger on sensor...", fg='blue')
+            if not self.scan_client.send('enroll', finger_id=finger_id, name=name, age=age,
+                                         department=department):
+                self.reg_status.config(text="Scanning daemon not reachable", fg='red')
+            return
+       
         # Start fingerprint enrollment
         self.reg_status.config(text="Place finger on sensor...", fg='blue')
         self.root.update()
@@ -779,13 +722,13 @@ class FingerprintAttendanceGUI:
             try:
                 # Enroll fingerprint
                 if self.finger.enroll_finger(finger_id):
+                    # The other readers search their own libraries
+                    copy_template(self.finger, [finger for finger in self.scan_fingers.values()
+                                                if finger is not self.finger], finger_id)
                     # Save to database
-                    conn = sqlite3.connect("users.db")
-                    c = conn.cursor()
-                    c.execute("INSERT INTO users (finger_id, name, age, department) VALUES (?, ?, ?, ?)",
-                             (finger_id, name, age, department))
-                    conn.commit()
-                    conn.close()
+                    self.db.execute("INSERT INTO users (finger_id, name, age, department) VALUES (?, ?, ?, ?)",
+                                    (finger_id, name, age, department))
+                    self.user_cache.put(finger_id, name, age, department)
                    
                     self.root.after(0, lambda: self.reg_status.config(text="User registered successfully!", fg='green'))
                     self.root.after(0, self.clear_registration_form)
@@ -813,6 +756,12 @@ class FingerprintAttendanceGUI:
             messagebox.showerror("Error", "Fingerprint sensor not connected")
             return
        
+        if self.scan_client is not None:
+            # The daemon scans; the button follows its status events
+            if not self.scan_client.send('stop' if self.scanning else 'start'):
+                messagebox.showerror("Error", "Scanning daemon not reachable")
+            return
+       
         if not self.scanning:
             self.scanning = True
             self.scan_button.config(text="Stop Scanning", bg='#f44336')
@@ -820,318 +769,369 @@ class FingerprintAttendanceGUI:
             self.start_scanning_thread()
         else:
             self.scanning = False
+            self.scan_pipeline.stop()
             self.scan_button.config(text="Start Scanning", bg='#2196F3')
             self.att_status.config(text="Scanning stopped", fg='black')
    
     def start_scanning_thread(self):
-        """Start fingerprint scanning in separate thread"""
-        def scan_loop():
-            while self.scanning:
-                try:
-                    if self.finger.get_image() == 0:  # Finger detected
-                        if self.finger.image_2_tz(1) == 0:  # Convert image
-                            if self.finger.finger_search() == 0:  # Search for match
-                                finger_id = self.finger.finger_id
-                                confidence = self.finger.confidence
-                               
-                                # Get user info
-                                conn = sqlite3.connect("users.db")
-                                c = conn.cursor()
-                                c.execute("SELECT name, department FROM users WHERE finger_id = ?", (finger_id,))
-                                user_info = c.fetchone()
-                               
-                                if user_info:
-                                    name, department = user_info
-                                    current_time = datetime.now()
-                                    current_date = current_time.date()
-                                   
-                                    # Check if user already has attendance for today
-                                    c.execute("SELECT id, check_in_time, check_out_time, status FROM attendance WHERE finger_id = ? AND date = ?",
-                                             (finger_id, current_date))
-                                    existing_record = c.fetchone()
-                                   
-                                    if existing_record:
-                                        record_id, check_in_time, check_out_time, status = existing_record
-                                        if status == 'checked_in':
-                                            # Mark check-out
-                                            c.execute("UPDATE attendance SET check_out_time = ?, status = 'completed' WHERE id = ?",
-                                                     (current_time, record_id))
-                                            message = f"Check-out: {name} ({department})"
-                                            status_text = "Check-out recorded"
-                                        else:
-                                            message = f"Already completed: {name} ({department})"
-                                            status_text = "Already marked for today"
-                                    else:
-                                        # Mark check-in
-                                        c.execute("INSERT INTO attendance (finger_id, name, department, check_in_time, date, status) VALUES (?, ?, ?, ?, ?, ?)",
-                                                 (finger_id, name, department, current_time, current_date, 'checked_in'))
-                                        message = f"Check-in: {name} ({department})"
-                                        status_text = "Check-in recorded"
-                                   
-                                    conn.commit()
-                                    conn.close()
-                                   
-                                    self.root.after(0, lambda: self.att_status.config(text=status_text, fg='green'))
-                                    self.root.after(0, lambda: messagebox.showinfo("Attendance", message))
-                                    self.root.after(0, self.refresh_recent_attendance)
-                                   
-                                    # Brief pause after successful scan
-                                    time.sleep(3)
-                                else:
-                                    conn.close()
-                                    self.root.after(0, lambda: self.att_status.config(text="Fingerprint not registered", fg='red'))
-                            else:
-                                self.root.after(0, lambda: self.att_status.config(text="No match found", fg='orange'))
-                        else:
-                            self.root.after(0, lambda: self.att_status.config(text="Image processing failed", fg='red'))
-                   
-                    time.sleep(0.1)  # Small delay to prevent excessive CPU usage
-                except Exception as e:
-                    self.root.after(0, lambda: self.att_status.config(text=f"Scanning error: {str(e)}", fg='red'))
-                    time.sleep(1)
-       
-        self.scan_thread = threading.Thread(target=scan_loop)
-        self.scan_thread.daemon = True
-        self.scan_thread.start()
+        """Start the fingerprint scan pipeline in background threads"""
+        if not self.scanning or (self.scan_pipeline is not None and self.scan_pipeline.running):
+            return
+        if self.scan_pipeline is not None and not self.scan_pipeline.finished():
+            # A stopped pipeline is still recording from the journal; two
+            # at once would apply its entries twice
+            self.root.after(50, self.start_scanning_thread)
+            return
+        self.open_journal()
+        self.scan_pipeline = ScanPipeline(self.scan_fingers, self.record_scan, self.show_scan_result,
+                                          journal=self.journal)
+        self.scan_pipeline.start()
+   
+    def open_journal(self):
+        """Open the scan journal; scans are recorded without it if it cannot be opened"""
+        if self.journal is None:
+            try:
+                self.journal = ScanJournal()
+            except Exception as e:
+                print(f"Scan journal error: {e}")
+   
+    def record_scan(self, finger_id, confidence, reader=None, scanned_at=None):
+        """Record attendance for a matched fingerprint (pipeline record stage)"""
+        # Get user info from the in-memory cache
+        user_info = self.user_cache.get(finger_id)
+        if not user_info:
+            return None
+       
+        # Decide check-in/check-out from today's in-memory state
+        return record_attendance(self.today_attendance, user_info, reader, scanned_at)
+   
+    def show_scan_result(self, kind, data):
+        """Show the outcome of a scan (pipeline notify stage)"""
+        self.root.after(0, self.update_cache_status)
+       
+        if kind in ('recorded', 'unknown'):
+            self.events.publish_scan(kind, data)
+        elif kind == 'no_match':
+            self.root.after(0, lambda: self.att_status.config(text="No match found", fg='orange'))
+        elif kind == 'image_failed':
+            self.root.after(0, lambda: self.att_status.config(text="Image processing failed", fg='red'))
+        elif kind == 'error':
+            self.root.after(0, lambda: self.att_status.config(text=f"Scanning error: {str(data)}", fg='red'))
+   
+    def show_attendance_event(self, event):
+        """Show an attendance event on the attendance tab; called on the Tk thread"""
+        if event.kind == UNKNOWN:
+            self.att_status.config(text="Fingerprint not registered", fg='red')
+            return
+        if event.kind == CHECK_IN:
+            message = f"Check-in: {event.name} ({event.department})"
+            status_text = "Check-in recorded"
+        elif event.kind == CHECK_OUT:
+            message = f"Check-out: {event.name} ({event.department})"
+            status_text = "Check-out recorded"
+        else:
+            message = f"Already completed: {event.name} ({event.department})"
+            status_text = "Already marked for today"
+        self.att_status.config(text=status_text, fg='green')
+        messagebox.showinfo("Attendance", message)
+
+    def daemon_event(self, kind, data):
+        """Handle an event from the scanning daemon (scan client thread)"""
+        if kind == 'status':
+            self.root.after(0, self.show_daemon_status, data)
+        elif kind == 'enroll':
+            self.root.after(0, self.show_enroll_progress, data)
+        elif kind == 'disconnected':
+            self.sensor_connected = False
+            self.sensor_status = "Scanning daemon not reachable, reconnecting..."
+            self.root.after(0, lambda: self.status_bar.config(text=self.sensor_status))
+        else:
+            self.show_scan_result(kind, data)
+
+    def show_daemon_status(self, status):
+        """Follow the daemon's scanning state; called on the Tk thread"""
+        self.sensor_connected = status['sensor_ready']
+        self.scanning = status['scanning']
+        self.sensor_status = f"Scanning daemon: {status['sensor']}"
+        self.status_bar.config(text=self.sensor_status)
+        if self.scanning:
+            self.scan_button.config(text="Stop Scanning", bg='#f44336')
+            self.att_status.config(text="Scanning for fingerprints...", fg='blue')
+        else:
+            self.scan_button.config(text="Start Scanning", bg='#2196F3')
+            self.att_status.config(text="Sensor busy enrolling" if status['enrolling'] else "Scanning stopped",
+                                   fg='black')
+
+    def show_enroll_progress(self, event):
+        """Show the daemon's enrollment prompts; called on the Tk thread"""
+        if not event['done']:
+            self.reg_status.config(text=event['message'], fg='blue')
+        elif event['ok']:
+            self.reg_status.config(text=event['message'], fg='green')
+            self.clear_registration_form()
+            self.refresh_users()
+        else:
+            self.reg_status.config(text=event['message'], fg='red')
+
+    def update_cache_status(self):
+        """Show user cache hit/miss counters, and per-reader counts with several readers, in the status bar"""
+        text = f"{self.sensor_status} | {self.user_cache.summary()}"
+        if self.scan_pipeline is not None and len(self.scan_pipeline.readers) > 1:
+            text += f" | {self.scan_pipeline.summary()}"
+        self.status_bar.config(text=text)
    
     def refresh_recent_attendance(self):
         """Refresh recent attendance display"""
-        # Clear existing items
-        for item in self.recent_tree.get_children():
-            self.recent_tree.delete(item)
-       
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("""SELECT name, department, check_in_time, check_out_time, status
+        # Scans arriving within one frame share a single refresh
+        self.recent_updater.request(self.load_recent_attendance)
+   
+    def apply_recent_attendance(self, event):
+        """Show a check-in or check-out in the recent attendance display; called on the Tk thread"""
+        if event.date != date.today().strftime('%Y-%m-%d'):
+            return
+        # Newest check-in first, as loaded
+        self.recent_updater.put(event.record_id, (
+            event.name, event.department, event.check_in.split()[1][:5],
+            event.check_out.split()[1][:5] if event.check_out else "N/A",
+            "Completed" if event.status == "completed" else "Checked In"))
+   
+    def load_recent_attendance(self):
+        """Today's attendance rows for the recent attendance display"""
+        # The local date, as attendance rows and events use; SQLite's
+        # date('now') is the UTC one
+        records = self.db.query("""SELECT id, name, department, check_in_time, check_out_time, status
                     FROM attendance 
-                    WHERE date = date('now') 
-                    ORDER BY check_in_time DESC""")
-        records = c.fetchall()
-        conn.close()
+                    WHERE date = ? 
+                    ORDER BY check_in_time DESC""", (date.today().strftime('%Y-%m-%d'),))
        
+        rows = []
         for record in records:
-            name, department, check_in, check_out, status = record
+            record_id, name, department, check_in, check_out, status = record
             check_in_display = check_in.split()[1][:5] if check_in else "N/A"
             check_out_display = check_out.split()[1][:5] if check_out else "N/A"
             status_display = "Completed" if status == "completed" else "Checked In"
            
-            self.recent_tree.insert('', 'end', values=(name, department, check_in_display, check_out_display, status_display))
+            rows.append((record_id, (name, department, check_in_display, check_out_display, status_display)))
+        return rows
    
     def refresh_statistics(self):
         """Refresh attendance statistics"""
+        # Today's, this week's, this month's and per-department figures
+        self.live_stats.load()
+        self.show_statistics()
+   
+    def apply_statistics(self, event):
+        """Count a check-in or check-out in the statistics; called on the Tk thread"""
+        if self.live_stats.apply(event):
+            self.show_statistics()
+        elif event.date == date.today().strftime('%Y-%m-%d'):
+            # The day has changed, or a new department
+            self.refresh_statistics()
+   
+    def show_statistics(self):
+        """Display the live statistics"""
+        stats = self.live_stats.stats
         self.stats_text.delete(1.0, tk.END)
        
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-       
-        # Get today's statistics
-        today = date.today()
-        c.execute("SELECT COUNT(*) FROM users")
-        total_users = c.fetchone()[0]
-       
-        c.execute("SELECT COUNT(DISTINCT finger_id) FROM attendance WHERE date = ?", (today,))
-        present_today = c.fetchone()[0]
-       
-        c.execute("SELECT COUNT(*) FROM attendance WHERE date = ? AND status = 'completed'", (today,))
-        completed_today = c.fetchone()[0]
-       
-        c.execute("SELECT COUNT(*) FROM attendance WHERE date = ? AND status = 'checked_in'", (today,))
-        checked_in_only = c.fetchone()[0]
-       
-        # Get weekly statistics
-        week_start = today - timedelta(days=today.weekday())
-        c.execute("SELECT COUNT(DISTINCT finger_id) FROM attendance WHERE date >= ?", (week_start,))
-        present_this_week = c.fetchone()[0]
-       
-        # Get monthly statistics
-        month_start = today.replace(day=1)
-        c.execute("SELECT COUNT(DISTINCT finger_id) FROM attendance WHERE date >= ?", (month_start,))
-        present_this_month = c.fetchone()[0]
-       
-        # Get department-wise statistics for today
-        c.execute("""SELECT u.department, COUNT(DISTINCT a.finger_id) as present_count
-                    FROM users u
-                    LEFT JOIN attendance a ON u.finger_id = a.finger_id AND a.date = ?
-                    WHERE u.department IS NOT NULL
-                    GROUP BY u.department""", (today,))
-        dept_stats = c.fetchall()
-       
-        conn.close()
-       
         # Display statistics
         stats_text = f"""
 ATTENDANCE STATISTICS
 {'='*50}
 
-TODAY'S ATTENDANCE ({today.strftime('%Y-%m-%d')})
+TODAY'S ATTENDANCE ({stats.day.strftime('%Y-%m-%d')})
 {'='*50}
-Total Registered Users: {total_users}
-Present Today: {present_today}
-Absent Today: {total_users - present_today}
-Completed (Check-in + Check-out): {completed_today}
-Checked In Only: {checked_in_only}
-Attendance Rate: {(present_today/total_users*100):.1f}% if total_users > 0 else 0%
+Total Registered Users: {stats.total_users}
+Present Today: {stats.present}
+Absent Today: {stats.absent}
+Completed (Check-in + Check-out): {stats.completed}
+Checked In Only: {stats.checked_in}
+Attendance Rate: {stats.rate(stats.present):.1f}%
 
 WEEKLY STATISTICS
 {'='*50}
-Present This Week: {present_this_week}
-Weekly Attendance Rate: {(present_this_week/total_users*100):.1f}% if total_users > 0 else 0%
+Present This Week: {stats.present_week}
+Weekly Attendance Rate: {stats.rate(stats.present_week):.1f}%
 
 MONTHLY STATISTICS
 {'='*50}
-Present This Month: {present_this_month}
-Monthly Attendance Rate: {(present_this_month/total_users*100):.1f}% if total_users > 0 else 0%
+Present This Month: {stats.present_month}
+Monthly Attendance Rate: {stats.rate(stats.present_month):.1f}%
 
 DEPARTMENT-WISE ATTENDANCE (Today)
 {'='*50}
 """
        
-        for dept, count in dept_stats:
-            if dept:
-                stats_text += f"{dept}: {count} present\n"
+        for dept in stats.departments:
+            if dept.department:
+                stats_text += f"{dept.department}: {dept.present} present\n"
        
         self.stats_text.insert(tk.END, stats_text)
    
     def export_pdf(self):
         """Export attendance report to PDF"""
-        try:
-            filename = filedialog.asksaveasfilename(
-                defaultextension=".pdf",
-                filetypes=[("PDF files", "*.pdf"), ("All files", "*.*")],
-                initialname=f"attendance_report_{date.today().strftime('%Y_%m_%d')}.pdf"
-            )
-           
-            if filename:
-                self.generate_pdf_report(filename)
-                messagebox.showinfo("Success", f"Report exported successfully to:\n{filename}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to export PDF: {str(e)}")
-   
-    def generate_pdf_report(self, filename):
-        """Generate PDF report"""
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        
-        # Get today's attendance data
-        today = date.today()
-        c.execute("""SELECT u.name, u.department, a.check_in_time, a.check_out_time, a.status,
-                           CASE WHEN a.check_in_time IS NOT NULL AND a.check_out_time IS NOT NULL
-                               THEN printf('%.2f', (julianday(a.check_out_time) - julianday(a.check_in_time)) * 24)
-                               ELSE 'N/A' END as hours_worked
-                    FROM users u
-                    LEFT JOIN attendance a ON u.finger_id = a.finger_id AND a.date = ?
-                    ORDER BY u.name""", (today,))
-        attendance_data = c.fetchall()
-        conn.close()
-        
-        # Create PDF
-        doc = SimpleDocTemplate(filename, pagesize=A4)
-        story = []
-        styles = getSampleStyleSheet()
-        
-        # Title
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=18,
-            spaceAfter=30,
-            alignment=1,
-            textColor=colors.darkblue
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".pdf",
+            filetypes=[("PDF files", "*.pdf"), ("All files", "*.*")],
+            initialfile=f"attendance_report_{date.today().strftime('%Y_%m_%d')}.pdf"
         )
-        
-        story.append(Paragraph("Daily Attendance Report", title_style))
-        story.append(Paragraph(f"Date: {today.strftime('%Y-%m-%d')}", styles['Normal']))
-        story.append(Paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['Normal']))
-        story.append(Spacer(1, 20))
-        
-        # Summary statistics
-        total_users = len(attendance_data)
-        present_users = sum(1 for row in attendance_data if row[2] is not None)
-        completed_users = sum(1 for row in attendance_data if row[4] == 'completed')
-        
-        summary_data = [
-            ['Metric', 'Count'],
-            ['Total Users', str(total_users)],
-            ['Present Today', str(present_users)],
-            ['Absent Today', str(total_users - present_users)],
-            ['Completed (Check-in + Check-out)', str(completed_users)],
-            ['Attendance Rate', f"{(present_users/total_users*100):.1f}%" if total_users > 0 else "0%"]
-        ]
-        
-        summary_table = Table(summary_data)
-        summary_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        
-        story.append(summary_table)
-        story.append(Spacer(1, 20))
-        
-        # Detailed attendance table
-        story.append(Paragraph("Detailed Attendance", styles['Heading2']))
-        
-        table_data = [['Name', 'Department', 'Check-in', 'Check-out', 'Status', 'Hours Worked']]
-        
-        for row in attendance_data:
-            name, dept, check_in, check_out, status, hours = row
-            check_in_display = check_in.split()[1][:5] if check_in else "Absent"
-            check_out_display = check_out.split()[1][:5] if check_out else "N/A"
-            status_display = "Completed" if status == "completed" else "Checked In" if status == "checked_in" else "Absent"
-            
-            table_data.append([
-                name, dept or 'N/A', check_in_display, check_out_display, status_display, hours
-            ])
-        
-        attendance_table = Table(table_data)
-        attendance_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTSIZE', (0, 1), (-1, -1), 8)
-        ]))
-        
-        story.append(attendance_table)
-        doc.build(story)
+       
+        if filename:
+            self.submit_report("Daily report", daily_report, filename)
    
     def export_csv(self):
-        """Export attendance data to CSV"""
+        """Export attendance data to CSV in the background"""
         try:
-            filename = filedialog.asksaveasfilename(
-                defaultextension=".csv",
-                filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
-                initialname=f"attendance_data_{date.today().strftime('%Y_%m_%d')}.csv"
-            )
-           
-            if filename:
-                conn = sqlite3.connect("users.db")
-                c = conn.cursor()
-                c.execute("""SELECT u.name, u.department, a.date, a.check_in_time, a.check_out_time, a.status
-                            FROM users u
-                            LEFT JOIN attendance a ON u.finger_id = a.finger_id
-                            ORDER BY a.date DESC, u.name""")
-                data = c.fetchall()
-                conn.close()
-                
-                with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-                    writer = csv.writer(csvfile)
-                    writer.writerow(['Name', 'Department', 'Date', 'Check-in Time', 'Check-out Time', 'Status'])
-                    for row in data:
-                        writer.writerow(row)
-                
-                messagebox.showinfo("Success", f"CSV exported successfully to:\n{filename}")
+            start, end, department = self.export_filters()
+        except ValueError:
+            messagebox.showerror("Error", "Export dates must be in YYYY-MM-DD format")
+            return
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
+            initialfile=f"attendance_data_{date.today().strftime('%Y_%m_%d')}.csv"
+        )
+        if filename:
+            key = self.report_cache.key(CSV_CACHE_NAME, start, end, department)
+            if self.report_cache.copy(key, filename):
+                self.status_bar.config(text="CSV export copied from the report cache")
+                messagebox.showinfo("Success", f"Attendance data exported successfully to:\n{filename}")
+                return
+            self.run_export("Exporting CSV", filename, write_csv, CSV_COLUMNS, start, end, department,
+                            cache_key=key)
+
+    def export_parquet(self):
+        """Export the attendance history as month-partitioned Parquet files in the background"""
+        try:
+            start, end, department = self.export_filters()
+        except ValueError:
+            messagebox.showerror("Error", "Export dates must be in YYYY-MM-DD format")
+            return
+        if importlib.util.find_spec("pyarrow") is None:
+            messagebox.showerror("Error", "Parquet export requires pyarrow: pip install pyarrow")
+            return
+        directory = filedialog.askdirectory(title="Choose a folder for the Parquet export")
+        if directory:
+            directory = os.path.join(directory, f"attendance_{date.today().strftime('%Y_%m_%d')}")
+            self.run_export("Exporting Parquet", directory, write_columnar, 'parquet',
+                            start, end, department)
+
+    def submit_report(self, title, report, filename, *args):
+        """Render a report in a worker process and list it under Report Jobs"""
+        job = self.report_jobs.submit(title, report, filename, *args)
+        self.status_bar.config(text=f"{title} queued")
+        return job
+
+    def report_job_changed(self, job):
+        """Show a job's progress; called on the Tk thread"""
+        state = "Done (cached)" if job.cached else job.state.capitalize()
+        values = (job.title, state, job.pages, job.filename)
+        if self.jobs_tree.exists(job.id):
+            self.jobs_tree.item(job.id, values=values)
+        else:
+            self.jobs_tree.insert('', 'end', iid=job.id, values=values)
+        if job.state == 'running':
+            self.status_bar.config(text=f"{job.title}: page {job.pages}")
+        elif job.state == 'done':
+            self.status_bar.config(text=f"{job.title} saved to {job.filename}")
+            messagebox.showinfo("Success", f"{job.title} exported successfully to:\n{job.filename}")
+        elif job.state == 'failed':
+            self.status_bar.config(text=f"{job.title} failed")
+            messagebox.showerror("Error", f"Failed to export {job.title}: {job.error}")
+        elif job.state == 'cancelled':
+            self.status_bar.config(text=f"{job.title} cancelled")
+
+    def cancel_report_job(self):
+        for item in self.jobs_tree.selection():
+            job = next((job for job in self.report_jobs.jobs if str(job.id) == item), None)
+            if job is not None:
+                self.report_jobs.cancel(job)
+
+    def clear_report_jobs(self):
+        self.report_jobs.clear_finished()
+        remaining = {str(job.id) for job in self.report_jobs.jobs}
+        self.jobs_tree.delete(*[item for item in self.jobs_tree.get_children() if item not in remaining])
+
+    def export_filters(self):
+        """Return the (start, end, department) export filters, validating the dates"""
+        start = self.export_start_var.get().strip() or None
+        end = self.export_end_var.get().strip() or None
+        for value in (start, end):
+            if value:
+                datetime.strptime(value, '%Y-%m-%d')
+        department = self.export_dept_var.get()
+        return start, end, None if department in ('', 'All') else department
+
+    def run_export(self, label, filename, target, *args, cache_key=None):
+        """Run target(db, filename, *args) in the background, showing its progress in the status bar.
+
+        With a cache_key the finished file is added to the report cache.
+        """
+        if self.export_job is not None and self.export_job.running():
+            messagebox.showwarning("Export", "An export is already running")
+            return
+
+        def on_progress(done, total, elapsed):
+            text = progress_text(label, done, total, elapsed)
+            self.root.after(0, lambda: self.status_bar.config(text=text))
+
+        def on_done(result, error):
+            if error is None and cache_key is not None:
+                try:
+                    self.report_cache.put(cache_key, filename)
+                except Exception as e:
+                    print(f"Report cache error: {e}")
+            self.root.after(0, lambda: self.export_finished(label, filename, result, error))
+
+        self.cancel_export_button.config(state=tk.NORMAL)
+        self.status_bar.config(text=f"{label}...")
+        self.export_job = ExportJob(target, self.db, filename, *args,
+                                    on_progress=on_progress, on_done=on_done).start()
+
+    def export_finished(self, label, filename, result, error):
+        self.export_job = None
+        self.cancel_export_button.config(state=tk.DISABLED)
+        if isinstance(error, ExportCancelled):
+            self.status_bar.config(text=f"{label} cancelled")
+        elif error is not None:
+            self.status_bar.config(text=f"{label} failed")
+            messagebox.showerror("Error", f"Failed to export: {error}")
+        else:
+            self.status_bar.config(text=f"{label}: {result:,} rows written")
+            messagebox.showinfo("Success", f"{result:,} rows exported successfully to:\n{filename}")
+
+    def cancel_export(self):
+        if self.export_job is not None:
+            self.export_job.cancel()
+
+    def on_close(self):
+        """Hide the window and shut down in the background; the window is destroyed afterwards"""
+        if self.closing:
+            return
+        self.closing = True
+        self.root.withdraw()
+        # The threads shut down here pass results to Tk until they
+        # finish, so the Tk thread keeps running its event loop meanwhile
+        threading.Thread(target=self.shutdown, name="shutdown").start()
+
+    def shutdown(self):
+        """Stop scanning, exports and report workers, then close the journal and the database"""
+        try:
+            if self.scan_pipeline is not None:
+                # Matches already captured are still recorded
+                self.scan_pipeline.stop(wait=True)
+            if self.scan_client is not None:
+                self.scan_client.close()
+            if self.export_job is not None:
+                self.export_job.cancel()
+                self.export_job.join()
+            self.report_scheduler.stop()
+            self.report_jobs.shutdown()
+            if self.journal is not None:
+                self.journal.close()
+            self.db.close()
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to export CSV: {str(e)}")
+            print(f"Shutdown error: {e}")
+        self.root.after(0, self.root.destroy)
 
 # Main application
 def main():
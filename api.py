@@ -0,0 +1,540 @@
+"""Headless JSON API over the attendance database.
+
+Serves the data the GUIs show, through the same Database, statistics,
+report and cache modules, for HR systems and other programs:
+
+    GET  /users                 ?department= &limit= &after=
+    GET  /users/<finger_id>
+    GET  /attendance            ?date= (default today) &department= &status= &limit= &after=
+    GET  /statistics            ?date= &department=
+    GET  /statistics/users
+    POST /reports               {"report": "daily" | "datewise" | "summary",
+                                 "date": ..., "department": ..., "status": ...}
+    GET  /reports/<id>
+    GET  /reports/<id>/file
+    GET  /events                server-sent attendance events
+
+Lists are paged with keyset cursors: a page holds up to limit items and
+"next", the after= value of the following page (null on the last one).
+GET responses carry an ETag derived from the data version of the dates
+they cover (see report_cache.py), so a client sending If-None-Match gets
+304 Not Modified without the query being run, and recent responses are
+kept in memory by ETag. Bodies over COMPRESS_MIN_BYTES are gzipped for
+clients that accept it. Reports are rendered by ReportJobs worker
+processes and cached like those exported from the GUI.
+
+/events streams every check-in, check-out, duplicate scan and unknown
+finger as it happens (see events.py), as text/event-stream: "event:" is
+the kind, "data:" the event as JSON and "id:" its number, so a
+reconnecting EventSource sends Last-Event-ID and gets the events it
+missed. The events come from the scanning daemon (scan_daemon.py), which
+the server follows over its socket.
+
+The server is a small HTTP/1.1 implementation on asyncio streams with
+keep-alive; queries run on a thread pool, each thread with its own
+database connection. Run ``python3 api.py --help`` to start it.
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import gzip
+import hashlib
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from report_cache import MAX_DATE, data_version
+
+# Address the API listens on by default
+API_HOST = os.environ.get("ATTENDANCE_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("ATTENDANCE_API_PORT", "8080"))
+
+# Directory reports requested through the API are written to
+API_REPORT_DIR = os.environ.get("ATTENDANCE_API_REPORTS", "api_reports")
+
+# Page size of list endpoints, and the largest a client may ask for
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# Smallest response body worth compressing (bytes)
+COMPRESS_MIN_BYTES = 1024
+
+# Responses kept in memory by ETag
+RESPONSE_CACHE_SIZE = 256
+
+# Largest request head and body accepted (bytes)
+MAX_HEADER_BYTES = 65536
+MAX_BODY_BYTES = 65536
+
+# Seconds an idle keep-alive connection is kept open
+KEEP_ALIVE_TIMEOUT = 30
+
+# Seconds between comment lines keeping an idle event stream open
+EVENT_PING_SECONDS = 15
+
+# Events waiting to be sent before a slow event stream is closed; the
+# client reconnects with Last-Event-ID
+EVENT_BACKLOG = 1000
+
+DATE_FORMAT = '%Y-%m-%d'
+
+# Status filter values of /attendance and the SQL condition on the
+# user's record for the day (a is NULL for absent users)
+STATUS_FILTERS = {
+    'all': "1",
+    'present': "a.id IS NOT NULL",
+    'absent': "a.id IS NULL",
+    'completed': "a.status = 'completed'",
+    'checked_in': "a.status = 'checked_in'",
+}
+
+Response = collections.namedtuple('Response', 'status body content_type etag headers')
+
+
+class ApiError(Exception):
+    """An error returned to the client as {"error": message} with status"""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+        self.message = message
+
+
+def _date(value, name='date'):
+    try:
+        return datetime.strptime(value, DATE_FORMAT).date()
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{name} must be YYYY-MM-DD")
+
+
+def _limit(query):
+    try:
+        limit = int(query.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "limit must be a number")
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def encode_cursor(row):
+    """after= value continuing after row, a (sort value, key) pair"""
+    return base64.urlsafe_b64encode(json.dumps(row).encode()).decode().rstrip('=')
+
+
+def decode_cursor(value):
+    try:
+        sort_value, key = json.loads(base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)))
+    except (ValueError, TypeError):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "invalid after= cursor")
+    return sort_value, key
+
+
+def _page(db, sql, params, query, columns):
+    """One keyset page of sql ordered by (name, finger_id), as {"items", "next"}"""
+    limit = _limit(query)
+    where, after = "", ()
+    if query.get('after'):
+        where = "WHERE (name, finger_id) > (?, ?)"
+        after = decode_cursor(query['after'])
+    rows = db.query(f"SELECT * FROM ({sql}) {where} ORDER BY name, finger_id LIMIT ?",
+                    tuple(params) + tuple(after) + (limit + 1,))
+    items = [dict(zip(columns, row)) for row in rows[:limit]]
+    more = len(rows) > limit
+    return {'items': items,
+            'next': encode_cursor([items[-1]['name'], items[-1]['finger_id']]) if more else None}
+
+
+class AttendanceApi:
+    """Request handlers; each returns a JSON-able object or a Response.
+
+    route() finds the handler of a request, and for GET requests etag()
+    works out the ETag of the answer from the data version alone, so the
+    server can answer If-None-Match, or serve a kept response, without
+    running the handler.
+    """
+
+    USER_COLUMNS = ('finger_id', 'name', 'age', 'department')
+    ATTENDANCE_COLUMNS = ('finger_id', 'name', 'department', 'date', 'check_in_time', 'check_out_time',
+                          'status', 'worked_seconds')
+
+    def __init__(self, db, report_jobs=None, report_dir=API_REPORT_DIR):
+        self.db = db
+        self.report_jobs = report_jobs
+        self.report_dir = report_dir
+
+    def route(self, method, path):
+        """Return (handler, args, scope) for a request, raising ApiError if there is none.
+
+        scope names the data the answer depends on ('users', 'attendance',
+        'statistics' or 'history'), None for answers that are not cacheable.
+        """
+        parts = [part for part in path.split('/') if part]
+        if method == 'GET':
+            if parts == ['users']:
+                return self.users, (), 'users'
+            if len(parts) == 2 and parts[0] == 'users':
+                return self.user, (self._id(parts[1]),), 'users'
+            if parts == ['attendance']:
+                return self.attendance, (), 'attendance'
+            if parts == ['statistics']:
+                return self.statistics, (), 'statistics'
+            if parts == ['statistics', 'users']:
+                return self.user_statistics, (), 'history'
+            if len(parts) in (2, 3) and parts[0] == 'reports' and parts[2:] in ([], ['file']):
+                return (self.report_file if parts[2:] else self.report), (self._id(parts[1]),), None
+        elif method == 'POST' and parts == ['reports']:
+            return self.submit_report, (), None
+        if parts and parts[0] in ('users', 'attendance', 'statistics', 'reports'):
+            raise ApiError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} is not supported on {path}")
+        raise ApiError(HTTPStatus.NOT_FOUND, f"no such resource: {path}")
+
+    def etag(self, path, query, scope):
+        """ETag of a GET answer, from the data version of the dates it covers"""
+        if scope == 'users':
+            # Only the users counter: no attendance is dated after MAX_DATE
+            version = data_version(self.db, MAX_DATE, MAX_DATE)
+        elif scope == 'attendance':
+            day = self._day(query)
+            version = data_version(self.db, day, day)
+            query = dict(query, date=day)
+        elif scope == 'statistics':
+            day = _date(self._day(query))
+            # Week and month figures count every day from the start of the
+            # week or month onwards
+            version = data_version(self.db, min(day - timedelta(days=day.weekday()), day.replace(day=1))
+                                   .strftime(DATE_FORMAT), None)
+            query = dict(query, date=day.strftime(DATE_FORMAT))
+        else:
+            version = data_version(self.db)
+        digest = hashlib.sha1(repr((path, sorted(query.items()), version)).encode()).hexdigest()[:20]
+        return f'"{digest}"'
+
+    def _id(self, value):
+        try:
+            return int(value)
+        except ValueError:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"no such id: {value}")
+
+    def _day(self, query):
+        day = query.get('date') or date.today().strftime(DATE_FORMAT)
+        _date(day)
+        return day
+
+    def users(self, query):
+        sql = "SELECT finger_id, name, age, department FROM users"
+        params = []
+        if query.get('department'):
+            sql += " WHERE department = ?"
+            params.append(query['department'])
+        return _page(self.db, sql, params, query, self.USER_COLUMNS)
+
+    def user(self, query, finger_id):
+        row = self.db.query_one("SELECT finger_id, name, age, department FROM users WHERE finger_id = ?",
+                                (finger_id,))
+        if row is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"no user with finger_id {finger_id}")
+        return dict(zip(self.USER_COLUMNS, row))
+
+    def attendance(self, query):
+        day = self._day(query)
+        status = query.get('status', 'all').lower()
+        if status not in STATUS_FILTERS:
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"status must be one of {', '.join(STATUS_FILTERS)}")
+        sql = f"""SELECT u.finger_id, u.name, u.department, ? AS date, a.check_in_time, a.check_out_time,
+                         COALESCE(a.status, 'absent') AS status, a.worked_seconds
+                  FROM users u
+                  LEFT JOIN attendance a ON u.finger_id = a.finger_id AND a.date = ?
+                  WHERE {STATUS_FILTERS[status]}"""
+        params = [day, day]
+        if query.get('department'):
+            sql += " AND u.department = ?"
+            params.append(query['department'])
+        return _page(self.db, sql, params, query, self.ATTENDANCE_COLUMNS)
+
+    def statistics(self, query):
+        from stats import attendance_statistics
+
+        stats = attendance_statistics(self.db, _date(self._day(query)), query.get('department') or None)
+        result = stats._asdict()
+        result['day'] = stats.day.strftime(DATE_FORMAT)
+        result['absent'] = stats.absent
+        result['departments'] = [department._asdict() for department in stats.departments]
+        return result
+
+    def user_statistics(self, query):
+        from stats import user_statistics
+
+        return {'items': [user._asdict() for user in user_statistics(self.db)]}
+
+    def submit_report(self, query, body):
+        from reports import daily_report, datewise_report, summary_report
+
+        if self.report_jobs is None:
+            raise ApiError(HTTPStatus.SERVICE_UNAVAILABLE, "reports are not enabled")
+        try:
+            request = json.loads(body or b'{}')
+        except ValueError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "body must be JSON")
+        kind = request.get('report')
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        if kind == 'datewise':
+            day = request.get('date') or date.today().strftime(DATE_FORMAT)
+            _date(day)
+            args = (day, request.get('department') or 'All', request.get('status') or 'All')
+            title, report = f"Date-wise report {day}", datewise_report
+        elif kind == 'daily':
+            title, report, args = "Daily report", daily_report, ()
+        elif kind == 'summary':
+            title, report, args = "Summary report", summary_report, ()
+        else:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "report must be daily, datewise or summary")
+        os.makedirs(self.report_dir, exist_ok=True)
+        filename = os.path.join(self.report_dir, f"{kind}_{stamp}.pdf")
+        job = self.report_jobs.submit(title, report, filename, *args)
+        return Response(HTTPStatus.ACCEPTED, self._job(job), 'application/json', None,
+                        {'Location': f"/reports/{job.id}"})
+
+    def _find_job(self, job_id):
+        job = next((job for job in self.report_jobs.jobs if job.id == job_id), None) \
+            if self.report_jobs is not None else None
+        if job is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"no report job {job_id}")
+        return job
+
+    def _job(self, job):
+        return {'id': job.id, 'title': job.title, 'state': job.state, 'pages': job.pages,
+                'cached': job.cached, 'error': str(job.error) if job.error else None,
+                'file': f"/reports/{job.id}/file" if job.state == 'done' else None}
+
+    def report(self, query, job_id):
+        return self._job(self._find_job(job_id))
+
+    def report_file(self, query, job_id):
+        job = self._find_job(job_id)
+        if job.state != 'done':
+            raise ApiError(HTTPStatus.CONFLICT, f"report job {job_id} is {job.state}")
+        with open(job.filename, 'rb') as f:
+            return Response(HTTPStatus.OK, f.read(), 'application/pdf', None,
+                            {'Content-Disposition': f'attachment; filename="{os.path.basename(job.filename)}"'})
+
+
+class ApiServer:
+    """HTTP/1.1 front end of an AttendanceApi on asyncio streams"""
+
+    def __init__(self, api, cache_size=RESPONSE_CACHE_SIZE, events=None):
+        self.api = api
+        self.cache_size = cache_size
+        self.events = events
+        self._responses = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    async def serve(self, host=API_HOST, port=API_PORT, ready=None):
+        """Serve until cancelled; ready(port) is called once listening"""
+        server = await asyncio.start_server(self._connection, host, port, limit=MAX_HEADER_BYTES)
+        if ready:
+            ready(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    async def _connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self._send(writer, self._error(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,
+                                                         "request head too large"), {}, False)
+                    return
+                try:
+                    method, target, version, headers = self._parse(head)
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    await self._send(writer, self._error(HTTPStatus.BAD_REQUEST, "malformed request"),
+                                     {}, False)
+                    return
+                if length > MAX_BODY_BYTES:
+                    await self._send(writer, self._error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                                         "request body too large"), headers, False)
+                    return
+                body = await reader.readexactly(length) if length else b''
+                if method == 'GET' and self.events is not None and urlsplit(target).path.rstrip('/') == '/events':
+                    await self._stream(writer, headers)
+                    return
+                keep_alive = (headers.get('connection', '').lower() != 'close' if version == 'HTTP/1.1'
+                              else headers.get('connection', '').lower() == 'keep-alive')
+
+                # Queries, rendering and compression run off the event loop
+                response = await asyncio.to_thread(self.handle, method, target, headers, body)
+                await self._send(writer, response, headers, keep_alive, method == 'HEAD')
+                self.requests += 1
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _stream(self, writer, headers):
+        """Send attendance events as server-sent events until the client goes away"""
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue()
+        last = headers.get('last-event-id', '')
+        token = self.events.subscribe(lambda event: loop.call_soon_threadsafe(pending.put_nowait, event),
+                                      after=int(last) if last.isdigit() else None)
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                         b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            while pending.qsize() <= EVENT_BACKLOG:
+                try:
+                    event = await asyncio.wait_for(pending.get(), EVENT_PING_SECONDS)
+                except asyncio.TimeoutError:
+                    writer.write(b": ping\n\n")
+                else:
+                    data = json.dumps(event._asdict(), separators=(',', ':'))
+                    writer.write(f"id: {event.seq}\nevent: {event.kind}\ndata: {data}\n\n".encode())
+                await writer.drain()
+        finally:
+            self.events.unsubscribe(token)
+
+    def _parse(self, head):
+        lines = head.decode('latin-1').split("\r\n")
+        method, target, version = lines[0].split(" ")
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        return method.upper(), target, version, headers
+
+    def handle(self, method, target, headers, body):
+        """Answer one request; returns a Response whose body is bytes"""
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            handler, args, scope = self.api.route('GET' if method == 'HEAD' else method, url.path)
+            if method == 'POST':
+                return self._json(handler(query, body))
+            etag = self.api.etag(url.path, query, scope) if scope else None
+            if etag is not None:
+                if etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+                    return Response(HTTPStatus.NOT_MODIFIED, b'', None, etag, {})
+                with self._lock:
+                    kept = self._responses.get(etag)
+                    if kept is not None:
+                        self._responses.move_to_end(etag)
+                        return kept
+            response = self._json(handler(query, *args))
+            if etag is not None:
+                response = response._replace(etag=etag)
+                with self._lock:
+                    self._responses[etag] = response
+                    while len(self._responses) > self.cache_size:
+                        self._responses.popitem(last=False)
+            return response
+        except ApiError as e:
+            return self._error(e.status, e.message)
+        except Exception as e:
+            return self._error(HTTPStatus.INTERNAL_SERVER_ERROR, str(e))
+
+    def _json(self, result):
+        if isinstance(result, Response):
+            if isinstance(result.body, bytes):
+                return result
+            return result._replace(body=json.dumps(result.body, separators=(',', ':'), default=str).encode())
+        return Response(HTTPStatus.OK, json.dumps(result, separators=(',', ':'), default=str).encode(),
+                        'application/json', None, {})
+
+    def _error(self, status, message):
+        return self._json(Response(status, {'error': message}, 'application/json', None, {}))
+
+    async def _send(self, writer, response, headers, keep_alive, head_only=False):
+        body = response.body
+        lines = [f"HTTP/1.1 {response.status.value} {response.status.phrase}"]
+        if response.content_type:
+            lines.append(f"Content-Type: {response.content_type}")
+        if response.etag:
+            lines.append(f"ETag: {response.etag}")
+            lines.append("Cache-Control: no-cache")
+        if len(body) >= COMPRESS_MIN_BYTES and 'gzip' in headers.get('accept-encoding', ''):
+            body = await asyncio.to_thread(self._gzip, response)
+            lines.append("Content-Encoding: gzip")
+        if response.content_type == 'application/json' or response.etag:
+            lines.append("Vary: Accept-Encoding")
+        lines.extend(f"{name}: {value}" for name, value in response.headers.items())
+        lines.append(f"Content-Length: {len(body)}")
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        if not head_only:
+            writer.write(body)
+        await writer.drain()
+
+    def _gzip(self, response):
+        # Compressed bodies of kept responses are kept with them
+        if response.etag is None:
+            return gzip.compress(response.body, 6)
+        key = (response.etag, 'gzip')
+        with self._lock:
+            body = self._responses.get(key)
+        if body is None:
+            body = gzip.compress(response.body, 6)
+            with self._lock:
+                self._responses[key] = body
+                while len(self._responses) > self.cache_size:
+                    self._responses.popitem(last=False)
+        return body
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Attendance JSON API")
+    parser.add_argument("--db", help="database file (default: ATTENDANCE_DB or users.db)")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--no-reports", action="store_true", help="disable POST /reports")
+    parser.add_argument("--no-events", action="store_true", help="disable GET /events")
+    parser.add_argument("--socket", help="scanning daemon socket /events follows "
+                                         "(default: ATTENDANCE_SCAN_SOCKET)")
+    args = parser.parse_args()
+
+    from database import DB_PATH, Database
+    from migrations import migrate
+
+    db = Database(args.db or DB_PATH)
+    with db.transaction() as c:
+        migrate(c)
+    report_jobs = None
+    if not args.no_reports:
+        from report_cache import ReportCache
+        from reports import ReportJobs
+        report_jobs = ReportJobs(db.path, cache=ReportCache(db))
+    events, scan_client = None, None
+    if not args.no_events:
+        from events import EventBus
+        from scan_daemon import SCAN_SOCKET, ScanClient
+
+        # Relay the scanning daemon's events; the client reconnects when
+        # the daemon is started or restarted
+        events = EventBus()
+        scan_client = ScanClient(events.publish_scan, args.socket or SCAN_SOCKET).start()
+    server = ApiServer(AttendanceApi(db, report_jobs), events=events)
+    try:
+        asyncio.run(server.serve(args.host, args.port,
+                                 ready=lambda port: print(f"Serving on http://{args.host}:{port}", flush=True)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if report_jobs is not None:
+            report_jobs.shutdown()
+        if scan_client is not None:
+            scan_client.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import sqlite3
+import threading
+from datetime import datetime
+
+# Format of check_in_time / check_out_time values written to the database
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def _insert_check_in(c, finger_id, name, department, timestamp, epoch, day, reader=None):
+    c.execute("""INSERT INTO attendance (finger_id, name, department, check_in_time, check_in_epoch, date, status,
+                                         check_in_reader)
+                 VALUES (?, ?, ?, ?, ?, ?, 'checked_in', ?)""",
+              (finger_id, name, department, timestamp, epoch, day, reader))
+    return c.lastrowid
+
+
+def _update_check_out(c, record_id, timestamp, epoch, reader=None):
+    # worked_seconds is stored once here so reports never parse the text times
+    c.execute("""UPDATE attendance
+                 SET check_out_time = ?, check_out_epoch = ?, status = 'completed', check_out_reader = ?,
+                     worked_seconds = ? - COALESCE(check_in_epoch,
+                                                   CAST(strftime('%s', check_in_time, 'utc') AS INTEGER))
+                 WHERE id = ? AND check_out_time IS NULL""",
+              (timestamp, epoch, reader, epoch, record_id))
+    return c.rowcount
+
+
+class TodayAttendance:
+    """Check-in/check-out state of every user for the current day.
+
+    The table maps finger_id to (record id, check-in time, check-out
+    time, status) and is rebuilt from the attendance table at startup
+    and whenever the date changes, so a restart in the middle of the day
+    picks up where it left off. record() decides between check-in,
+    check-out and already-completed with a dictionary lookup, then
+    writes the single INSERT or UPDATE through the database writer and
+    updates the table once the write has committed. With several
+    readers the first scan of the day at any of them is the check-in
+    and the next the check-out; the name of the reader is stored with
+    each.
+    """
+
+    def __init__(self, db, clock=datetime.now):
+        self.db = db
+        self.clock = clock
+        self.day = None
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def load(self, day=None):
+        """Rebuild the state table from the attendance rows of day (default: today)"""
+        with self._lock:
+            self._load(day or self.clock().date())
+
+    def _load(self, day):
+        rows = self.db.query("""SELECT finger_id, id, check_in_time, check_out_time, status
+                                FROM attendance WHERE date = ?""", (day.strftime(DATE_FORMAT),))
+        self._records = {row[0]: tuple(row[1:]) for row in rows}
+        self.day = day
+
+    def state(self, finger_id):
+        """Return 'absent', 'checked_in' or 'completed' for today"""
+        with self._lock:
+            if self.clock().date() != self.day:
+                self._load(self.clock().date())
+            record = self._records.get(finger_id)
+        if record is None:
+            return 'absent'
+        return 'checked_in' if record[2] is None else 'completed'
+
+    def record(self, user, now=None, reader=None):
+        """Record a scan for user (a users-table row) at reader and return the action taken.
+
+        The action is 'check_in', 'check_out' or 'already_checked_out'.
+        Recording the same scan time again changes nothing and returns
+        'already_recorded', so a replayed scan is not counted twice.
+        """
+        now = now or self.clock()
+        finger_id, name, department = user[0], user[1], user[3]
+        timestamp = now.strftime(TIME_FORMAT)
+        epoch = int(now.timestamp())
+
+        with self._lock:
+            if now.date() != self.day:
+                self._load(now.date())
+
+            record = self._records.get(finger_id)
+            if record is not None and timestamp in (record[1], record[2]):
+                # The same scan again, replayed from the scan journal
+                return 'already_recorded'
+            if record is None:
+                try:
+                    record_id = self.db.write(_insert_check_in, finger_id, name, department,
+                                              timestamp, epoch, self.day.strftime(DATE_FORMAT), reader)
+                except sqlite3.IntegrityError:
+                    # Recorded by another process since the table was loaded
+                    self._load(self.day)
+                    record = self._records.get(finger_id)
+                    if record is None:
+                        raise
+                else:
+                    self._records[finger_id] = (record_id, timestamp, None, 'checked_in')
+                    return 'check_in'
+
+            record_id, check_in_time, check_out_time, status = record
+            if check_out_time is None:
+                if self.db.write(_update_check_out, record_id, timestamp, epoch, reader):
+                    self._records[finger_id] = (record_id, check_in_time, timestamp, 'completed')
+                    return 'check_out'
+                # Checked out by another process since the table was loaded
+                self._load(self.day)
+            return 'already_checked_out'
+
+    def entry(self, finger_id):
+        """Today's (record id, check-in time, check-out time, status) of a user, or None"""
+        with self._lock:
+            return self._records.get(finger_id)
+
+    def forget(self, finger_id):
+        """Drop a user whose attendance rows have been deleted"""
+        with self._lock:
+            self._records.pop(finger_id, None)
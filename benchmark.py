@@ -0,0 +1,1663 @@
+"""Micro-benchmarks for the attendance system.
+
+Run ``python3 benchmark.py <name> --help`` for the options of each benchmark.
+Benchmarks work on a temporary copy of the database so a real users.db is
+never modified.
+"""
+import argparse
+import collections
+import csv
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from attendance import TodayAttendance
+from cache import UserCache
+from database import Database
+from export import CSV_COLUMNS, write_columnar, write_csv
+from migrations import MIGRATIONS, migrate
+from report_cache import ReportCache
+from rollups import drop_rollup_triggers
+from scanner import ScanPipeline
+from sensor import SimulatedSensor, open_sensor
+
+DEPARTMENTS = ["Engineering", "HR", "Sales", "Finance", "Operations"]
+
+
+def prepare_db(source, users):
+    """Copy source (or create a seeded database) into a temp dir"""
+    workdir = tempfile.mkdtemp(prefix="attendance_bench_")
+    path = os.path.join(workdir, "users.db")
+    if source and os.path.exists(source):
+        shutil.copy(source, path)
+    conn = sqlite3.connect(path)
+    migrate(conn.cursor())
+    if conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0:
+        conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?)",
+                         [(i, f"User {i}", 20 + i % 40, DEPARTMENTS[i % len(DEPARTMENTS)])
+                          for i in range(users)])
+    conn.commit()
+    conn.close()
+    return workdir, path
+
+
+def finger_ids(path):
+    """Return every registered finger ID in the database"""
+    conn = sqlite3.connect(path)
+    ids = [row[0] for row in conn.execute("SELECT finger_id FROM users")]
+    conn.close()
+    return ids
+
+
+def report(label, count, elapsed):
+    print(f"{label:<28} {count:>8} ops  {elapsed:8.3f} s  {count / elapsed:10.1f} ops/s")
+
+
+def record_scan(c, finger_id, name, department, now):
+    """Check-in/check-out logic of scan_loop, run on an open cursor"""
+    c.execute("SELECT id, check_in_time, check_out_time, status FROM attendance WHERE finger_id = ? AND date = ?",
+              (finger_id, now.date()))
+    record = c.fetchone()
+    if record is None:
+        c.execute("INSERT INTO attendance (finger_id, name, department, check_in_time, date, status) VALUES (?, ?, ?, ?, ?, ?)",
+                  (finger_id, name, department, now, now.date(), 'checked_in'))
+    elif record[3] == 'checked_in':
+        c.execute("UPDATE attendance SET check_out_time = ?, status = 'completed' WHERE id = ?", (now, record[0]))
+
+
+def scan_per_call_connect(path, finger_id):
+    """One scan as the original scan_loop did it: a fresh connection per scan"""
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute("SELECT name, department FROM users WHERE finger_id = ?", (finger_id,))
+    name, department = c.fetchone()
+    record_scan(c, finger_id, name, department, datetime.now())
+    conn.commit()
+    conn.close()
+
+
+def scan_pooled(db, finger_id):
+    """One scan through the shared Database connections and writer thread"""
+    name, department = db.query_one("SELECT name, department FROM users WHERE finger_id = ?", (finger_id,))
+    db.write(record_scan, finger_id, name, department, datetime.now())
+
+
+REPORT_QUERIES = [
+    ("SELECT COUNT(DISTINCT finger_id) FROM attendance WHERE date = ?", True),
+    ("SELECT COUNT(*) FROM attendance WHERE date = ? AND status = 'completed'", True),
+    ("""SELECT u.department, COUNT(DISTINCT a.finger_id)
+        FROM users u LEFT JOIN attendance a ON u.finger_id = a.finger_id AND a.date = ?
+        GROUP BY u.department""", True),
+    ("SELECT name, department, check_in_time FROM attendance ORDER BY check_in_time DESC LIMIT 15", False),
+]
+
+
+def run_report_per_call_connect(path, today):
+    conn = sqlite3.connect(path)
+    for sql, dated in REPORT_QUERIES:
+        conn.execute(sql, (today,) if dated else ()).fetchall()
+    conn.close()
+
+
+def run_report_pooled(db, today):
+    for sql, dated in REPORT_QUERIES:
+        db.query(sql, (today,) if dated else ())
+
+
+def run_concurrently(duration, writers, readers, write_op, read_op):
+    """Run write_op/read_op in threads for duration seconds and count results"""
+    counts = {"writes": 0, "reads": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(kind, op):
+        done = errors = 0
+        while time.perf_counter() < deadline:
+            try:
+                op()
+                done += 1
+            except sqlite3.OperationalError:
+                errors += 1
+        with lock:
+            counts[kind] += done
+            counts["errors"] += errors
+
+    threads = [threading.Thread(target=worker, args=("writes", write_op)) for _ in range(writers)]
+    threads += [threading.Thread(target=worker, args=("reads", read_op)) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return counts
+
+
+def bench_connections(args):
+    """Scans per second with per-call connections vs. the shared pool"""
+    workdir, path = prepare_db(args.db, args.users)
+    try:
+        ids = finger_ids(path)
+        scans = [random.choice(ids) for _ in range(args.scans)]
+
+        start = time.perf_counter()
+        for finger_id in scans:
+            scan_per_call_connect(path, finger_id)
+        report("per-call sqlite3.connect", len(scans), time.perf_counter() - start)
+
+        db = Database(path)
+        start = time.perf_counter()
+        for finger_id in scans:
+            scan_pooled(db, finger_id)
+        report("shared Database pool", len(scans), time.perf_counter() - start)
+
+        user_cache = UserCache(db)
+        user_cache.load()
+        today_attendance = TodayAttendance(db)
+        today_attendance.load()
+        start = time.perf_counter()
+        for finger_id in scans:
+            today_attendance.record(user_cache.get(finger_id))
+        report("user cache + day state", len(scans), time.perf_counter() - start)
+        db.close()
+    finally:
+        shutil.rmtree(workdir)
+
+
+def bench_concurrency(args):
+    """Concurrent check-in and report throughput: rollback journal vs. WAL + writer thread"""
+    for label in ("rollback journal, per-call", "WAL + writer thread"):
+        workdir, path = prepare_db(args.db, args.users)
+        try:
+            ids = finger_ids(path)
+            today = datetime.now().date()
+            if label.startswith("WAL"):
+                db = Database(path)
+                write_op = lambda: scan_pooled(db, random.choice(ids))
+                read_op = lambda: run_report_pooled(db, today)
+            else:
+                db = None
+                conn = sqlite3.connect(path)
+                conn.execute("PRAGMA journal_mode = DELETE")
+                conn.close()
+                write_op = lambda: scan_per_call_connect(path, random.choice(ids))
+                read_op = lambda: run_report_per_call_connect(path, today)
+
+            counts = run_concurrently(args.duration, args.writers, args.readers, write_op, read_op)
+            if db:
+                db.close()
+            print(f"{label:<28} writes {counts['writes'] / args.duration:9.1f}/s  "
+                  f"reports {counts['reads'] / args.duration:9.1f}/s  locked errors {counts['errors']}")
+        finally:
+            shutil.rmtree(workdir)
+
+
+def seed_attendance(conn, users, start, stop):
+    """Insert synthetic attendance rows numbered start..stop-1, one per user per day"""
+    first_day = date.today()
+    def rows():
+        for i in range(start, stop):
+            day = first_day - timedelta(days=i // users)
+            check_in = datetime.combine(day, datetime.min.time()) + timedelta(hours=9, minutes=i % 60)
+            check_out = check_in + timedelta(hours=8, minutes=i % 45)
+            check_in_epoch, check_out_epoch = int(check_in.timestamp()), int(check_out.timestamp())
+            yield (i % users, f"User {i % users}", DEPARTMENTS[i % users % len(DEPARTMENTS)],
+                   check_in, check_out, check_in_epoch, check_out_epoch,
+                   check_out_epoch - check_in_epoch, day, 'completed')
+    conn.executemany("""INSERT INTO attendance (finger_id, name, department, check_in_time, check_out_time,
+                                                check_in_epoch, check_out_epoch, worked_seconds, date, status)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows())
+    conn.commit()
+
+
+def set_attendance_indexes(conn, enabled):
+    """Create or drop the indexes added by schema migration 2"""
+    index_migration = next(steps for version, description, steps in MIGRATIONS if version == 2)
+    for step in index_migration:
+        if isinstance(step, str):
+            if enabled:
+                conn.execute(step)
+            else:
+                conn.execute("DROP INDEX IF EXISTS " + step.split(" IF NOT EXISTS ")[1].split()[0])
+    conn.commit()
+
+
+def time_lookups(conn, users, days, lookups):
+    """Average milliseconds for a scan lookup and a daily statistics query"""
+    samples = [(random.randrange(users), date.today() - timedelta(days=random.randrange(days)))
+               for _ in range(lookups)]
+    start = time.perf_counter()
+    for finger_id, day in samples:
+        conn.execute("SELECT id, check_in_time, check_out_time, status FROM attendance WHERE finger_id = ? AND date = ?",
+                     (finger_id, day)).fetchone()
+    scan_ms = (time.perf_counter() - start) / lookups * 1000
+    start = time.perf_counter()
+    for finger_id, day in samples:
+        conn.execute("SELECT COUNT(DISTINCT finger_id) FROM attendance WHERE date = ?", (day,)).fetchone()
+    stats_ms = (time.perf_counter() - start) / lookups * 1000
+    return scan_ms, stats_ms
+
+
+def bench_indexes(args):
+    """Scan and statistics lookup latency vs. history size, with and without indexes"""
+    workdir, path = prepare_db(None, args.users)
+    try:
+        conn = sqlite3.connect(path)
+        seeded = 0
+        print(f"{'rows':>10}  {'scan (no idx)':>14}  {'scan (idx)':>11}  {'stats (no idx)':>15}  {'stats (idx)':>12}")
+        for size in sorted(args.sizes):
+            seed_attendance(conn, args.users, seeded, size)
+            seeded = size
+            days = max(1, size // args.users)
+
+            set_attendance_indexes(conn, False)
+            scan_plain, stats_plain = time_lookups(conn, args.users, days, args.lookups)
+            set_attendance_indexes(conn, True)
+            scan_indexed, stats_indexed = time_lookups(conn, args.users, days, args.lookups)
+            print(f"{size:>10}  {scan_plain:>11.3f} ms  {scan_indexed:>8.3f} ms  "
+                  f"{stats_plain:>12.3f} ms  {stats_indexed:>9.3f} ms")
+
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT id FROM attendance WHERE finger_id = ? AND date = ?",
+                            (0, date.today())).fetchall()
+        print("scan lookup plan:", "; ".join(row[-1] for row in plan))
+        conn.close()
+    finally:
+        shutil.rmtree(workdir)
+
+
+def bench_rollover(args):
+    """TodayAttendance decision latency, and reloading the day's state at a restart and at midnight"""
+    workdir, path = prepare_db(None, args.users)
+    try:
+        db = Database(path)
+        users = db.query("SELECT * FROM users ORDER BY finger_id")
+        now = [datetime(2024, 3, 4, 8, 0)]
+
+        def clock():
+            return now[0]
+
+        def scan_all(today_attendance):
+            spent = []
+            for user in users:
+                now[0] += timedelta(seconds=1)
+                start = time.perf_counter()
+                today_attendance.record(user)
+                spent.append(time.perf_counter() - start)
+            return spent
+
+        today_attendance = TodayAttendance(db, clock=clock)
+        today_attendance.load()
+        for label in ("check-in", "check-out", "already checked out"):
+            spent = sorted(scan_all(today_attendance))
+            print(f"{label:<26} p50 {spent[len(spent) // 2] * 1e6:7.1f} us  "
+                  f"p99 {spent[int(len(spent) * 0.99)] * 1e6:7.1f} us  ({len(users)} users)")
+
+        # A restart loads the day's rows; the first scan after midnight
+        # loads the new day's
+        start = time.perf_counter()
+        TodayAttendance(db, clock=clock).load()
+        print(f"{'restart (load)':<26} {(time.perf_counter() - start) * 1000:7.2f} ms")
+        now[0] = datetime(2024, 3, 5, 0, 0, 0)
+        start = time.perf_counter()
+        today_attendance.record(users[0])
+        print(f"{'first scan after midnight':<26} {(time.perf_counter() - start) * 1000:7.2f} ms")
+        db.close()
+    finally:
+        shutil.rmtree(workdir)
+
+
+def original_scan_loop(finger, record, notify, deadline):
+    """The pre-pipeline scan loop: capture, record and notify inline, then sleep"""
+    while time.perf_counter() < deadline:
+        try:
+            if finger.get_image() == 0:
+                if finger.image_2_tz(1) == 0:
+                    if finger.finger_search() == 0:
+                        result = record(finger.finger_id, finger.confidence)
+                        notify("recorded", (finger.finger_id, result))
+                        time.sleep(3)
+            time.sleep(0.1)
+        except Exception:
+            time.sleep(1)
+
+
+def bench_pipeline(args):
+    """Scan throughput with a simulated sensor: original loop vs. staged pipeline"""
+    for label in ("original scan loop", "staged pipeline"):
+        workdir, path = prepare_db(None, args.users)
+        try:
+            db = Database(path)
+            user_cache = UserCache(db)
+            user_cache.load()
+            today_attendance = TodayAttendance(db)
+            today_attendance.load()
+            recorded = []
+
+            def record(finger_id, confidence, reader=None, scanned_at=None):
+                return today_attendance.record(user_cache.get(finger_id), scanned_at)
+
+            def notify(kind, data):
+                time.sleep(args.ui_latency)
+                if kind == "recorded":
+                    recorded.append(data)
+
+            simulator = SimulatedSensor(enrolled=range(args.users), dwell=args.dwell,
+                                        match_rate=args.match_rate, error_rate=args.error_rate)
+            # A queue of distinct people, as at a turnstile during shift change
+            simulator.present(*[i % args.users for i in range(100000)])
+            uart, finger = open_sensor(args.sensor, simulator)
+
+            start = time.perf_counter()
+            if label == "staged pipeline":
+                pipeline = ScanPipeline(finger, record, notify)
+                pipeline.start()
+                time.sleep(args.duration)
+                pipeline.stop(wait=True)
+            else:
+                original_scan_loop(finger, record, notify, start + args.duration)
+            elapsed = time.perf_counter() - start
+            db.close()
+            if uart:
+                uart.close()
+            print(f"{label:<20} {len(recorded):>6} scans in {elapsed:5.1f} s  "
+                  f"{len(recorded) / elapsed * 60:8.1f} scans/min")
+        finally:
+            shutil.rmtree(workdir)
+
+
+def time_matches(matcher, probes, prune):
+    """Average milliseconds per match and the share of probes matched to the right ID"""
+    correct = 0
+    start = time.perf_counter()
+    for identity, probe in probes:
+        results = matcher.match(probe, prune=prune)
+        correct += bool(results) and results[0][0] == identity
+    elapsed = time.perf_counter() - start
+    return elapsed / len(probes) * 1000, correct / len(probes)
+
+
+def bench_matching(args):
+    """Host 1:N match latency and recall vs. template library size"""
+    # numpy is only needed for host-side matching
+    from matcher import TemplateMatcher
+
+    simulator = SimulatedSensor(seed=1)
+    matcher = TemplateMatcher()
+    enrolled = 0
+    print(f"{'templates':>10}  {'full scan':>10}  {'recall':>7}  {'pruned':>10}  {'recall':>7}")
+    for size in sorted(args.sizes):
+        for identity in range(enrolled, size):
+            matcher.add(identity, simulator.template(identity))
+        enrolled = size
+        probes = [(identity, simulator.template(identity))
+                  for identity in random.sample(range(size), min(args.probes, size))]
+        matcher.match(probes[0][1])  # build the index outside the timing
+        full_ms, full_recall = time_matches(matcher, probes, prune=False)
+        pruned_ms, pruned_recall = time_matches(matcher, probes, prune=True)
+        print(f"{size:>10}  {full_ms:>7.3f} ms  {full_recall:>7.1%}  {pruned_ms:>7.3f} ms  {pruned_recall:>7.1%}")
+
+
+def measure_frames(root, duration, work, interval):
+    """Run work() every interval seconds for duration and return the gaps between 16 ms frames"""
+    gaps = []
+    last = [time.perf_counter()]
+
+    def frame():
+        now = time.perf_counter()
+        gaps.append(now - last[0])
+        last[0] = now
+        root.after(16, frame)
+
+    def tick():
+        work()
+        root.after(int(interval * 1000), tick)
+
+    root.after(16, frame)
+    root.after(int(interval * 1000), tick)
+    root.after(int(duration * 1000), root.quit)
+    root.mainloop()
+    return sorted(gaps)
+
+
+def bench_treeview(args):
+    """Tk frame stalls while refreshing a users table: delete-all/insert-all vs. diffing"""
+    # Tk needs a display; run under xvfb-run on a headless machine
+    import tkinter as tk
+    from tkinter import ttk
+    from treeview import TreeUpdater
+
+    users = [[finger_id, f"User {finger_id}", 20 + finger_id % 40, random.choice(DEPARTMENTS), "Absent"]
+             for finger_id in range(args.users)]
+
+    def scan():
+        # One user checks in or out, then the table is refreshed
+        user = random.choice(users)
+        user[4] = "Completed" if user[4] == "Checked In" else "Checked In"
+        return [(user[0], tuple(user)) for user in users]
+
+    for label in ("delete/insert", "diffing"):
+        root = tk.Tk()
+        tree = ttk.Treeview(root, columns=('ID', 'Name', 'Age', 'Department', 'Status'), show='headings')
+        tree.pack(fill='both', expand=True)
+        if label == "diffing":
+            updater = TreeUpdater(tree)
+            updater.update(scan())
+
+            def work():
+                for _ in range(args.burst):
+                    updater.request(scan)
+        else:
+            def work():
+                for _ in range(args.burst):
+                    rows = scan()
+                    for item in tree.get_children():
+                        tree.delete(item)
+                    for key, values in rows:
+                        tree.insert('', 'end', values=values)
+            work()
+
+        gaps = measure_frames(root, args.duration, work, args.interval)
+        root.destroy()
+        p95 = gaps[int(len(gaps) * 0.95)] * 1000
+        stalls = sum(gap > 0.05 for gap in gaps)
+        print(f"{label:<14} {len(gaps):>5} frames  p95 {p95:7.1f} ms  max {gaps[-1] * 1000:7.1f} ms  "
+              f"{stalls:>4} frames over 50 ms")
+
+
+def bench_paging(args):
+    """Memory and latency of the users table: loading every row vs. keyset pages"""
+    from virtualtable import KeysetSource
+
+    workdir, path = prepare_db(None, args.users)
+    try:
+        db = Database(path)
+        query = "SELECT finger_id, name, COALESCE(age, '') AS age, COALESCE(department, '') AS department FROM users"
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        rows = [(row[0], tuple(row)) for row in db.query(query + " ORDER BY name")]
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{'load all':<16} {len(rows):>7} rows  {elapsed * 1000:8.1f} ms  peak {peak / 2**20:7.1f} MiB")
+        del rows
+
+        source = KeysetSource(db, query, columns=('finger_id', 'name', 'age', 'department'), sort='name')
+        offsets = [random.randrange(args.users) for _ in range(args.windows)]
+        tracemalloc.start()
+        start = time.perf_counter()
+        source.rows(offsets[0], args.visible)  # first jump reads the page bookmarks
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        for offset in offsets[1:]:
+            source.rows(offset, args.visible)
+        elapsed = (time.perf_counter() - start) / max(1, len(offsets) - 1)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{'keyset window':<16} {args.visible:>7} rows  {elapsed * 1000:8.1f} ms  peak {peak / 2**20:7.1f} MiB"
+              f"  (first jump {first * 1000:.1f} ms)")
+        db.close()
+    finally:
+        shutil.rmtree(workdir)
+
+
+def original_statistics(db, today):
+    """The Reports tab figures as refresh_statistics used to query them"""
+    total_users = db.query_value("SELECT COUNT(*) FROM users")
+    present_today = db.query_value("SELECT COUNT(DISTINCT finger_id) FROM attendance WHERE date = ?", (today,))
+    completed_today = db.query_value("SELECT COUNT(*) FROM attendance WHERE date = ? AND status = 'completed'", (today,))
+    checked_in_only = db.query_value("SELECT COUNT(*) FROM attendance WHERE date = ? AND status = 'checked_in'", (today,))
+    week_start = today - timedelta(days=today.weekday())
+    present_this_week = db.query_value("SELECT COUNT(DISTINCT finger_id) FROM attendance WHERE date >= ?", (week_start,))
+    month_start = today.replace(day=1)
+    present_this_month = db.query_value("SELECT COUNT(DISTINCT finger_id) FROM attendance WHERE date >= ?", (month_start,))
+    dept_stats = db.query("""SELECT u.department, COUNT(DISTINCT a.finger_id) as present_count
+                FROM users u
+                LEFT JOIN attendance a ON u.finger_id = a.finger_id AND a.date = ?
+                WHERE u.department IS NOT NULL
+                GROUP BY u.department""", (today,))
+    return (total_users, present_today, completed_today, checked_in_only,
+            present_this_week, present_this_month, dept_stats)
+
+
+def bench_statistics(args):
+    """Reports tab statistics latency: one query per figure vs. the statistics engine"""
+    from stats import attendance_statistics
+
+    workdir, path = prepare_db(None, args.users)
+    try:
+        conn = sqlite3.connect(path)
+        seed_attendance(conn, args.users, 0, args.rows)
+        # A newcomer who has only come in today
+        conn.execute("INSERT INTO users VALUES (?, 'Newcomer', 30, ?)", (args.users, DEPARTMENTS[0]))
+        conn.execute("INSERT INTO attendance (finger_id, date, status) VALUES (?, ?, 'checked_in')",
+                     (args.users, date.today().isoformat()))
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.close()
+        db = Database(path)
+        today = date.today()
+
+        old = original_statistics(db, today)
+        new = attendance_statistics(db, today)
+        assert old[:6] == (new.total_users, new.present, new.completed, new.checked_in,
+                           new.present_week, new.present_month), "statistics differ"
+
+        # The week and month of a past day stop at that day
+        past = today - timedelta(days=40)
+        stats = attendance_statistics(db, past)
+        for start, counted in ((past - timedelta(days=past.weekday()), stats.present_week),
+                               (past.replace(day=1), stats.present_month)):
+            expected = db.query_value("SELECT COUNT(DISTINCT finger_id) FROM attendance WHERE date BETWEEN ? AND ?",
+                                      (start.isoformat(), past.isoformat()))
+            assert counted == expected, f"{past}: counted {counted} users since {start}, expected {expected}"
+
+        for label, run in (("one query per figure", lambda: original_statistics(db, today)),
+                           ("statistics engine", lambda: attendance_statistics(db, today)),
+                           ("engine with history", lambda: attendance_statistics(db, today, history=True))):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                run()
+            elapsed = (time.perf_counter() - start) / args.repeat
+            print(f"{label:<22} {elapsed * 1000:8.2f} ms per refresh  ({args.rows} attendance rows)")
+        db.close()
+    finally:
+        shutil.rmtree(workdir)
+
+
+def original_history_reports(db):
+    """Per-department records and the per-user summary read from the attendance table"""
+    records = db.query("SELECT department, COUNT(*) FROM attendance GROUP BY department")
+    users = db.query("""
+        SELECT u.name, u.department,
+               COUNT(a.finger_id) as days_present,
+               SUM(CASE WHEN a.status = 'completed' THEN 1 ELSE 0 END) as days_completed,
+               AVG(CASE WHEN a.check_in_time IS NOT NULL AND a.check_out_time IS NOT NULL
+                   THEN (julianday(a.check_out_time) - julianday(a.check_in_time)) * 24
+                   ELSE NULL END) as avg_hours
+        FROM users u
+        LEFT JOIN attendance a ON u.finger_id = a.finger_id
+        GROUP BY u.finger_id
+        ORDER BY days_present DESC""")
+    return records, users
+
+
+def bench_rollups(args):
+    """History reports (department records, user summary) vs. history size: attendance table vs. rollups"""
+    from stats import attendance_statistics, user_statistics
+
+    workdir, path = prepare_db(None, args.users)
+    try:
+        conn = sqlite3.connect(path)
+        seeded = 0
+        print(f"{'rows':>10}  {'attendance table':>16}  {'rollups':>10}")
+        for size in sorted(args.sizes):
+            # Rows go through the rollup triggers like scans do
+            seed_attendance(conn, args.users, seeded, size)
+            seeded = size
+            db = Database(path)
+            timings = []
+            for run in (lambda: original_history_reports(db),
+                        lambda: (attendance_statistics(db, history=True), user_statistics(db))):
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    run()
+                timings.append((time.perf_counter() - start) / args.repeat * 1000)
+            db.close()
+            print(f"{size:>10}  {timings[0]:>13.1f} ms  {timings[1]:>7.1f} ms")
+        conn.close()
+    finally:
+        shutil.rmtree(workdir)
+
+
+# Hours worked computed from the text timestamps, as reports did before
+# schema version 6, and read from the worked_seconds column
+JULIANDAY_HOURS = "(julianday(a.check_out_time) - julianday(a.check_in_time)) * 24"
+WORKED_SECONDS_HOURS = "a.worked_seconds / 3600.0"
+
+
+def hours_export(db, hours):
+    """The history CSV export with hours worked per record"""
+    return db.query(f"""
+        SELECT u.name, u.department, a.check_in_time, a.check_out_time, a.date, a.status,
+               printf('%.2f', {hours}) AS hours_worked
+        FROM users u
+        LEFT JOIN attendance a ON u.finger_id = a.finger_id""")
+
+
+def hours_per_user(db, hours):
+    """Average and total hours of every user over the whole history"""
+    return db.query(f"SELECT a.finger_id, AVG({hours}), SUM({hours}) FROM attendance a GROUP BY a.finger_id")
+
+
+def bench_hours(args):
+    """Worked-hours report queries on a multi-year history: julianday() vs. worked_seconds"""
+    workdir, path = prepare_db(None, args.users)
+    try:
+        conn = sqlite3.connect(path)
+        seeded = 0
+        print(f"{'years':>5}  {'rows':>9}  {'query':<9}  {'julianday':>10}  {'worked_seconds':>14}")
+        for years in sorted(args.years):
+            size = years * 365 * args.users
+            seed_attendance(conn, args.users, seeded, size)
+            seeded = size
+            db = Database(path)
+            for label, report in (("export", hours_export), ("per user", hours_per_user)):
+                timings = []
+                for hours in (JULIANDAY_HOURS, WORKED_SECONDS_HOURS):
+                    start = time.perf_counter()
+                    for _ in range(args.repeat):
+                        report(db, hours)
+                    timings.append((time.perf_counter() - start) / args.repeat * 1000)
+                print(f"{years:>5}  {size:>9}  {label:<9}  {timings[0]:>7.1f} ms  {timings[1]:>11.1f} ms")
+            db.close()
+        conn.close()
+    finally:
+        shutil.rmtree(workdir)
+
+
+def original_export_csv(db, filename):
+    """export_csv as it was: fetchall() of the whole join, then write"""
+    select = ", ".join(expression for heading, expression in CSV_COLUMNS)
+    rows = db.query(f"""SELECT {select} FROM users u LEFT JOIN attendance a ON u.finger_id = a.finger_id
+                        ORDER BY a.date DESC, a.check_in_time DESC""")
+    with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow([heading for heading, expression in CSV_COLUMNS])
+        for row in rows:
+            writer.writerow(row)
+    return len(rows)
+
+
+def bench_export(args):
+    """Full-history CSV export: fetchall() then write vs. streamed chunks (time and peak Python memory)"""
+    workdir, path = prepare_db(None, args.users)
+    try:
+        conn = sqlite3.connect(path)
+        # Seed without the rollup triggers; the export doesn't read the rollups
+        drop_rollup_triggers(conn.cursor())
+        seed_attendance(conn, args.users, 0, args.rows)
+        conn.close()
+        db = Database(path)
+        filename = os.path.join(workdir, "export.csv")
+        progress = lambda done, total: None
+        # Streamed first: at millions of rows the original may run out of memory
+        for label, export in (("streamed", lambda: write_csv(db, filename, progress=progress,
+                                                             chunk_size=args.chunk_size)),
+                              ("fetchall + write", lambda: original_export_csv(db, filename))):
+            start = time.perf_counter()
+            rows = export()
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            export()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{label:<18} {rows:>9} rows  {elapsed:7.1f} s  {rows / elapsed:>9,.0f} rows/s  "
+                  f"peak {peak / 2 ** 20:8.1f} MiB  ({os.path.getsize(filename) / 2 ** 20:.0f} MiB file)",
+                  flush=True)
+        db.close()
+    finally:
+        shutil.rmtree(workdir)
+
+
+def disk_usage(path):
+    """Bytes used by a file or all files under a directory"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(folder, name))
+               for folder, dirs, files in os.walk(path) for name in files)
+
+
+def bench_columnar(args):
+    """History export to CSV vs. month-partitioned Parquet and Arrow IPC: write time, size and re-read time"""
+    import pyarrow.csv
+    import pyarrow.dataset
+
+    workdir, path = prepare_db(None, args.users)
+    try:
+        conn = sqlite3.connect(path)
+        drop_rollup_triggers(conn.cursor())
+        seed_attendance(conn, args.users, 0, args.rows)
+        conn.close()
+        db = Database(path)
+        print(f"{'format':<8} {'write':>8}  {'rows/s':>9}  {'size':>9}  {'read back':>9}")
+        for name, export, read in (
+                ("csv", lambda out: write_csv(db, out),
+                 lambda out: pyarrow.csv.read_csv(out)),
+                ("parquet", lambda out: write_columnar(db, out, 'parquet'),
+                 lambda out: pyarrow.dataset.dataset(os.path.join(out, "attendance"), format='parquet',
+                                                     partitioning='hive').to_table()),
+                ("arrow", lambda out: write_columnar(db, out, 'arrow'),
+                 lambda out: pyarrow.dataset.dataset(os.path.join(out, "attendance"), format='ipc',
+                                                     partitioning='hive').to_table())):
+            out = os.path.join(workdir, f"export_{name}")
+            start = time.perf_counter()
+            rows = export(out)
+            written = time.perf_counter() - start
+            start = time.perf_counter()
+            table = read(out)
+            parsed = time.perf_counter() - start
+            print(f"{name:<8} {written:>6.1f} s  {rows / written:>9,.0f}  {disk_usage(out) / 2 ** 20:>5.1f} MiB  "
+                  f"{parsed * 1000:>6.0f} ms  ({table.num_rows} rows)")
+        db.close()
+    finally:
+        shutil.rmtree(workdir)
+
+
+def measure_ticks(until, interval=0.016):
+    """Sleep interval-second ticks on this thread until until() and return how late each one was"""
+    delays = []
+    while not until():
+        start = time.perf_counter()
+        time.sleep(interval)
+        delays.append(time.perf_counter() - start - interval)
+    return sorted(delays)
+
+
+def bench_reports(args):
+    """16 ms ticks of a GUI-process thread while a large PDF renders in a thread vs. a worker process"""
+    from reports import ReportJobs, daily_report, render
+
+    workdir, path = prepare_db(None, args.users)
+    try:
+        conn = sqlite3.connect(path)
+        seed_attendance(conn, args.users, 0, args.users)
+        conn.close()
+        filename = os.path.join(workdir, "report.pdf")
+
+        def in_thread():
+            worker = threading.Thread(target=render, args=(daily_report, path, filename, ()))
+            worker.start()
+            return worker.is_alive, lambda: None
+
+        def in_process():
+            jobs = ReportJobs(path, workers=1)
+            job = jobs.submit("Daily report", daily_report, filename)
+            return lambda: not job.finished, jobs.shutdown
+
+        for label, run in (("thread", in_thread), ("worker process", in_process)):
+            start = time.perf_counter()
+            running, finish = run()
+            delays = measure_ticks(lambda: not running())
+            elapsed = time.perf_counter() - start
+            finish()
+            pages = os.path.getsize(filename) and open(filename, 'rb').read().count(b"/Type /Page\n")
+            print(f"{label:<15} {elapsed:6.1f} s  {pages} pages  ticks late: median "
+                  f"{delays[len(delays) // 2] * 1000:6.1f} ms  p99 {delays[int(len(delays) * 0.99)] * 1000:6.1f} ms  "
+                  f"max {delays[-1] * 1000:7.1f} ms")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def original_datewise_pdf(db, filename, selected_date):
+    """The date-wise detail table as it was rendered: one Table from fetchall()"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Table
+    from reports import DETAIL_TABLE_STYLE
+
+    rows = db.query("""SELECT u.name, u.department, a.check_in_time, a.check_out_time, a.status,
+                              CASE WHEN a.worked_seconds IS NOT NULL
+                                  THEN printf('%.2f', a.worked_seconds / 3600.0) ELSE 'N/A' END
+                       FROM users u LEFT JOIN attendance a ON u.finger_id = a.finger_id AND a.date = ?
+                       ORDER BY u.name""", (selected_date,))
+    table_data = [['Name', 'Department', 'Check-in', 'Check-out', 'Status', 'Hours']]
+    for name, dept, check_in, check_out, status, hours in rows:
+        table_data.append([name, dept or 'N/A', check_in.split()[1][:5] if check_in else "N/A",
+                           check_out.split()[1][:5] if check_out else "N/A", status or 'Absent', hours])
+    doc = SimpleDocTemplate(filename, pagesize=A4)
+    doc.build([Table(table_data, style=DETAIL_TABLE_STYLE)])
+
+
+def timed_pdf(path, filename, streamed):
+    """Render the date-wise report of today and return (seconds, peak RSS in MiB) of this process"""
+    import resource
+    from reports import datewise_report
+
+    db = Database(path)
+    start = time.perf_counter()
+    if streamed:
+        datewise_report(db, filename, date.today().isoformat(), 'All', 'All')
+    else:
+        original_datewise_pdf(db, filename, date.today().isoformat())
+    elapsed = time.perf_counter() - start
+    db.close()
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_pdf(args):
+    """Date-wise PDF report of N rows: one big Table from fetchall() vs. streamed page-sized Tables"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'rows':>8}  {'single table':>22}  {'streamed':>22}")
+    for rows in sorted(args.rows):
+        workdir, path = prepare_db(None, rows)
+        try:
+            conn = sqlite3.connect(path)
+            seed_attendance(conn, rows, 0, rows)
+            conn.close()
+            results = []
+            for streamed in (False, True):
+                if not streamed and rows > args.max_single:
+                    results.append("skipped")
+                    continue
+                # A fresh process per run so the peak RSS is the report's own
+                with ProcessPoolExecutor(1, mp_context=context) as pool:
+                    elapsed, peak = pool.submit(timed_pdf, path, os.path.join(workdir, "report.pdf"),
+                                                streamed).result()
+                results.append(f"{elapsed:7.1f} s {peak:7.0f} MiB")
+            print(f"{rows:>8}  {results[0]:>22}  {results[1]:>22}", flush=True)
+        finally:
+            shutil.rmtree(workdir)
+
+
+def bench_cache(args):
+    """Date-wise PDF report of N users: rendered, copied from the report cache, re-rendered after a change"""
+    from reports import ReportJobs, datewise_report
+
+    today = date.today().isoformat()
+    print(f"{'users':>8}  {'render':>10}  {'cache hit':>10}  {'after change':>12}")
+    for users in sorted(args.users):
+        workdir, path = prepare_db(None, users)
+        try:
+            conn = sqlite3.connect(path)
+            seed_attendance(conn, users, 0, users)
+            conn.close()
+            db = Database(path)
+            jobs = ReportJobs(path, workers=1, cache=ReportCache(db, os.path.join(workdir, "cache")))
+            # Start the worker before timing anything
+            jobs.submit("warm-up", datewise_report, os.path.join(workdir, "warm.pdf"),
+                        "2000-01-01", 'All', 'All').future.result()
+
+            def timed_submit(name):
+                start = time.perf_counter()
+                job = jobs.submit(name, datewise_report, os.path.join(workdir, f"{name}.pdf"), today, 'All', 'All')
+                if job.future is not None:
+                    job.future.result()
+                return time.perf_counter() - start
+
+            cold = timed_submit("cold")
+            time.sleep(0.2)  # let the done callback index the file
+            hit = timed_submit("hit")
+            db.execute("UPDATE attendance SET status = 'checked_in' WHERE finger_id = 0 AND date = ?", (today,))
+            changed = timed_submit("changed")
+            print(f"{users:>8}  {cold * 1000:>8.0f}ms  {hit * 1000:>8.1f}ms  {changed * 1000:>10.0f}ms")
+            jobs.shutdown()
+            db.close()
+        finally:
+            shutil.rmtree(workdir)
+
+
+async def api_client(host, port, urls, deadline, latencies, headers, etags):
+    """Send GETs for urls round-robin over one keep-alive connection until deadline"""
+    import asyncio
+
+    reader, writer = await asyncio.open_connection(host, port)
+    i = 0
+    while time.monotonic() < deadline:
+        url = urls[i % len(urls)]
+        i += 1
+        extra = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        if etags is not None and url in etags:
+            extra += f"If-None-Match: {etags[url]}\r\n"
+        start = time.perf_counter()
+        writer.write(f"GET {url} HTTP/1.1\r\nHost: {host}\r\n{extra}\r\n".encode())
+        head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+        fields = dict(line.split(": ", 1) for line in head.split("\r\n")[1:] if ": " in line)
+        await reader.readexactly(int(fields.get("Content-Length", 0)))
+        latencies.append(time.perf_counter() - start)
+        if etags is not None and "ETag" in fields:
+            etags[url] = fields["ETag"]
+    writer.close()
+
+
+def run_api_load(host, port, urls, clients, duration, headers, etags=None):
+    """Requests per second and latencies of clients concurrent connections"""
+    import asyncio
+
+    latencies = []
+
+    async def load():
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(api_client(host, port, urls[i::clients] or urls, deadline, latencies,
+                                          headers, etags) for i in range(clients)))
+
+    asyncio.run(load())
+    latencies.sort()
+    return (len(latencies) / duration, latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000)
+
+
+def bench_api(args):
+    """Load test of the JSON API (api.py) on a seeded database: requests/second and latency"""
+    import socket
+    import subprocess
+    import sys
+
+    workdir, path = prepare_db(None, args.users)
+    server = None
+    try:
+        conn = sqlite3.connect(path)
+        seed_attendance(conn, args.users, 0, args.users * args.days)
+        conn.close()
+
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        server = subprocess.Popen([sys.executable, os.path.abspath("api.py"), "--db", path, "--port", str(port),
+                                   "--no-reports"], stdout=subprocess.PIPE, text=True, cwd=workdir)
+        server.stdout.readline()
+
+        rng = random.Random(1)
+        days = [(date.today() - timedelta(days=i)).isoformat() for i in range(args.days)]
+        mixed = []
+        for i in range(2000):
+            mixed += [f"/users/{rng.randrange(args.users)}",
+                      f"/attendance?date={rng.choice(days)}&limit=100",
+                      f"/statistics?date={rng.choice(days)}"]
+        repeated = ["/users?limit=100", "/attendance?limit=100", "/statistics",
+                    f"/attendance?date={days[-1]}&status=completed&limit=100"]
+        runs = [
+            ("distinct URLs", mixed, {}, None),
+            ("same URLs", repeated, {}, None),
+            ("same URLs, gzip", repeated, {"Accept-Encoding": "gzip"}, None),
+            ("If-None-Match (304)", repeated, {}, {}),
+        ]
+        print(f"{args.users} users, {args.days} days, {args.clients} connections, {args.duration}s per run")
+        print(f"{'run':<22}  {'req/s':>8}  {'p50':>8}  {'p99':>8}")
+        for label, urls, headers, etags in runs:
+            if etags is not None:
+                # Learn the ETags first, as a polling client would have
+                run_api_load("127.0.0.1", port, urls, 1, 0.2, headers, etags)
+            rate, p50, p99 = run_api_load("127.0.0.1", port, urls, args.clients, args.duration, headers, etags)
+            print(f"{label:<22}  {rate:>8.0f}  {p50:>6.1f}ms  {p99:>6.1f}ms")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(workdir)
+
+
+def render_reports_until(db, workdir, deadline):
+    """Render date-wise reports back to back on this thread, as a busy GUI would"""
+    from reports import datewise_report
+
+    while time.monotonic() < deadline:
+        datewise_report(db, os.path.join(workdir, "busy.pdf"), date.today().isoformat(), 'All', 'All')
+
+
+def bench_daemon(args):
+    """Scan capture with the GUI busy or gone: in-process pipeline vs. scanning daemon"""
+    import subprocess
+    import sys
+    from scan_daemon import ScanClient
+
+    workdir, path = prepare_db(None, args.users)
+    daemon = None
+    try:
+        db = Database(path)
+        print(f"{'run':<40}  {'scans/min':>9}  {'event p50':>9}  {'event p99':>9}")
+
+        # The pipeline in the GUI process, sharing it with report rendering
+        simulator = SimulatedSensor(enrolled=range(args.users), dwell=0.3)
+        simulator.present(*[i % args.users for i in range(100000)])
+        user_cache = UserCache(db)
+        user_cache.load()
+        today_attendance = TodayAttendance(db)
+        today_attendance.load()
+        pipeline = ScanPipeline(simulator, lambda finger_id, confidence, reader, scanned_at:
+                                today_attendance.record(user_cache.get(finger_id), scanned_at), lambda kind, data: None)
+        pipeline.start()
+        render_reports_until(db, workdir, time.monotonic() + args.duration)
+        pipeline.stop(wait=True)
+        print(f"{'in-process, rendering reports':<40}  {pipeline.counts['recorded'] / args.duration * 60:>9.1f}")
+
+        socket_path = os.path.join(workdir, "scan.sock")
+        daemon = subprocess.Popen([sys.executable, os.path.abspath("scan_daemon.py"), "--db", path,
+                                   "--socket", socket_path, "--sensor", "simulated",
+                                   "--simulate-users", str(args.users)],
+                                  stdout=subprocess.PIPE, text=True, cwd=workdir)
+        daemon.stdout.readline()
+
+        statuses, lags = [], []
+
+        def on_event(kind, data):
+            if kind == 'status':
+                statuses.append(data)
+            elif kind == 'recorded':
+                lags.append(time.time() - client.event_time)
+
+        client = ScanClient(on_event, socket_path).start()
+
+        def recorded():
+            count = len(statuses)
+            client.send('status')
+            while len(statuses) == count:
+                time.sleep(0.01)
+            return statuses[-1]['counts']['recorded']
+
+        while not client.connected:
+            time.sleep(0.01)
+        for label, busy in (("daemon, client idle", False), ("daemon, client rendering reports", True)):
+            lags.clear()
+            before = recorded()
+            if busy:
+                render_reports_until(db, workdir, time.monotonic() + args.duration)
+            else:
+                time.sleep(args.duration)
+            rate = (recorded() - before) / args.duration * 60
+            lags.sort()
+            p50 = f"{lags[len(lags) // 2] * 1000:7.1f}ms" if lags else "-"
+            p99 = f"{lags[int(len(lags) * 0.99)] * 1000:7.1f}ms" if lags else "-"
+            print(f"{label:<40}  {rate:>9.1f}  {p50:>9}  {p99:>9}")
+
+        # No client at all: the daemon keeps recording
+        before = recorded()
+        client.close()
+        time.sleep(args.duration)
+        client = ScanClient(on_event, socket_path).start()
+        while not client.connected:
+            time.sleep(0.01)
+        print(f"{'daemon, no client connected':<40}  {(recorded() - before) / args.duration * 60:>9.1f}")
+        client.close()
+        db.close()
+    finally:
+        if daemon is not None:
+            daemon.terminate()
+            daemon.wait()
+        shutil.rmtree(workdir)
+
+
+def bench_events(args):
+    """Per-scan cost of keeping the GUI's tables and figures current: re-query vs. apply events"""
+    from events import EventBus, record_attendance
+    from stats import LiveStatistics, attendance_statistics
+
+    workdir, path = prepare_db(None, args.users)
+    try:
+        conn = sqlite3.connect(path)
+        # History up to yesterday; every scan below is a check-in or check-out today
+        seed_attendance(conn, args.users, args.users, args.users * (args.days + 1))
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.close()
+        db = Database(path)
+        user_cache = UserCache(db)
+        user_cache.load()
+        department = DEPARTMENTS[0]
+        print(f"{args.users} users, {args.users * args.days} attendance rows, {args.scans} scans")
+
+        def requery(event):
+            # What a scan used to cost: today's rows for the recent
+            # attendance tree, the Reports tab and the date-wise summary
+            db.query("""SELECT id, name, department, check_in_time, check_out_time, status
+                        FROM attendance WHERE date = ? ORDER BY check_in_time DESC""",
+                     (date.today().strftime('%Y-%m-%d'),))
+            attendance_statistics(db)
+            attendance_statistics(db, None, department)
+
+        live, datewise = LiveStatistics(db), LiveStatistics(db, department)
+        live.load()
+        datewise.load()
+
+        def apply(event):
+            live.apply(event)
+            datewise.apply(event)
+
+        for label, subscriber in (("re-query per scan", requery), ("apply events", apply)):
+            # Scans of the previous run are undone so both see the same day
+            db.execute("DELETE FROM attendance WHERE date = ?", (date.today().strftime('%Y-%m-%d'),))
+            today_attendance = TodayAttendance(db)
+            today_attendance.load()
+            bus = EventBus()
+            spent = []
+
+            def timed(event, subscriber=subscriber):
+                start = time.perf_counter()
+                subscriber(event)
+                spent.append(time.perf_counter() - start)
+
+            bus.subscribe(timed)
+            for i in range(args.scans):
+                bus.publish(record_attendance(today_attendance, user_cache.get(i % args.users)))
+            spent.sort()
+            print(f"{label:<20} {sum(spent) / len(spent) * 1000:8.3f} ms mean  "
+                  f"{spent[len(spent) // 2] * 1000:8.3f} ms p50  {spent[int(len(spent) * 0.99)] * 1000:8.3f} ms p99")
+        assert live.stats == attendance_statistics(db), "live statistics differ"
+        assert datewise.stats == attendance_statistics(db, None, department), "live statistics differ"
+        db.close()
+    finally:
+        shutil.rmtree(workdir)
+
+
+def bench_readers(args):
+    """Aggregate scan throughput and record latency with several simulated readers on one database"""
+    from events import CHECK_IN, CHECK_OUT, DUPLICATE, record_attendance
+    from scanner import DEBOUNCE_SECONDS
+
+    print(f"{'readers':>7}  {'scans/min':>9}  {'record p50':>10}  {'record p99':>10}  "
+          f"{'debounced':>9}  {'cross-reader':>12}  recorded per reader")
+    for count in [int(n) for n in args.readers.split(",")]:
+        workdir, path = prepare_db(None, args.users)
+        try:
+            db = Database(path)
+            user_cache = UserCache(db)
+            user_cache.load()
+            today_attendance = TodayAttendance(db)
+            today_attendance.load()
+            scans, spent = collections.defaultdict(list), []
+
+            def record(finger_id, confidence, reader, scanned_at):
+                start = time.perf_counter()
+                event = record_attendance(today_attendance, user_cache.get(finger_id), reader, scanned_at)
+                spent.append(time.perf_counter() - start)
+                scans[finger_id].append((event.kind, reader, scanned_at))
+                return event
+
+            readers = {}
+            for index in range(count):
+                simulator = SimulatedSensor(enrolled=range(args.users), dwell=args.dwell)
+                # Everyone passes every reader, in a different order at each
+                people = list(range(args.users))
+                random.Random(index).shuffle(people)
+                simulator.present(*(people * (100000 // args.users)))
+                readers[f"reader-{index + 1}"] = simulator
+            pipeline = ScanPipeline(readers, record, lambda kind, data: None)
+            pipeline.start()
+            time.sleep(args.duration)
+            pipeline.stop(wait=True)
+
+            rows = db.query("""SELECT finger_id, check_in_epoch, check_out_epoch, check_in_reader, check_out_reader
+                               FROM attendance WHERE date = ?""", (today_attendance.day.strftime('%Y-%m-%d'),))
+            # One row per person and day however many readers they used
+            assert len({row[0] for row in rows}) == len(rows), "several rows for one person"
+            assert set(scans) == {row[0] for row in rows}, "scanned people differ from rows"
+            for finger_id, check_in, check_out, check_in_reader, check_out_reader in rows:
+                kinds = [kind for kind, reader, scanned_at in scans[finger_id]]
+                # The first scan at any reader checks in, the second at any
+                # reader (the same or another) checks out, later ones change nothing
+                assert kinds[:2] == [CHECK_IN, CHECK_OUT][:len(kinds)], f"{finger_id}: scans recorded as {kinds}"
+                assert set(kinds[2:]) <= {DUPLICATE}, f"{finger_id}: scans recorded as {kinds}"
+                assert check_in_reader == scans[finger_id][0][1], f"{finger_id}: check-in reader differs"
+                assert check_in == int(scans[finger_id][0][2].timestamp()), f"{finger_id}: check-in time differs"
+                assert (check_out is not None) == (len(kinds) > 1), f"{finger_id}: check-out not stored"
+                if check_out is not None:
+                    assert check_out >= check_in, f"{finger_id}: check-out before check-in"
+                    assert check_out_reader == scans[finger_id][1][1], f"{finger_id}: check-out reader differs"
+                    assert check_out == int(scans[finger_id][1][2].timestamp()), f"{finger_id}: check-out time differs"
+                # The debounce is shared: no reader records a finger another just recorded
+                times = [scanned_at for kind, reader, scanned_at in scans[finger_id]]
+                assert all((later - earlier).total_seconds() > DEBOUNCE_SECONDS - 0.1
+                           for earlier, later in zip(times, times[1:])), f"{finger_id}: scans not debounced"
+                assert today_attendance.state(finger_id) == ('completed' if check_out else 'checked_in'), \
+                    f"{finger_id}: in-memory state differs from the database"
+            completed = [row for row in rows if row[2] is not None]
+            cross = sum(row[3] != row[4] for row in completed)
+            if count > 1 and len(completed) >= 20:
+                # Everyone passes every reader in a different order
+                assert cross, "no check-out at another reader than the check-in"
+            db.close()
+
+            spent.sort()
+            per_reader = " ".join(str(counts["recorded"]) for counts in pipeline.metrics().values())
+            print(f"{count:>7}  {len(spent) / args.duration * 60:>9.1f}  {spent[len(spent) // 2] * 1000:>8.3f}ms  "
+                  f"{spent[int(len(spent) * 0.99)] * 1000:>8.3f}ms  {pipeline.counts['debounced']:>9}  "
+                  f"{cross:>12}  {per_reader}")
+        finally:
+            shutil.rmtree(workdir)
+
+
+def instant_simulator(users):
+    """A SimulatedSensor without command latency and with a finger that stays on it"""
+    simulator = SimulatedSensor(enrolled=range(users), dwell=1e9, capture_latency=0, convert_latency=0,
+                                search_latency=0, store_latency=0, transfer_latency=0)
+    simulator.present(users // 2)
+    return simulator
+
+
+def bench_driver(args):
+    """Per-command round trip over a pty-backed simulator: Adafruit (blocking) vs. asyncio driver"""
+    import asyncio
+    import serial
+    from adafruit_fingerprint import Adafruit_Fingerprint
+    from r307 import AsyncR307, BlockingR307
+    from sensor import PtySensorServer
+
+    commands = (("get_image", lambda finger: finger.get_image()),
+                ("image_2_tz", lambda finger: finger.image_2_tz(1)),
+                ("finger_search", lambda finger: finger.finger_search()),
+                ("upload template", lambda finger: finger.get_fpdata("char", 1)),
+                ("no reply (get_image)", lambda finger: finger.get_image()))
+
+    def adafruit(port):
+        uart = serial.Serial(port, baudrate=57600, timeout=1)
+        return uart, Adafruit_Fingerprint(uart)
+
+    def blocking_runs(finger, simulator):
+        for name, call in commands:
+            # The sensor stops answering for the last command
+            simulator.error_rate = 1.0 if name.startswith("no reply") else 0.0
+            spent = []
+            for _ in range(3 if simulator.error_rate else args.commands):
+                start = time.perf_counter()
+                try:
+                    call(finger)
+                except RuntimeError:
+                    pass
+                spent.append(time.perf_counter() - start)
+            yield name, sorted(spent)
+
+    async def async_runs(port, simulator):
+        # The coroutines awaited directly, as a service on the loop would
+        sensor = await AsyncR307.open(port)
+        runs = []
+        for name, call in commands:
+            simulator.error_rate = 1.0 if name.startswith("no reply") else 0.0
+            spent = []
+            for _ in range(3 if simulator.error_rate else args.commands):
+                start = time.perf_counter()
+                try:
+                    await call(sensor)
+                except RuntimeError:
+                    pass
+                spent.append(time.perf_counter() - start)
+            runs.append((name, sorted(spent)))
+        sensor.close()
+        return runs
+
+    drivers = ("adafruit", "asyncio (blocking)", "asyncio (in loop)")
+    results = {}
+    for driver in drivers:
+        simulator = instant_simulator(args.users)
+        server = PtySensorServer(simulator).start()
+        if driver == "asyncio (in loop)":
+            runs = asyncio.run(async_runs(server.port, simulator))
+        else:
+            uart, finger = adafruit(server.port) if driver == "adafruit" else (BlockingR307(server.port),) * 2
+            runs = list(blocking_runs(finger, simulator))
+            uart.close()
+        results.update(((name, driver), spent) for name, spent in runs)
+        server.stop()
+
+    print(f"{'p50 / p99':<22}" + "".join(f"  {driver:>20}" for driver in drivers))
+    for name, call in commands:
+        row = f"{name:<22}"
+        for driver in drivers:
+            spent = results[name, driver]
+            row += f"  {spent[len(spent) // 2] * 1000:>8.3f} /{spent[int(len(spent) * 0.99)] * 1000:>8.3f}ms"
+        print(row)
+
+    # Many sensors polled at once: a thread per sensor vs. one event loop
+    servers = [PtySensorServer(instant_simulator(args.users)).start() for _ in range(args.sensors)]
+    baseline = threading.active_count()
+    fingers = [adafruit(server.port) for server in servers]
+    counts = [0] * args.sensors
+    threads_used = []
+
+    def poll(index, deadline):
+        finger = fingers[index][1]
+        while time.perf_counter() < deadline:
+            finger.get_image()
+            counts[index] += 1
+
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=poll, args=(index, deadline)) for index in range(args.sensors)]
+    for thread in threads:
+        thread.start()
+    threads_used.append(threading.active_count() - baseline)
+    for thread in threads:
+        thread.join()
+    for uart, finger in fingers:
+        uart.close()
+    rates = [sum(counts) / args.duration]
+
+    async def poll_all():
+        sensors = [await AsyncR307.open(server.port) for server in servers]
+        total = 0
+
+        async def poll_one(sensor, deadline):
+            nonlocal total
+            while time.perf_counter() < deadline:
+                await sensor.get_image()
+                total += 1
+
+        deadline = time.perf_counter() + args.duration
+        tasks = asyncio.gather(*[poll_one(sensor, deadline) for sensor in sensors])
+        await asyncio.sleep(0)
+        threads_used.append(threading.active_count() - baseline)
+        await tasks
+        for sensor in sensors:
+            sensor.close()
+        return total / args.duration
+
+    rates.append(asyncio.run(poll_all()))
+    for server in servers:
+        server.stop()
+    print(f"\n{args.sensors} sensors polled for {args.duration:.0f} s")
+    for label, rate, used in zip(("thread per sensor (adafruit)", "one event loop (asyncio)"), rates, threads_used):
+        print(f"{label:<30} {rate:10.0f} get_image/s  {used:>3} extra threads")
+
+
+def bench_sync(args):
+    """Scan cost of the sync outbox, and catching up on days offline while scans continue"""
+    from sync import Aggregator, SyncAgent, enable_sync, serve
+
+    workdir, path = prepare_db(None, args.users)
+    server = None
+    try:
+        db = Database(path)
+        user_cache = UserCache(db)
+        user_cache.load()
+        today = date.today().strftime('%Y-%m-%d')
+
+        def scan_latencies(count):
+            spent = []
+            for i in range(count):
+                start = time.perf_counter()
+                today_attendance.record(user_cache.get(i % args.users))
+                spent.append(time.perf_counter() - start)
+            return sorted(spent)
+
+        def describe(spent):
+            return (f"p50 {spent[len(spent) // 2] * 1000:6.3f} ms  "
+                    f"p99 {spent[int(len(spent) * 0.99)] * 1000:6.3f} ms")
+
+        print(f"{args.users} users, {args.days} days offline")
+        for label in ("scan, no outbox", "scan, with outbox"):
+            with db.transaction() as c:
+                # A fresh database keeps no outbox until sync is enabled
+                if label == "scan, with outbox":
+                    enable_sync(c)
+                c.execute("DELETE FROM attendance WHERE date = ?", (today,))
+                c.execute("DELETE FROM sync_outbox")
+            today_attendance = TodayAttendance(db)
+            today_attendance.load()
+            print(f"{label:<34} {describe(scan_latencies(args.users * 2))}")
+
+        # Days of history recorded while the aggregator was unreachable
+        conn = sqlite3.connect(path)
+        seed_attendance(conn, args.users, args.users, args.users * (args.days + 1))
+        conn.close()
+        raw = db.query_value("SELECT SUM(LENGTH(data)) FROM sync_outbox")
+        central = Database(os.path.join(workdir, "central.db"))
+        server = serve(Aggregator(central), "127.0.0.1", 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        agent = SyncAgent(db, f"http://127.0.0.1:{server.server_port}", "bench")
+        pending = agent.pending()
+
+        # Keep scanning today's people while the backlog drains
+        db.execute("DELETE FROM attendance WHERE date = ?", (today,))
+        today_attendance = TodayAttendance(db)
+        today_attendance.load()
+        spent, done = [], threading.Event()
+
+        def scanning():
+            i = 0
+            while not done.is_set():
+                start = time.perf_counter()
+                today_attendance.record(user_cache.get(i % args.users))
+                spent.append(time.perf_counter() - start)
+                i += 1
+                time.sleep(0.005)
+
+        scanner = threading.Thread(target=scanning)
+        scanner.start()
+        start = time.perf_counter()
+        requests = 0
+        while agent.sync_once():
+            requests += 1
+        elapsed = time.perf_counter() - start
+        done.set()
+        scanner.join()
+        print(f"{'scan, while draining the backlog':<34} {describe(sorted(spent))}")
+        print(f"drained {pending} changes in {elapsed:.2f} s ({pending / elapsed:.0f} changes/s, "
+              f"{requests} requests), {agent.bytes_sent / 1024:.0f} KiB sent for {raw / 1024:.0f} KiB of JSON")
+
+        # Whatever the scans added meanwhile goes in the next sync
+        while agent.sync_once():
+            pass
+        local = db.query_value("SELECT COUNT(*) FROM attendance")
+        synced = central.query_value("SELECT COUNT(*) FROM site_attendance WHERE NOT deleted")
+        assert local == synced, f"{local} local rows, {synced} central"
+        central.close()
+        db.close()
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(workdir)
+
+
+def bench_journal(args):
+    """Journal append latency against a SQLite commit, group commit across readers and replay at start"""
+    from events import record_attendance
+    from journal import ScanJournal
+
+    def describe(spent):
+        spent.sort()
+        return (f"p50 {spent[len(spent) // 2] * 1000:7.3f} ms  "
+                f"p99 {spent[int(len(spent) * 0.99)] * 1000:7.3f} ms")
+
+    workdir, path = prepare_db(None, args.users)
+    journal_path = os.path.join(workdir, "scan_journal.bin")
+    try:
+        # What a scan waits for before the sensor stage can take the next one
+        db = Database(path)
+        user_cache = UserCache(db)
+        user_cache.load()
+        today_attendance = TodayAttendance(db)
+        today_attendance.load()
+        spent = []
+        for i in range(args.users * 2):
+            start = time.perf_counter()
+            record_attendance(today_attendance, user_cache.get(i % args.users))
+            spent.append(time.perf_counter() - start)
+        print(f"{'SQLite record (commit)':<32} {describe(spent)}")
+        db.execute("DELETE FROM attendance")
+        db.close()
+
+        journal = ScanJournal(journal_path)
+        spent = []
+        for i in range(args.users * 2):
+            start = time.perf_counter()
+            entry = journal.append(i % args.users, 100, "reader-1")
+            spent.append(time.perf_counter() - start)
+            journal.mark_applied(entry.seq)
+        print(f"{'journal append (synced)':<32} {describe(spent)}")
+
+        # Appends from several readers at once share a sync
+        syncs = journal.sync_count
+
+        def appending():
+            for i in range(args.appends):
+                journal.mark_applied(journal.append(i % args.users, 100, threading.current_thread().name).seq)
+
+        threads = [threading.Thread(target=appending, name=f"reader-{n}") for n in range(args.readers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        count = args.readers * args.appends
+        print(f"{f'journal append, {args.readers} threads':<32} {count / elapsed:8.0f} appends/s, "
+              f"{count / (journal.sync_count - syncs):.1f} appends per sync")
+        journal.close()
+        os.remove(journal_path)
+
+        # What a start after a crash spends recording the scans left in the journal
+        journal = ScanJournal(journal_path)
+        for i in range(args.users * 2):
+            journal.append(i % args.users, 100, "reader-1", wait=False)
+        db = Database(path)
+        user_cache = UserCache(db)
+        user_cache.load()
+        today_attendance = TodayAttendance(db)
+        today_attendance.load()
+        pipeline = ScanPipeline({}, lambda finger_id, confidence, reader, scanned_at: record_attendance(
+            today_attendance, user_cache.get(finger_id), reader, scanned_at), lambda kind, data: None,
+            journal=journal)
+        start = time.perf_counter()
+        pipeline.start()
+        pipeline.stop(wait=True)
+        elapsed = time.perf_counter() - start
+        print(f"{'replay at start':<32} {args.users * 2} entries in {elapsed * 1000:.1f} ms")
+        journal.close()
+        db.close()
+    finally:
+        shutil.rmtree(workdir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Attendance system benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    p = subparsers.add_parser("connections", help=bench_connections.__doc__)
+    p.add_argument("--db", default="users.db", help="database to copy (seeded if missing)")
+    p.add_argument("--users", type=int, default=128)
+    p.add_argument("--scans", type=int, default=2000)
+    p.set_defaults(func=bench_connections)
+
+    p = subparsers.add_parser("concurrency", help=bench_concurrency.__doc__)
+    p.add_argument("--db", default="users.db", help="database to copy (seeded if missing)")
+    p.add_argument("--users", type=int, default=128)
+    p.add_argument("--writers", type=int, default=4)
+    p.add_argument("--readers", type=int, default=2)
+    p.add_argument("--duration", type=float, default=5.0)
+    p.set_defaults(func=bench_concurrency)
+
+    p = subparsers.add_parser("indexes", help=bench_indexes.__doc__)
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000, 2000000])
+    p.add_argument("--lookups", type=int, default=50)
+    p.set_defaults(func=bench_indexes)
+
+    p = subparsers.add_parser("rollover", help=bench_rollover.__doc__)
+    p.add_argument("--users", type=int, default=500)
+    p.set_defaults(func=bench_rollover)
+
+    p = subparsers.add_parser("pipeline", help=bench_pipeline.__doc__)
+    p.add_argument("--users", type=int, default=128)
+    p.add_argument("--duration", type=float, default=15.0)
+    p.add_argument("--dwell", type=float, default=0.5, help="seconds each finger stays on the sensor")
+    p.add_argument("--ui-latency", type=float, default=0.05, help="seconds spent notifying the UI per scan")
+    p.add_argument("--sensor", choices=["simulated", "simulated-pty"], default="simulated",
+                   help="drive the simulator directly or through a pty with Adafruit_Fingerprint")
+    p.add_argument("--match-rate", type=float, default=1.0)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.set_defaults(func=bench_pipeline)
+
+    p = subparsers.add_parser("matching", help=bench_matching.__doc__)
+    p.add_argument("--sizes", type=int, nargs="+", default=[128, 1000, 5000, 20000])
+    p.add_argument("--probes", type=int, default=200)
+    p.set_defaults(func=bench_matching)
+
+    p = subparsers.add_parser("treeview", help=bench_treeview.__doc__)
+    p.add_argument("--users", type=int, default=5000)
+    p.add_argument("--duration", type=float, default=10.0)
+    p.add_argument("--interval", type=float, default=0.5, help="seconds between scan bursts")
+    p.add_argument("--burst", type=int, default=3, help="refreshes requested per burst")
+    p.set_defaults(func=bench_treeview)
+
+    p = subparsers.add_parser("paging", help=bench_paging.__doc__)
+    p.add_argument("--users", type=int, default=100000)
+    p.add_argument("--visible", type=int, default=30, help="rows in the table window")
+    p.add_argument("--windows", type=int, default=200, help="random scroll positions to read")
+    p.set_defaults(func=bench_paging)
+
+    p = subparsers.add_parser("statistics", help=bench_statistics.__doc__)
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--rows", type=int, default=1000000, help="attendance rows to seed")
+    p.add_argument("--repeat", type=int, default=20)
+    p.set_defaults(func=bench_statistics)
+
+    p = subparsers.add_parser("rollups", help=bench_rollups.__doc__)
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--sizes", type=int, nargs="+", default=[100000, 500000, 1000000])
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_rollups)
+
+    p = subparsers.add_parser("hours", help=bench_hours.__doc__)
+    p.add_argument("--users", type=int, default=200)
+    p.add_argument("--years", type=int, nargs="+", default=[1, 3, 5])
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_hours)
+
+    p = subparsers.add_parser("export", help=bench_export.__doc__)
+    p.add_argument("--users", type=int, default=1000)
+    p.add_argument("--rows", type=int, default=5000000)
+    p.add_argument("--chunk-size", type=int, default=5000)
+    p.set_defaults(func=bench_export)
+
+    p = subparsers.add_parser("columnar", help=bench_columnar.__doc__)
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--rows", type=int, default=1000000)
+    p.set_defaults(func=bench_columnar)
+
+    p = subparsers.add_parser("reports", help=bench_reports.__doc__)
+    p.add_argument("--users", type=int, default=19000, help="rows in the daily report (~500 pages)")
+    p.set_defaults(func=bench_reports)
+
+    p = subparsers.add_parser("pdf", help=bench_pdf.__doc__)
+    p.add_argument("--rows", type=int, nargs="+", default=[10000, 50000, 200000])
+    p.add_argument("--max-single", type=int, default=50000,
+                   help="largest report rendered as a single Table")
+    p.set_defaults(func=bench_pdf)
+
+    p = subparsers.add_parser("cache", help=bench_cache.__doc__)
+    p.add_argument("--users", type=int, nargs="+", default=[1000, 5000, 20000])
+    p.set_defaults(func=bench_cache)
+
+    p = subparsers.add_parser("api", help=bench_api.__doc__)
+    p.add_argument("--users", type=int, default=2000)
+    p.add_argument("--days", type=int, default=90)
+    p.add_argument("--clients", type=int, default=16, help="concurrent keep-alive connections")
+    p.add_argument("--duration", type=float, default=5)
+    p.set_defaults(func=bench_api)
+
+    p = subparsers.add_parser("daemon", help=bench_daemon.__doc__)
+    p.add_argument("--users", type=int, default=100)
+    p.add_argument("--duration", type=float, default=20)
+    p.set_defaults(func=bench_daemon)
+
+    p = subparsers.add_parser("events", help=bench_events.__doc__)
+    p.add_argument("--users", type=int, default=5000)
+    p.add_argument("--days", type=int, default=60)
+    p.add_argument("--scans", type=int, default=2000)
+    p.set_defaults(func=bench_events)
+
+    p = subparsers.add_parser("readers", help=bench_readers.__doc__)
+    p.add_argument("--users", type=int, default=30, help="people passing the readers; few enough to come round again")
+    p.add_argument("--readers", default="1,2,4,6,8", help="comma-separated reader counts")
+    p.add_argument("--dwell", type=float, default=0.3, help="seconds each finger stays on a reader")
+    p.add_argument("--duration", type=float, default=10)
+    p.set_defaults(func=bench_readers)
+
+    p = subparsers.add_parser("driver", help=bench_driver.__doc__)
+    p.add_argument("--users", type=int, default=100)
+    p.add_argument("--commands", type=int, default=500, help="round trips per command and driver")
+    p.add_argument("--sensors", type=int, default=8)
+    p.add_argument("--duration", type=float, default=5)
+    p.set_defaults(func=bench_driver)
+
+    p = subparsers.add_parser("sync", help=bench_sync.__doc__)
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--days", type=int, default=14)
+    p.set_defaults(func=bench_sync)
+
+    p = subparsers.add_parser("journal", help=bench_journal.__doc__)
+    p.add_argument("--users", type=int, default=300)
+    p.add_argument("--readers", type=int, default=4, help="appending threads, and readers in the crashing process")
+    p.add_argument("--appends", type=int, default=2000, help="appends per thread")
+    p.set_defaults(func=bench_journal)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import threading
+
+
+class UserCache:
+    """In-memory copy of the users table indexed by finger_id.
+
+    Rows are kept in a list whose index is the finger ID, so a lookup
+    on the scan path is a single list access. The cache is loaded once
+    at startup and kept current by calling put()/remove() after each
+    write to the users table. Lookups for IDs that are not cached fall
+    back to the database, so rows added outside this process are still
+    found.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._slots = []
+        self._count = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """Replace the cache contents with every row of the users table"""
+        rows = self.db.query("SELECT finger_id, name, age, department FROM users")
+        size = max((row[0] for row in rows), default=-1) + 1
+        slots = [None] * size
+        for row in rows:
+            slots[row[0]] = tuple(row)
+        with self._lock:
+            self._slots = slots
+            self._count = len(rows)
+
+    def get(self, finger_id):
+        """Return (finger_id, name, age, department) or None if not registered"""
+        slots = self._slots
+        user = slots[finger_id] if 0 <= finger_id < len(slots) else None
+        if user is not None:
+            self.hits += 1
+            return user
+
+        self.misses += 1
+        row = self.db.query_one("SELECT finger_id, name, age, department FROM users WHERE finger_id = ?",
+                                (finger_id,))
+        if row:
+            self.put(*row)
+            return tuple(row)
+        return None
+
+    def put(self, finger_id, name, age, department):
+        """Add or replace a user after it has been written to the database"""
+        with self._lock:
+            slots = self._slots
+            if finger_id >= len(slots):
+                # Grow into a new list so concurrent readers never see a partial resize
+                slots = slots + [None] * (finger_id + 1 - len(slots))
+            if slots[finger_id] is None:
+                self._count += 1
+            slots[finger_id] = (finger_id, name, age, department)
+            self._slots = slots
+
+    def remove(self, finger_id):
+        """Drop a user after it has been deleted from the database"""
+        with self._lock:
+            if 0 <= finger_id < len(self._slots) and self._slots[finger_id] is not None:
+                self._slots[finger_id] = None
+                self._count -= 1
+
+    def __len__(self):
+        return self._count
+
+    def summary(self):
+        """Short description of the cache for the status bar"""
+        return f"User cache: {self._count} users, {self.hits} hits, {self.misses} misses"
@@ -0,0 +1,219 @@
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+# Database file used by the GUI; override with ATTENDANCE_DB for testing
+DB_PATH = os.environ.get("ATTENDANCE_DB", "users.db")
+
+# Number of compiled statements kept per connection
+STATEMENT_CACHE_SIZE = 128
+
+# Pragmas applied to every connection. WAL lets report queries read while
+# the scanner writes; NORMAL sync is durable across application crashes
+# and only risks the last commits on power loss.
+CONNECTION_PRAGMAS = [
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -8000",       # 8 MB page cache
+    "PRAGMA mmap_size = 67108864",     # 64 MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+]
+
+# Seconds a connection waits on a lock before raising "database is locked"
+BUSY_TIMEOUT = 10
+
+# Pending writes allowed before submit() blocks the caller
+WRITE_QUEUE_SIZE = 256
+
+# Most queued writes committed together in one transaction
+WRITE_BATCH_SIZE = 64
+
+_STOP = object()
+
+
+class Database:
+    """Long-lived SQLite connections shared by the GUI and scanning threads.
+
+    All writes go through a single writer connection guarded by a lock.
+    Each reading thread gets its own connection, created on first use and
+    kept open for the life of the application, so statements compiled by
+    sqlite3 are reused across calls instead of being re-prepared.
+
+    Writes submitted with submit()/write() are applied by a dedicated
+    writer thread that commits everything queued so far in one
+    transaction, so bursts of check-ins share a single fsync.
+    """
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._writer = self._connect(isolation_level=None)
+        self._writer.execute("PRAGMA journal_mode = WAL")
+        self._closed = False
+        self._queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._writer_thread = threading.Thread(target=self._write_loop, name="db-writer")
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+
+    def _connect(self, isolation_level=""):
+        """Open a new connection to the database file"""
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE,
+                               isolation_level=isolation_level)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def reader(self):
+        """Return the read connection owned by the calling thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Database has been closed")
+            conn = self._connect()
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    def query(self, sql, params=()):
+        """Run a read query and return all rows"""
+        return self.reader().execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        """Run a read query and return the first row or None"""
+        return self.reader().execute(sql, params).fetchone()
+
+    def query_value(self, sql, params=()):
+        """Run a read query and return the first column of the first row"""
+        row = self.query_one(sql, params)
+        return row[0] if row else None
+
+    def stream(self, sql, params=(), size=1000):
+        """Run a read query and yield its rows in lists of up to size rows.
+
+        The query runs on a connection of its own, opened for the call and
+        closed when the generator finishes, so a long export neither holds
+        every row in memory nor ties up the calling thread's reader.
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    def execute(self, sql, params=()):
+        """Run a single write statement on the writer thread and wait for it"""
+        return self.write(lambda c: c.execute(sql, params).lastrowid)
+
+    @contextmanager
+    def transaction(self):
+        """Yield a cursor on the writer connection inside one transaction.
+
+        Reads done through this cursor see the writer's own uncommitted
+        changes, so read-modify-write sequences stay consistent.
+        """
+        with self._write_lock:
+            c = self._writer.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                yield c
+                c.execute("COMMIT")
+            except Exception:
+                c.execute("ROLLBACK")
+                raise
+            finally:
+                c.close()
+
+    def submit(self, func, *args):
+        """Queue func(cursor, *args) for the writer thread.
+
+        Returns a Future resolved with func's return value once the batch
+        containing it has been committed. Blocks while the queue is full.
+        """
+        if self._closed:
+            raise sqlite3.ProgrammingError("Database has been closed")
+        future = Future()
+        self._queue.put((future, func, args))
+        return future
+
+    def write(self, func, *args):
+        """Run func(cursor, *args) on the writer thread and wait for the commit"""
+        return self.submit(func, *args).result()
+
+    def _write_loop(self):
+        """Apply queued writes, committing each batch as one transaction"""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = any(job is _STOP for job in batch)
+            jobs = [job for job in batch if job is not _STOP]
+            if jobs:
+                self._apply_batch(jobs)
+            if stop:
+                return
+
+    def _apply_batch(self, jobs):
+        """Run each job in its own savepoint inside a single transaction"""
+        results = []
+        with self._write_lock:
+            c = self._writer.cursor()
+            try:
+                c.execute("BEGIN IMMEDIATE")
+                for future, func, args in jobs:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    c.execute("SAVEPOINT job")
+                    try:
+                        results.append((future, func(c, *args), None))
+                        c.execute("RELEASE job")
+                    except Exception as e:
+                        c.execute("ROLLBACK TO job")
+                        c.execute("RELEASE job")
+                        results.append((future, None, e))
+                c.execute("COMMIT")
+            except Exception as e:
+                if self._writer.in_transaction:
+                    self._writer.rollback()
+                for future, func, args in jobs:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            finally:
+                c.close()
+
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def close(self):
+        """Flush pending writes, then close every connection"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._writer_thread.join()
+        with self._write_lock:
+            self._writer.close()
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
+        self._local = threading.local()
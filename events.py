@@ -0,0 +1,140 @@
+"""Live attendance events.
+
+Every scan outcome that concerns a person is published on an EventBus
+as an AttendanceEvent: a check-in, a check-out, a duplicate scan of
+someone who already completed the day or of a scan already recorded, or
+a finger that matched the sensor library but belongs to no registered
+user. The GUI tables and
+statistics subscribe and apply each event to what they already show, so
+a scan never makes a widget query the database again; the JSON API
+streams the same events to dashboards as server-sent events.
+
+The bus numbers the events it publishes and keeps the last KEEP_EVENTS,
+so a subscriber that reconnects can ask for the ones it missed.
+"""
+import collections
+import threading
+import time
+from datetime import date, datetime
+
+# Event kinds
+CHECK_IN = 'check_in'
+CHECK_OUT = 'check_out'
+DUPLICATE = 'duplicate'
+UNKNOWN = 'unknown'
+
+# Kinds that change the attendance table
+ATTENDANCE_CHANGES = (CHECK_IN, CHECK_OUT)
+
+# Events kept for subscribers catching up
+KEEP_EVENTS = 1000
+
+DATE_FORMAT = '%Y-%m-%d'
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class AttendanceEvent(collections.namedtuple('AttendanceEvent', [
+        'kind', 'finger_id', 'name', 'department', 'date', 'check_in', 'check_out',
+        'record_id', 'time', 'reader', 'seq'], defaults=(None, None))):
+    """One scan outcome.
+
+    check_in and check_out are the attendance row's times after the scan
+    (TIME_FORMAT, check_out None while checked in); name, department and
+    the row fields are None for an UNKNOWN finger. time is the scan's
+    time.time(), reader the name of the reader it was taken at (None
+    with a single sensor) and seq the number the publishing bus gave the
+    event.
+    """
+
+    @property
+    def status(self):
+        """Attendance status after the scan, as stored in the attendance table"""
+        if self.check_in is None:
+            return None
+        return 'checked_in' if self.check_out is None else 'completed'
+
+    @property
+    def worked_seconds(self):
+        """Seconds between check-in and check-out, None until checked out"""
+        if self.check_out is None:
+            return None
+        return int((datetime.strptime(self.check_out, TIME_FORMAT)
+                    - datetime.strptime(self.check_in, TIME_FORMAT)).total_seconds())
+
+
+def record_attendance(today_attendance, user, reader=None, now=None):
+    """Record a scan of user (a users-table row) in a TodayAttendance and return its AttendanceEvent"""
+    action = today_attendance.record(user, now, reader)
+    record_id, check_in, check_out, status = today_attendance.entry(user[0])
+    kind = DUPLICATE if action in ('already_checked_out', 'already_recorded') else action
+    return AttendanceEvent(kind, user[0], user[1], user[3], today_attendance.day.strftime(DATE_FORMAT),
+                           check_in, check_out, record_id, time.time(), reader)
+
+
+def unknown_event(finger_id):
+    """AttendanceEvent of a finger matched by the sensor but not registered"""
+    return AttendanceEvent(UNKNOWN, finger_id, None, None, date.today().strftime(DATE_FORMAT),
+                           None, None, None, time.time())
+
+
+class EventBus:
+    """Publish/subscribe for AttendanceEvents within one process.
+
+    Subscribers are called on the publishing thread, which is a scan
+    pipeline or scan client thread; GUI subscribers pass the event on to
+    Tk with root.after. A subscriber that raises is reported and stays
+    subscribed.
+    """
+
+    def __init__(self, keep=KEEP_EVENTS):
+        self.seq = 0
+        self.recent = collections.deque(maxlen=keep)
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback, kinds=None, after=None):
+        """Call callback(event) for every event published from now on, or only those of kinds.
+
+        With after, the kept events numbered after it are passed to
+        callback first. Returns a token for unsubscribe().
+        """
+        token = (callback, frozenset(kinds) if kinds else None)
+        with self._lock:
+            self._subscribers.append(token)
+            if after is not None:
+                for event in self.recent:
+                    if event.seq > after:
+                        self._call(token, event)
+        return token
+
+    def unsubscribe(self, token):
+        with self._lock:
+            if token in self._subscribers:
+                self._subscribers.remove(token)
+
+    def publish(self, event):
+        """Number event, keep it and pass it to the subscribers; returns the numbered event"""
+        with self._lock:
+            self.seq += 1
+            event = event._replace(seq=self.seq)
+            self.recent.append(event)
+            subscribers = list(self._subscribers)
+        for token in subscribers:
+            self._call(token, event)
+        return event
+
+    def publish_scan(self, kind, data):
+        """Publish the event of a ScanPipeline notify(kind, data) outcome, if it has one"""
+        if kind == 'recorded':
+            return self.publish(data[1])
+        if kind == 'unknown':
+            return self.publish(unknown_event(data))
+        return None
+
+    def _call(self, token, event):
+        callback, kinds = token
+        if kinds is None or event.kind in kinds:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"Attendance event error: {e}")
@@ -0,0 +1,362 @@
+"""Streaming exports of the attendance history.
+
+Exports read the attendance table in chunks through Database.stream and
+write each chunk as it arrives, so memory use does not grow with the
+history. ExportJob runs an export on a background thread and reports
+progress to a callback; the GUIs forward it to the status bar with
+root.after.
+
+write_columnar() archives the history as Parquet or Arrow IPC files
+(requires pyarrow) partitioned by month:
+
+    <directory>/users.<ext>
+    <directory>/attendance/month=YYYY-MM/part-0.<ext>
+
+Run ``python3 export.py --help`` to export from the command line.
+"""
+import argparse
+import csv
+import itertools
+import os
+import shutil
+import threading
+import time
+
+# Rows fetched from SQLite and written per chunk
+EXPORT_CHUNK_SIZE = 5000
+
+# Attendance CSV columns: (heading, SQL expression over users u / attendance a)
+CSV_COLUMNS = [
+    ('Name', 'u.name'),
+    ('Department', 'u.department'),
+    ('Check-in Time', 'a.check_in_time'),
+    ('Check-out Time', 'a.check_out_time'),
+    ('Date', 'a.date'),
+    ('Status', 'a.status'),
+    ('Hours Worked', "CASE WHEN a.worked_seconds IS NOT NULL "
+                     "THEN printf('%.2f', a.worked_seconds / 3600.0) ELSE 'N/A' END"),
+]
+
+
+class ExportCancelled(Exception):
+    """Raised inside an export when its job has been cancelled"""
+
+
+def attendance_queries(columns, start=None, end=None, department=None):
+    """Return the [(sql, params)] queries producing an attendance export.
+
+    The first query reads the attendance records newest first, walking
+    the date index so no full sort of the history is needed; the second
+    adds one row of NULL attendance for every user without a record in
+    the range, as the LEFT JOIN of the original export did. start and
+    end are inclusive YYYY-MM-DD strings, None for an open range.
+    """
+    select = ", ".join(column[1] for column in columns)
+    conditions, params = [], []
+    if start:
+        conditions.append("a.date >= ?")
+        params.append(start)
+    if end:
+        conditions.append("a.date <= ?")
+        params.append(end)
+    user_conditions, user_params = [], []
+    if department:
+        user_conditions.append("u.department = ?")
+        user_params.append(department)
+
+    records_where = " AND ".join(conditions + user_conditions) or "1"
+    records = (f"""SELECT {select} FROM attendance a JOIN users u ON u.finger_id = a.finger_id
+                   WHERE {records_where}
+                   ORDER BY a.date DESC, a.check_in_time DESC""",
+               tuple(params + user_params))
+
+    absent_where = " AND ".join(conditions) or "1"
+    users_where = " AND ".join(user_conditions + [
+        f"NOT EXISTS (SELECT 1 FROM attendance a WHERE a.finger_id = u.finger_id AND {absent_where})"])
+    # Join an empty attendance row so the columns select NULL for these users
+    absent = (f"""SELECT {select} FROM users u LEFT JOIN (SELECT * FROM attendance LIMIT 0) a ON 1
+                  WHERE {users_where}
+                  ORDER BY u.name""",
+              tuple(user_params + params))
+    return [records, absent]
+
+
+def count_rows(db, queries):
+    """Total rows the export queries will return"""
+    total = 0
+    for sql, params in queries:
+        # Through stream() so export threads don't each keep a reader open
+        for chunk in db.stream(f"SELECT COUNT(*) FROM ({sql})", params):
+            total += chunk[0][0]
+    return total
+
+
+def stream_rows(db, queries, progress=None, cancelled=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the rows of queries chunk by chunk.
+
+    progress(done, total) is called after every chunk and cancelled() is
+    polled before each one; ExportCancelled is raised once it returns
+    True.
+    """
+    total = count_rows(db, queries) if progress else None
+    done = 0
+    for sql, params in queries:
+        for chunk in db.stream(sql, params, chunk_size):
+            if cancelled and cancelled():
+                raise ExportCancelled()
+            yield chunk
+            done += len(chunk)
+            if progress:
+                progress(done, total)
+
+
+def write_csv(db, filename, columns=CSV_COLUMNS, start=None, end=None, department=None,
+              progress=None, cancelled=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Stream the attendance export to filename and return the rows written.
+
+    Rows go to filename.part, which replaces filename only once the export
+    is complete, so a cancelled or failed export leaves no partial file.
+    """
+    queries = attendance_queries(columns, start, end, department)
+    partial = filename + ".part"
+    written = 0
+    try:
+        with open(partial, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow([heading for heading, expression in columns])
+            for chunk in stream_rows(db, queries, progress, cancelled, chunk_size):
+                writer.writerows(chunk)
+                written += len(chunk)
+        os.replace(partial, filename)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return written
+
+
+# Typed columns of the columnar attendance export:
+# (name, SQL expression, Arrow type name)
+COLUMNAR_COLUMNS = [
+    ('id', 'a.id', 'int64'),
+    ('finger_id', 'a.finger_id', 'int64'),
+    ('name', 'u.name', 'string'),
+    ('department', 'u.department', 'string'),
+    ('date', 'a.date', 'date'),
+    ('check_in_time', 'a.check_in_epoch', 'timestamp'),
+    ('check_out_time', 'a.check_out_epoch', 'timestamp'),
+    ('status', 'a.status', 'string'),
+    ('worked_seconds', 'a.worked_seconds', 'int64'),
+]
+
+USER_COLUMNS = [
+    ('finger_id', 'finger_id', 'int64'),
+    ('name', 'name', 'string'),
+    ('age', 'age', 'int64'),
+    ('department', 'department', 'string'),
+]
+
+COLUMNAR_FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+# Partition of records without a date, under the name Arrow's and Hive's
+# partition readers take for NULL
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+def _arrow_schema(pa, columns):
+    types = {'int64': pa.int64(), 'string': pa.string(),
+             'timestamp': pa.timestamp('s', tz='UTC'), 'date': pa.date32()}
+    return pa.schema([(name, types[kind]) for name, expression, kind in columns])
+
+
+def _record_batch(pa, schema, rows):
+    """Build a RecordBatch from a list of row tuples"""
+    arrays = []
+    for field, values in zip(schema, zip(*rows)):
+        if pa.types.is_integer(field.type) or pa.types.is_string(field.type):
+            arrays.append(pa.array(values, field.type))
+        else:
+            # Epoch seconds and YYYY-MM-DD strings are converted by Arrow
+            source = pa.int64() if pa.types.is_timestamp(field.type) else pa.string()
+            arrays.append(pa.array(values, source).cast(field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class _ColumnarFile:
+    """One Parquet or Arrow IPC file written a record batch at a time"""
+
+    def __init__(self, path, schema, format):
+        import pyarrow as pa
+
+        self.path = path
+        if format == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, schema, compression='zstd')
+        else:
+            self._sink = pa.OSFile(path, 'wb')
+            self._writer = pa.ipc.new_file(self._sink, schema,
+                                           options=pa.ipc.IpcWriteOptions(compression='zstd'))
+        self._format = format
+
+    def write(self, batch):
+        self._writer.write_batch(batch)
+
+    def close(self):
+        self._writer.close()
+        if self._format != 'parquet':
+            self._sink.close()
+
+
+def write_columnar(db, directory, format='parquet', start=None, end=None, department=None,
+                   progress=None, cancelled=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Stream the attendance history into month-partitioned columnar files.
+
+    Times are typed UTC timestamps taken from the epoch columns and dates
+    are date32. Records arrive newest first, so only the current month's
+    file is open at any time. Files are written to directory.part, which
+    replaces directory once the export is complete. Returns the number of
+    attendance rows written.
+    """
+    import pyarrow as pa
+
+    extension = COLUMNAR_FORMATS[format]
+    records = attendance_queries(COLUMNAR_COLUMNS, start, end, department)[0]
+    partial = directory.rstrip(os.sep) + ".part"
+    if os.path.exists(partial):
+        shutil.rmtree(partial)
+    written = 0
+    output = None
+    try:
+        os.makedirs(os.path.join(partial, "attendance"))
+
+        schema = _arrow_schema(pa, USER_COLUMNS)
+        users = _ColumnarFile(os.path.join(partial, "users" + extension), schema, format)
+        where, params = ("WHERE department = ?", (department,)) if department else ("", ())
+        for chunk in db.stream(f"SELECT {', '.join(column[1] for column in USER_COLUMNS)} FROM users {where}",
+                               params, chunk_size):
+            users.write(_record_batch(pa, schema, chunk))
+        users.close()
+
+        schema = _arrow_schema(pa, COLUMNAR_COLUMNS)
+        month = None
+        for chunk in stream_rows(db, [records], progress, cancelled, chunk_size):
+            # The date column is the 5th; rows of a month are contiguous, and
+            # rows without a date sort after all of them
+            for key, rows in itertools.groupby(chunk, key=lambda row: row[4][:7] if row[4] else NULL_PARTITION):
+                if key != month:
+                    if output is not None:
+                        output.close()
+                    month = key
+                    folder = os.path.join(partial, "attendance", f"month={month}")
+                    os.makedirs(folder, exist_ok=True)
+                    output = _ColumnarFile(os.path.join(folder, "part-0" + extension), schema, format)
+                rows = list(rows)
+                output.write(_record_batch(pa, schema, rows))
+                written += len(rows)
+        if output is not None:
+            output.close()
+            output = None
+
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.replace(partial, directory)
+    except BaseException:
+        if output is not None:
+            output.close()
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    return written
+
+
+def progress_text(label, done, total, elapsed):
+    """Status bar text such as 'Exporting CSV: 40% (2,000 of 5,000 rows), 3s left'"""
+    if not total:
+        return f"{label}: {done:,} rows"
+    percent = done * 100 // total
+    text = f"{label}: {percent}% ({done:,} of {total:,} rows)"
+    if done and elapsed > 0:
+        text += f", {int(elapsed * (total - done) / done)}s left"
+    return text
+
+
+class ExportJob:
+    """Run one export on a background thread.
+
+    target is called as target(*args, progress=..., cancelled=...), like
+    write_csv. on_progress(done, total, elapsed) and on_done(result,
+    error) are called from the worker thread, so GUI callers wrap them
+    in root.after. error is an ExportCancelled after cancel().
+    """
+
+    def __init__(self, target, *args, on_progress=None, on_done=None):
+        self.target = target
+        self.args = args
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self._cancel = threading.Event()
+        self._started = None
+        self._thread = threading.Thread(target=self._run, name="export")
+        self._thread.daemon = True
+
+    def start(self):
+        self._started = time.monotonic()
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Ask the export to stop after the chunk it is writing"""
+        self._cancel.set()
+
+    def running(self):
+        return self._thread.is_alive()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _progress(self, done, total):
+        if self.on_progress:
+            self.on_progress(done, total, time.monotonic() - self._started)
+
+    def _run(self):
+        result, error = None, None
+        try:
+            result = self.target(*self.args, progress=self._progress, cancelled=self._cancel.is_set)
+        except Exception as e:
+            error = e
+        if self.on_done:
+            self.on_done(result, error)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the attendance history")
+    parser.add_argument("format", choices=["csv"] + sorted(COLUMNAR_FORMATS))
+    parser.add_argument("output", help="CSV file, or directory for parquet/arrow")
+    parser.add_argument("--db", help="database file (default: ATTENDANCE_DB or users.db)")
+    parser.add_argument("--start", help="first date to export (YYYY-MM-DD)")
+    parser.add_argument("--end", help="last date to export (YYYY-MM-DD)")
+    parser.add_argument("--department")
+    args = parser.parse_args()
+
+    from database import DB_PATH, Database
+    from migrations import migrate
+
+    db = Database(args.db or DB_PATH)
+    with db.transaction() as c:
+        migrate(c)
+    started = time.monotonic()
+    progress = lambda done, total: print(
+        "\r" + progress_text("Exporting", done, total, time.monotonic() - started), end="", flush=True)
+    try:
+        if args.format == "csv":
+            rows = write_csv(db, args.output, start=args.start, end=args.end,
+                             department=args.department, progress=progress)
+        else:
+            rows = write_columnar(db, args.output, args.format, args.start, args.end,
+                                  args.department, progress=progress)
+    finally:
+        db.close()
+    print(f"\nExported {rows:,} attendance rows to {args.output} in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Crash-safe journal of recognised scans.
+
+A match is appended to the journal before it is recorded in SQLite, so
+a punch survives "database is locked", a full disk, an SD card error or
+the process being killed between the two. ScanPipeline's sensor stage
+appends and its record stage applies the journal to the database in
+order, retrying an entry that fails rather than dropping it; whatever
+is left when the application stops is applied when it starts again.
+
+The journal is a fixed-size file used as a ring buffer and accessed
+through mmap:
+
+    header   magic, capacity, offset and sequence number of the oldest
+             entry not yet applied
+    entries  length, CRC-32 and sequence number, then the payload
+             (scan time, finger ID, confidence, reader name)
+
+append() copies the entry into the mapping, where it already survives a
+crash of the process, and waits until a flusher thread has synced it to
+disk with msync; appends arriving while a sync runs share the next one.
+mark_applied() moves the head past an applied entry; the header is
+synced along with the next entries, so after a power cut the last few
+applied entries may be replayed. Recording a scan is idempotent for a
+given scan time (see TodayAttendance.record), which makes that
+harmless. On open the entries from the head on are read back until one
+has a bad length or checksum, or a sequence number that is not the next
+one, which is where the last append before the crash ended.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque, namedtuple
+
+# Journal file; override with ATTENDANCE_JOURNAL
+JOURNAL_PATH = os.environ.get("ATTENDANCE_JOURNAL", "scan_journal.bin")
+
+# Bytes of entries the ring holds: about 30,000 scans waiting for the
+# database
+JOURNAL_BYTES = 1024 * 1024
+
+# Seconds the flusher waits for more appends before syncing. Appends
+# arriving while a sync runs share the next one anyway, so by default it
+# syncs at once.
+SYNC_DELAY = 0
+
+MAGIC = b"ATJ1"
+HEADER = struct.Struct("<4sIQQQ")        # magic, version, capacity, head, head sequence
+HEADER_SIZE = 64
+ENTRY = struct.Struct("<IIQ")            # length, CRC-32 of sequence and payload, sequence
+PAYLOAD = struct.Struct("<dIH")          # scan time, finger ID, confidence
+WRAP = 0xFFFFFFFF                        # length marking the rest of the ring unused
+
+JournalEntry = namedtuple('JournalEntry', 'seq scanned_at finger_id confidence reader')
+
+
+class JournalFull(Exception):
+    """Raised by append() when entries not yet applied fill the ring"""
+
+
+class ScanJournal:
+    """Memory-mapped ring of scans waiting to be recorded in the database"""
+
+    def __init__(self, path=JOURNAL_PATH, capacity=JOURNAL_BYTES, sync_delay=SYNC_DELAY):
+        self.path = path
+        self.sync_delay = sync_delay
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # One process at a time: the GUI or the scanning daemon
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(self._fd)
+            raise RuntimeError(f"{path} is in use by another process") from None
+        size = os.fstat(self._fd).st_size
+        # A file cut short before its header was written is started afresh
+        exists = size > 0 and os.pread(self._fd, len(MAGIC), 0) != bytes(len(MAGIC))
+        if exists and size <= HEADER_SIZE:
+            os.close(self._fd)
+            raise ValueError(f"{path} is not a scan journal")
+        if exists:
+            capacity = size - HEADER_SIZE
+        else:
+            os.ftruncate(self._fd, HEADER_SIZE + capacity)
+        self.capacity = capacity
+        self._map = mmap.mmap(self._fd, HEADER_SIZE + capacity)
+        self._lock = threading.Condition()
+        self._entries = deque()
+        self.head, self.head_seq = HEADER_SIZE, 1
+        try:
+            if exists:
+                self._recover()
+            else:
+                self._write_header()
+                self._map.flush()
+        except Exception:
+            self._map.close()
+            os.close(self._fd)
+            raise
+        self.tail = self._entries[-1][1] if self._entries else self.head
+        self.next_seq = self._entries[-1][0].seq + 1 if self._entries else self.head_seq
+        self.synced_seq = self.next_seq - 1
+        self.sync_count = 0
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name="scan-journal")
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def _write_header(self):
+        self._map[:HEADER.size] = HEADER.pack(MAGIC, 1, self.capacity, self.head, self.head_seq)
+
+    def _recover(self):
+        magic, version, capacity, head, head_seq = HEADER.unpack(self._map[:HEADER.size])
+        if magic != MAGIC or capacity != self.capacity:
+            raise ValueError(f"{self.path} is not a scan journal")
+        self.head, self.head_seq = head, head_seq
+        position, seq = head, head_seq
+        # At most one lap of the ring can hold entries not yet applied
+        for _ in range(self.capacity):
+            entry, end = self._read(position, seq)
+            if entry is None:
+                break
+            if entry == WRAP:
+                position = HEADER_SIZE
+                continue
+            self._entries.append((entry, end))
+            position, seq = end, seq + 1
+
+    def _read(self, position, seq):
+        # Returns (entry, end), (WRAP, None) or (None, None) where the entries stop
+        end_of_ring = HEADER_SIZE + self.capacity
+        if position + ENTRY.size > end_of_ring:
+            return WRAP, None
+        length, crc, entry_seq = ENTRY.unpack_from(self._map, position)
+        if length == WRAP:
+            return WRAP, None
+        end = position + ENTRY.size + length
+        if entry_seq != seq or length < PAYLOAD.size or end > end_of_ring:
+            return None, None
+        payload = self._map[position + ENTRY.size:end]
+        if zlib.crc32(payload, zlib.crc32(struct.pack("<Q", seq))) != crc:
+            return None, None
+        scanned_at, finger_id, confidence = PAYLOAD.unpack_from(payload)
+        reader = payload[PAYLOAD.size:].decode() or None
+        return JournalEntry(seq, scanned_at, finger_id, confidence, reader), end
+
+    def _free(self):
+        if not self._entries:
+            return self.capacity
+        if self.tail > self.head:
+            return (HEADER_SIZE + self.capacity - self.tail) + (self.head - HEADER_SIZE)
+        return self.head - self.tail
+
+    def append(self, finger_id, confidence, reader=None, scanned_at=None, wait=True, timeout=0):
+        """Journal a match and return its JournalEntry once it is on disk.
+
+        With wait=False the entry is returned as soon as it is in the
+        mapping, which a process crash does not lose but a power cut can.
+        A full journal raises JournalFull, after waiting up to timeout
+        seconds for mark_applied() to make room.
+        """
+        payload = PAYLOAD.pack(scanned_at or time.time(), finger_id, confidence or 0) + (reader or "").encode()
+        size = ENTRY.size + len(payload)
+        end_of_ring = HEADER_SIZE + self.capacity
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise ValueError("Journal is closed")
+                position = self.tail
+                wrap = position + size > end_of_ring
+                # One byte is always left free, so a full ring never looks empty
+                needed = size + (end_of_ring - position if wrap else 0)
+                if needed < self._free():
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise JournalFull(f"{len(self._entries)} scans are waiting for the database")
+                self._lock.wait(remaining)
+            if wrap:
+                if position + ENTRY.size <= end_of_ring:
+                    ENTRY.pack_into(self._map, position, WRAP, 0, 0)
+                position = HEADER_SIZE
+            seq = self.next_seq
+            crc = zlib.crc32(payload, zlib.crc32(struct.pack("<Q", seq)))
+            self._map[position + ENTRY.size:position + size] = payload
+            ENTRY.pack_into(self._map, position, len(payload), crc, seq)
+            entry = JournalEntry(seq, *PAYLOAD.unpack_from(payload), reader or None)
+            if not self._entries:
+                self.head, self.head_seq = position, seq
+                self._write_header()
+            self._entries.append((entry, position + size))
+            self.tail = position + size
+            self.next_seq += 1
+            self._lock.notify_all()
+            while wait and self.synced_seq < seq and not self._closed:
+                self._lock.wait()
+        return entry
+
+    def pending(self):
+        """Entries appended but not yet marked applied, oldest first"""
+        with self._lock:
+            return [entry for entry, end in self._entries]
+
+    def wait(self, timeout=None):
+        """Wait until there is an entry to apply; returns whether there is one"""
+        with self._lock:
+            if not self._entries and not self._closed:
+                self._lock.wait(timeout)
+            return bool(self._entries)
+
+    def mark_applied(self, seq):
+        """Drop the entries up to seq, which have been recorded in the database"""
+        with self._lock:
+            while self._entries and self._entries[0][0].seq <= seq:
+                entry, end = self._entries.popleft()
+                self.head, self.head_seq = end, entry.seq + 1
+            if not self._entries:
+                self.head = self.tail
+            self._write_header()
+            self._lock.notify_all()
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                while self.synced_seq == self.next_seq - 1 and not self._closed:
+                    self._lock.wait()
+                if self._closed:
+                    return
+            if self.sync_delay:
+                # Let appends from other readers join this sync
+                time.sleep(self.sync_delay)
+            with self._lock:
+                target = self.next_seq - 1
+            # The header first, so a head it moved past reused space is on
+            # disk before the entries overwriting that space
+            self._map.flush(0, min(mmap.PAGESIZE, len(self._map)))
+            self._map.flush()
+            with self._lock:
+                self.synced_seq = target
+                self.sync_count += 1
+                self._lock.notify_all()
+
+    def close(self):
+        """Sync everything and close the file"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._lock.notify_all()
+        self._flusher.join()
+        self._map.flush()
+        self._map.close()
+        os.close(self._fd)
@@ -0,0 +1,259 @@
+"""Host-side fingerprint template library and 1:N matching.
+
+The R307 can only search the 128 templates in its own flash. With
+FINGERPRINT_MATCHING=host the templates live in the templates table
+instead and HostMatchingSensor does the 1:N search here: the probe's
+characteristic data is uploaded from the sensor, TemplateMatcher ranks
+the stored templates against it and the best candidates are downloaded
+back into the sensor for its own 1:1 compare, which makes the final
+match decision.
+
+The ranking is only a guess at which compares to try first: the R307's
+characteristic data is not a feature vector designed for cosine
+similarity, so on real hardware a genuine finger need not be among the
+best candidates. When none of them is confirmed up to FALLBACK_COMPARES
+more templates are compared in ranked order, trading scan time for
+recall: each compare downloads a 512-byte template over the serial link,
+about 0.1 s at 57600 baud, and every unregistered finger uses the whole
+budget.
+"""
+import os
+import threading
+
+import numpy as np
+
+from sensor import NOTFOUND, OK, PACKETRECIEVEERR
+
+# Candidates passed to the sensor's 1:1 compare first for each scan;
+# override with FINGERPRINT_TOP_K
+TOP_K = int(os.environ.get("FINGERPRINT_TOP_K", "3"))
+
+# Cosine similarity below which a stored template is not among those
+# candidates; override with FINGERPRINT_MIN_SCORE
+MIN_SCORE = float(os.environ.get("FINGERPRINT_MIN_SCORE", "0.3"))
+
+# Further templates compared, best ranked first, when no candidate is
+# confirmed; override with FINGERPRINT_FALLBACK_COMPARES. Off by default,
+# so a scan costs at most TOP_K compares; raise it when registered
+# fingers are turned away because the ranking missed them.
+FALLBACK_COMPARES = int(os.environ.get("FINGERPRINT_FALLBACK_COMPARES", "0"))
+
+# Random-hyperplane LSH used to prune the library before scoring. A
+# template is a candidate if its signature matches the probe's in any
+# table; similar templates share a signature far more often than
+# unrelated ones.
+LSH_TABLES = 16
+LSH_BITS = 10
+
+
+def _features(templates):
+    """Turn template bytes into mean-centred, unit-length float32 rows"""
+    rows = np.frombuffer(b"".join(templates), dtype=np.uint8).reshape(len(templates), -1)
+    rows = rows.astype(np.float32)
+    rows -= rows.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return rows / norms
+
+
+class TemplateMatcher:
+    """Vectorised 1:N search over a library of fingerprint templates.
+
+    Templates are kept as a matrix of normalised feature rows so scoring
+    the probe against every candidate is one matrix-vector product. The
+    matrix and the LSH buckets are rebuilt lazily on the first match
+    after templates are added or removed.
+    """
+
+    def __init__(self, templates=None, tables=LSH_TABLES, bits=LSH_BITS, seed=0):
+        self.tables = tables
+        self.bits = bits
+        self.seed = seed
+        self._templates = dict(templates or {})
+        self._lock = threading.Lock()
+        self._index = None
+        self._planes = None
+
+    @classmethod
+    def from_db(cls, db, **kwargs):
+        """Load every template stored in the templates table"""
+        rows = db.query("SELECT finger_id, template FROM templates") if db else []
+        return cls({row[0]: bytes(row[1]) for row in rows}, **kwargs)
+
+    def add(self, finger_id, template):
+        """Add or replace the template of finger_id"""
+        with self._lock:
+            self._templates[finger_id] = bytes(template)
+            self._index = None
+
+    def remove(self, finger_id):
+        """Drop the template of finger_id"""
+        with self._lock:
+            if self._templates.pop(finger_id, None) is not None:
+                self._index = None
+
+    def template(self, finger_id):
+        """Return the stored template bytes or None"""
+        return self._templates.get(finger_id)
+
+    def ids(self):
+        """Finger IDs with a stored template, in ascending order"""
+        return sorted(self._templates)
+
+    def __len__(self):
+        return len(self._templates)
+
+    def _signatures(self, rows):
+        # (tables, rows) array of integer signatures
+        bits = (np.einsum('tbd,nd->tnb', self._planes, rows) > 0).astype(np.int64)
+        return bits @ (1 << np.arange(self.bits, dtype=np.int64))
+
+    def _build(self):
+        with self._lock:
+            if self._index is not None:
+                return self._index
+            ids = np.array(sorted(self._templates), dtype=np.int64)
+            if not len(ids):
+                self._index = (ids, None, [])
+                return self._index
+            matrix = _features([self._templates[i] for i in ids])
+            if self._planes is None or self._planes.shape[2] != matrix.shape[1]:
+                rng = np.random.default_rng(self.seed)
+                self._planes = rng.standard_normal((self.tables, self.bits, matrix.shape[1])).astype(np.float32)
+            buckets = []
+            for signatures in self._signatures(matrix):
+                order = np.argsort(signatures, kind='stable')
+                keys, starts = np.unique(signatures[order], return_index=True)
+                buckets.append(dict(zip(keys.tolist(), np.split(order, starts[1:]))))
+            self._index = (ids, matrix, buckets)
+            return self._index
+
+    def match(self, probe, top_k=TOP_K, min_score=MIN_SCORE, prune=True):
+        """Return up to top_k (finger_id, score) pairs, best first.
+
+        With prune the probe is only scored against templates sharing an
+        LSH bucket with it; if none of those reaches min_score the whole
+        library is scanned so pruning never loses a match outright.
+        """
+        ids, matrix, buckets = self._build()
+        if matrix is None:
+            return []
+        vector = _features([bytes(probe)])[0]
+        if vector.shape[0] != matrix.shape[1]:
+            return []
+
+        candidates = None
+        if prune:
+            found = [bucket.get(int(signature)) for bucket, signature
+                     in zip(buckets, self._signatures(vector[None, :])[:, 0])]
+            found = [indexes for indexes in found if indexes is not None]
+            if found:
+                candidates = np.unique(np.concatenate(found))
+        results = self._rank(ids, matrix, vector, candidates, top_k, min_score)
+        if not results and candidates is not None:
+            results = self._rank(ids, matrix, vector, None, top_k, min_score)
+        return results
+
+    def _rank(self, ids, matrix, vector, candidates, top_k, min_score):
+        if candidates is None:
+            candidates = np.arange(len(ids))
+        scores = matrix[candidates] @ vector
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k)[:top_k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best])]
+        return [(int(ids[candidates[i]]), float(scores[i])) for i in best if scores[i] >= min_score]
+
+
+class HostMatchingSensor:
+    """Sensor wrapper that matches against the host template library.
+
+    finger_search() and the library commands (store_model, delete_model,
+    count_templates, read_templates) are handled on the host; everything
+    else is passed through to the wrapped sensor. finger_search() sends
+    the top_k candidates scoring at least min_score to the sensor's 1:1
+    compare and then up to fallback more templates, best ranked first.
+    compares counts the 1:1 compares of the last search.
+    """
+
+    def __init__(self, finger, matcher, db, top_k=TOP_K, min_score=MIN_SCORE,
+                 fallback=FALLBACK_COMPARES):
+        self.finger = finger
+        self.matcher = matcher
+        self.db = db
+        self.top_k = top_k
+        self.min_score = min_score
+        self.fallback = fallback
+        self.compares = 0
+        self.finger_id = None
+        self.confidence = None
+        self.template_count = None
+        self.templates = []
+
+    def __getattr__(self, name):
+        return getattr(self.finger, name)
+
+    def finger_search(self):
+        """Search the host library for the template in char buffer 1"""
+        probe = self.finger.get_fpdata("char", 1)
+        if not probe:
+            return PACKETRECIEVEERR
+        probe = bytes(probe)
+        self.compares = 0
+        candidates = [finger_id for finger_id, score in self.matcher.match(probe, self.top_k, self.min_score)]
+        for finger_id in candidates:
+            if self._confirm(finger_id):
+                return OK
+        if self.fallback > 0:
+            # Cosine similarity ranks raw R307 templates poorly; go on
+            # down the ranking of the whole library, within the budget
+            ranked = self.matcher.match(probe, len(candidates) + self.fallback, -1.0, prune=False)
+            for finger_id in [finger_id for finger_id, score in ranked
+                              if finger_id not in candidates][:self.fallback]:
+                if self._confirm(finger_id):
+                    return OK
+        return NOTFOUND
+
+    def _confirm(self, finger_id):
+        # Let the sensor confirm the candidate with its own 1:1 compare
+        self.compares += 1
+        self.finger.send_fpdata(list(self.matcher.template(finger_id)), "char", 2)
+        if self.finger.compare_templates() != OK:
+            return False
+        confidence = self.finger.confidence
+        if isinstance(confidence, tuple):
+            confidence = confidence[0]
+        self.finger_id, self.confidence = finger_id, confidence
+        return True
+
+    finger_fast_search = finger_search
+
+    def store_model(self, location, slot=1):
+        """Save the model in char buffer slot as the template of finger ID location"""
+        template = bytes(self.finger.get_fpdata("char", slot))
+        if not template:
+            return PACKETRECIEVEERR
+        self.db.execute("INSERT OR REPLACE INTO templates (finger_id, template) VALUES (?, ?)",
+                        (location, template))
+        self.matcher.add(location, template)
+        return OK
+
+    def delete_model(self, location):
+        self.db.execute("DELETE FROM templates WHERE finger_id = ?", (location,))
+        self.matcher.remove(location)
+        return OK
+
+    def empty_library(self):
+        self.db.execute("DELETE FROM templates")
+        for finger_id in self.matcher.ids():
+            self.matcher.remove(finger_id)
+        return OK
+
+    def count_templates(self):
+        self.template_count = len(self.matcher)
+        return OK
+
+    def read_templates(self):
+        self.templates = self.matcher.ids()
+        return OK
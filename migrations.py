@@ -0,0 +1,117 @@
+"""Versioned schema migrations for users.db.
+
+Each migration has a version number, a description and a list of steps;
+a step is either an SQL string or a function taking a cursor. migrate()
+applies every migration newer than the version recorded in the
+schema_version table, in order, on the cursor it is given.
+"""
+from report_cache import create_report_cache
+from rollups import TEXT_TIME_MEASURES, create_rollups, drop_rollup_triggers, rebuild_rollups
+from sync import create_outbox
+
+
+def _merge_duplicate_attendance(c):
+    """Collapse duplicate (finger_id, date) rows into the earliest one"""
+    # Carry a check-out from a later duplicate over to the row being kept
+    c.execute("""
+        UPDATE attendance
+        SET check_out_time = (SELECT MAX(d.check_out_time) FROM attendance d
+                              WHERE d.finger_id = attendance.finger_id AND d.date = attendance.date),
+            status = 'completed'
+        WHERE check_out_time IS NULL
+          AND id IN (SELECT MIN(id) FROM attendance
+                     GROUP BY finger_id, date
+                     HAVING COUNT(*) > 1 AND MAX(check_out_time) IS NOT NULL)""")
+    c.execute("""
+        DELETE FROM attendance
+        WHERE id NOT IN (SELECT MIN(id) FROM attendance GROUP BY finger_id, date)""")
+
+
+MIGRATIONS = [
+    (1, "Create users and attendance tables", [
+        '''CREATE TABLE IF NOT EXISTS users (
+            finger_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            age INTEGER,
+            department TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS attendance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            finger_id INTEGER,
+            name TEXT,
+            department TEXT,
+            check_in_time TIMESTAMP,
+            check_out_time TIMESTAMP,
+            date DATE,
+            status TEXT DEFAULT 'present')''',
+    ]),
+    (2, "Index attendance by finger/date, date and department/date", [
+        _merge_duplicate_attendance,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_finger_date ON attendance (finger_id, date)",
+        "CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance (date)",
+        "CREATE INDEX IF NOT EXISTS idx_attendance_department_date ON attendance (department, date)",
+    ]),
+    (3, "Store fingerprint templates for host-side matching", [
+        '''CREATE TABLE IF NOT EXISTS templates (
+            finger_id INTEGER PRIMARY KEY,
+            template BLOB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+    ]),
+    (4, "Index users by name for paged user lists", [
+        "CREATE INDEX IF NOT EXISTS idx_users_name ON users (name)",
+    ]),
+    (5, "Add daily, department and monthly user attendance rollups", [
+        lambda c: create_rollups(c, TEXT_TIME_MEASURES),
+        lambda c: rebuild_rollups(c, TEXT_TIME_MEASURES),
+    ]),
+    (6, "Store check-in/out as epoch seconds with a worked_seconds column", [
+        # Rewriting every row must not go through the rollup triggers
+        drop_rollup_triggers,
+        "ALTER TABLE attendance ADD COLUMN check_in_epoch INTEGER",
+        "ALTER TABLE attendance ADD COLUMN check_out_epoch INTEGER",
+        "ALTER TABLE attendance ADD COLUMN worked_seconds INTEGER",
+        """UPDATE attendance
+           SET check_in_epoch = CAST(strftime('%s', check_in_time, 'utc') AS INTEGER),
+               check_out_epoch = CAST(strftime('%s', check_out_time, 'utc') AS INTEGER)""",
+        """UPDATE attendance SET worked_seconds = check_out_epoch - check_in_epoch
+           WHERE check_in_epoch IS NOT NULL AND check_out_epoch IS NOT NULL""",
+        create_rollups,
+        rebuild_rollups,
+    ]),
+    (7, "Track data versions per attendance date and index the report cache", [
+        create_report_cache,
+    ]),
+    (8, "Record the reader of each check-in and check-out", [
+        "ALTER TABLE attendance ADD COLUMN check_in_reader TEXT",
+        "ALTER TABLE attendance ADD COLUMN check_out_reader TEXT",
+    ]),
+    (9, "Create the outbox a SyncAgent logs attendance and user changes in", [
+        create_outbox,
+    ]),
+]
+
+
+def schema_version(c):
+    """Return the highest migration version applied to the database"""
+    c.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    c.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return c.fetchone()[0]
+
+
+def migrate(c, target=None):
+    """Apply pending migrations up to target (default: latest) and return the new version"""
+    current = schema_version(c)
+    for version, description, steps in MIGRATIONS:
+        if version <= current or (target is not None and version > target):
+            continue
+        for step in steps:
+            if callable(step):
+                step(c)
+            else:
+                c.execute(step)
+        c.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                  (version, description))
+        current = version
+    return current
@@ -0,0 +1,333 @@
+"""Asyncio driver for the R307 fingerprint sensor.
+
+Adafruit_Fingerprint reads the serial port with blocking reads and a one
+second timeout, so every command holds an OS thread until its reply
+arrives and a lost reply stalls the caller for the whole second.
+AsyncR307 speaks the same packet protocol on a non-blocking file
+descriptor registered with an event loop: incoming bytes are framed
+and checksummed as they arrive, each command waits on a future for its
+acknowledgement with its own timeout (COMMAND_TIMEOUTS), and a corrupt
+reply fails the command at once instead of after the timeout. Any
+number of sensors can share one loop.
+
+BlockingR307 runs an AsyncR307 on a shared background loop and exposes
+the blocking interface of the other sensor backends, so ScanPipeline,
+enroll() and HostMatchingSensor use it unchanged; open_sensor() picks
+it with FINGERPRINT_DRIVER=asyncio.
+"""
+import asyncio
+import os
+import struct
+import termios
+import threading
+import tty
+
+from sensor import (ACKPACKET, COMMANDPACKET, COMPARE, DATA_PACKET_SIZE, DATAPACKET, DEFAULT_ADDRESS, DELETE,
+                    DOWNLOAD, EMPTY, ENDDATAPACKET, FINGERPRINTSEARCH, GETIMAGE, IMAGE2TZ, OK, READSYSPARA,
+                    REGMODEL, SENSOR_BAUDRATE, STORE, TEMPLATECOUNT, TEMPLATEREAD, UPLOAD, VERIFYPASSWORD,
+                    build_packet, parse_packet)
+
+# Seconds to wait for the acknowledgement of a command. Capturing and
+# converting take a few hundred milliseconds on the R307, a library
+# search or emptying the library up to a second or two.
+COMMAND_TIMEOUT = 1.0
+COMMAND_TIMEOUTS = {
+    GETIMAGE: 0.5,
+    IMAGE2TZ: 0.8,
+    REGMODEL: 0.8,
+    FINGERPRINTSEARCH: 2.0,
+    EMPTY: 3.0,
+}
+
+# Termios speed constants by baud rate
+BAUDRATES = {9600: termios.B9600, 19200: termios.B19200, 38400: termios.B38400,
+             57600: termios.B57600, 115200: termios.B115200}
+
+
+def open_port(port, baudrate=SENSOR_BAUDRATE):
+    """Open a serial device for non-blocking raw I/O and return its file descriptor"""
+    fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        tty.setraw(fd)
+        attributes = termios.tcgetattr(fd)
+        attributes[4] = attributes[5] = BAUDRATES[baudrate]
+        termios.tcsetattr(fd, termios.TCSANOW, attributes)
+    except Exception:
+        os.close(fd)
+        raise
+    return fd
+
+
+class AsyncR307:
+    """R307 protocol over a non-blocking file descriptor.
+
+    Commands are sent one at a time (the R307 answers strictly in
+    order); the coroutines mirror the Adafruit_Fingerprint methods,
+    return the confirmation code and update finger_id, confidence,
+    template_count and templates the same way. A command whose reply
+    does not arrive in time raises RuntimeError, as the Adafruit driver
+    does; a reply that arrives after that, before the next command is
+    sent, is discarded.
+    """
+
+    def __init__(self, fd, address=DEFAULT_ADDRESS, password=(0, 0, 0, 0), timeouts=None):
+        self.fd = fd
+        self.address = list(address)
+        self.password = list(password)
+        self.timeouts = dict(COMMAND_TIMEOUTS, **(timeouts or {}))
+        self.loop = asyncio.get_running_loop()
+        self.finger_id = None
+        self.confidence = None
+        self.template_count = None
+        self.templates = []
+        self.library_size = None
+        self.data_packet_size = DATA_PACKET_SIZE
+        self.commands = 0
+        self._buffer = b""
+        self._output = b""
+        self._reply = None
+        self._data = None
+        self._received = bytearray()
+        self._lock = asyncio.Lock()
+        self.loop.add_reader(fd, self._readable)
+
+    @classmethod
+    async def open(cls, port, baudrate=SENSOR_BAUDRATE, **kwargs):
+        """Open port, check the password and read the system parameters"""
+        sensor = cls(open_port(port, baudrate), **kwargs)
+        try:
+            if await sensor.verify_password() != OK:
+                raise RuntimeError("Failed to find sensor, check wiring!")
+            if await sensor.read_sysparam() != OK:
+                raise RuntimeError("Failed to read system parameters!")
+        except Exception:
+            sensor.close()
+            raise
+        return sensor
+
+    def close(self):
+        if self.fd is None:
+            return
+        self.loop.remove_reader(self.fd)
+        self.loop.remove_writer(self.fd)
+        os.close(self.fd)
+        self.fd = None
+        for future in (self._reply, self._data):
+            if future is not None and not future.done():
+                future.set_exception(RuntimeError("Sensor closed"))
+
+    # Framing
+
+    def _readable(self):
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._fail(RuntimeError(f"Failed to read data from sensor: {e}"))
+            return
+        self._buffer += data
+        while True:
+            try:
+                packet = parse_packet(self._buffer)
+            except ValueError as e:
+                # Corrupt reply: fail the command now and resync after the start code
+                self._buffer = self._buffer[self._buffer.find(b"\xef\x01") + 2:]
+                self._fail(RuntimeError(str(e)))
+                continue
+            if packet is None:
+                return
+            packet_type, payload, address, self._buffer = packet
+            if address != self.address:
+                continue
+            if packet_type == ACKPACKET:
+                if self._reply is not None and not self._reply.done():
+                    self._reply.set_result(list(payload))
+            elif packet_type in (DATAPACKET, ENDDATAPACKET) and self._data is not None:
+                self._received += payload
+                if packet_type == ENDDATAPACKET and not self._data.done():
+                    self._data.set_result(list(self._received))
+
+    def _fail(self, error):
+        for future in (self._reply, self._data):
+            if future is not None and not future.done():
+                future.set_exception(error)
+                return
+
+    def _write(self, data):
+        # Whatever the port does not take now is sent when it is writable
+        if not self._output:
+            try:
+                data = data[os.write(self.fd, data):]
+            except BlockingIOError:
+                pass
+            if not data:
+                return
+            self.loop.add_writer(self.fd, self._writable)
+        self._output += data
+
+    def _writable(self):
+        try:
+            self._output = self._output[os.write(self.fd, self._output):]
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._output = b""
+            self._fail(RuntimeError(f"Failed to write to sensor: {e}"))
+        if not self._output:
+            self.loop.remove_writer(self.fd)
+
+    async def command(self, instruction, *params, send=None, receive=False, timeout=None):
+        """Send a command packet and return the payload of its acknowledgement.
+
+        send is data to transfer in DATA packets once the command is
+        acknowledged; with receive the DATA packets that follow the
+        acknowledgement are collected and returned as well, as
+        (reply, data).
+        """
+        timeout = timeout or self.timeouts.get(instruction, COMMAND_TIMEOUT)
+        async with self._lock:
+            if self.fd is None:
+                raise RuntimeError("Sensor closed")
+            self.commands += 1
+            self._reply = self.loop.create_future()
+            self._data, self._received = (self.loop.create_future(), bytearray()) if receive else (None, None)
+            try:
+                self._write(build_packet(COMMANDPACKET, [instruction, *params], self.address))
+                reply = await self._wait(self._reply, instruction, timeout)
+                if send is not None and reply[0] == OK:
+                    self._send_data(send)
+                if not receive:
+                    return reply
+                return reply, (await self._wait(self._data, instruction, timeout) if reply[0] == OK else [])
+            finally:
+                self._reply = self._data = None
+
+    async def _wait(self, future, instruction, timeout):
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"No reply from sensor to command 0x{instruction:02X}") from None
+
+    def _send_data(self, data):
+        data = bytes(data)
+        size = self.data_packet_size
+        chunks = [data[i:i + size] for i in range(0, len(data), size)] or [b""]
+        for index, chunk in enumerate(chunks):
+            packet_type = ENDDATAPACKET if index == len(chunks) - 1 else DATAPACKET
+            self._write(build_packet(packet_type, chunk, self.address))
+
+    # Commands
+
+    async def verify_password(self):
+        return (await self.command(VERIFYPASSWORD, *self.password))[0]
+
+    async def read_sysparam(self):
+        reply = await self.command(READSYSPARA)
+        if reply[0] == OK:
+            self.library_size = struct.unpack(">H", bytes(reply[5:7]))[0]
+            self.data_packet_size = 32 << struct.unpack(">H", bytes(reply[13:15]))[0]
+        return reply[0]
+
+    async def get_image(self):
+        return (await self.command(GETIMAGE))[0]
+
+    async def image_2_tz(self, slot=1):
+        return (await self.command(IMAGE2TZ, slot))[0]
+
+    async def create_model(self):
+        return (await self.command(REGMODEL))[0]
+
+    async def store_model(self, location, slot=1):
+        return (await self.command(STORE, slot, location >> 8, location & 0xFF))[0]
+
+    async def delete_model(self, location):
+        return (await self.command(DELETE, location >> 8, location & 0xFF, 0x00, 0x01))[0]
+
+    async def empty_library(self):
+        return (await self.command(EMPTY))[0]
+
+    async def finger_search(self):
+        # The library size is read once at open, not before every search
+        capacity = self.library_size
+        reply = await self.command(FINGERPRINTSEARCH, 0x01, 0x00, 0x00, capacity >> 8, capacity & 0xFF)
+        self.finger_id, self.confidence = struct.unpack(">HH", bytes(reply[1:5]))
+        return reply[0]
+
+    async def compare_templates(self):
+        reply = await self.command(COMPARE)
+        self.confidence = struct.unpack(">H", bytes(reply[1:3]))[0]
+        return reply[0]
+
+    async def count_templates(self):
+        reply = await self.command(TEMPLATECOUNT)
+        self.template_count = struct.unpack(">H", bytes(reply[1:3]))[0]
+        return reply[0]
+
+    async def read_templates(self):
+        self.templates = []
+        code = OK
+        for page in range((self.library_size + 255) // 256):
+            reply = await self.command(TEMPLATEREAD, page)
+            code = reply[0]
+            if code != OK:
+                continue
+            for index, byte in enumerate(reply[1:33]):
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        self.templates.append(page * 256 + index * 8 + bit)
+        return code
+
+    async def get_fpdata(self, sensorbuffer="char", slot=1):
+        if sensorbuffer != "char":
+            raise RuntimeError("Only char buffers are supported")
+        reply, data = await self.command(UPLOAD, slot, receive=True)
+        return data
+
+    async def send_fpdata(self, data, sensorbuffer="char", slot=1):
+        if sensorbuffer != "char":
+            raise RuntimeError("Only char buffers are supported")
+        await self.command(DOWNLOAD, slot, send=data)
+        return True
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def sensor_loop():
+    """The event loop shared by every BlockingR307, started on first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="r307-loop")
+            thread.daemon = True
+            thread.start()
+        return _loop
+
+
+class BlockingR307:
+    """An AsyncR307 on the shared sensor loop behind the blocking sensor interface.
+
+    Each method call runs the coroutine of the same name on the loop and
+    waits for its result; attributes are read from the AsyncR307.
+    """
+
+    def __init__(self, port, baudrate=SENSOR_BAUDRATE, loop=None, **kwargs):
+        self.loop = loop or sensor_loop()
+        self.sensor = self._run(AsyncR307.open(port, baudrate, **kwargs))
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def __getattr__(self, name):
+        if name == "sensor":
+            raise AttributeError(name)
+        value = getattr(self.sensor, name)
+        if asyncio.iscoroutinefunction(value):
+            return lambda *args, **kwargs: self._run(value(*args, **kwargs))
+        return value
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.sensor.close)
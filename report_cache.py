@@ -0,0 +1,216 @@
+"""Cache of rendered reports and CSV exports.
+
+A report is cached under a key made of the report name, the dates it
+covers, its department and status filters and the data version of those
+dates. The data_versions table holds a counter per attendance date, and
+one for the users table, bumped by triggers on every insert, update and
+delete. Changing any attendance row of a date therefore changes the key
+of every report covering it, so a stale file is never returned; evict()
+deletes such files along with those older than the age limit and, least
+recently used first, those beyond the size limit.
+
+Cached files live in REPORT_CACHE_DIR and are indexed in the report_cache
+table. A hit is copied to the chosen filename instead of being rendered
+again.
+"""
+import hashlib
+import os
+import shutil
+import time
+from collections import namedtuple
+
+# Directory holding cached reports; override with ATTENDANCE_REPORT_CACHE
+REPORT_CACHE_DIR = os.environ.get("ATTENDANCE_REPORT_CACHE", "report_cache")
+
+# Total size of cached files kept by evict() (bytes)
+REPORT_CACHE_BYTES = 256 * 1024 * 1024
+
+# Cached files older than this are deleted by evict() (seconds)
+REPORT_CACHE_AGE = 7 * 24 * 3600
+
+# Unindexed files in the cache directory older than this are removed by
+# evict() (seconds)
+ORPHAN_AGE = 3600
+
+# data_versions scope counting changes to the users table
+USERS_SCOPE = 'users'
+
+# First and last possible dates, for reports over the whole history
+MIN_DATE = '0000-01-01'
+MAX_DATE = '9999-12-31'
+
+CacheKey = namedtuple('CacheKey', 'report start end department status version')
+
+# Statements run by the data version triggers: {scope} is the date of a
+# NEW or OLD attendance row, or the users scope
+_BUMP = ("INSERT INTO data_versions (scope, version) VALUES ({scope}, 1) "
+         "ON CONFLICT (scope) DO UPDATE SET version = version + 1;")
+
+_TRIGGERS = [
+    ('attendance', 'INSERT', ('NEW.date',)),
+    ('attendance', 'DELETE', ('OLD.date',)),
+    ('attendance', 'UPDATE', ('OLD.date', 'NEW.date')),
+    ('users', 'INSERT', (f"'{USERS_SCOPE}'",)),
+    ('users', 'DELETE', (f"'{USERS_SCOPE}'",)),
+    ('users', 'UPDATE', (f"'{USERS_SCOPE}'",)),
+]
+
+
+def create_report_cache(c):
+    """Create the data_versions and report_cache tables and the version triggers"""
+    c.execute('''CREATE TABLE IF NOT EXISTS data_versions (
+        scope TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS report_cache (
+        key TEXT PRIMARY KEY,
+        filename TEXT NOT NULL,
+        report TEXT NOT NULL,
+        start_date TEXT,
+        end_date TEXT,
+        department TEXT,
+        status TEXT,
+        version INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        used_at REAL NOT NULL)''')
+    for table, event, scopes in _TRIGGERS:
+        statements = " ".join(_BUMP.format(scope=scope) for scope in scopes)
+        c.execute(f"DROP TRIGGER IF EXISTS {table}_data_version_{event.lower()}")
+        c.execute(f"CREATE TRIGGER {table}_data_version_{event.lower()} AFTER {event} ON {table} "
+                  f"BEGIN {statements} END")
+
+
+def data_version(db, start=None, end=None):
+    """Version of the attendance rows dated start..end (default: all) and of the users table.
+
+    Every counter only grows, so the sum changes whenever any row in the
+    range does.
+    """
+    return db.query_value(
+        """SELECT COALESCE(SUM(version), 0) FROM data_versions
+           WHERE scope = ? OR scope BETWEEN ? AND ?""",
+        (USERS_SCOPE, start or MIN_DATE, end or MAX_DATE))
+
+
+class ReportCache:
+    """Rendered reports indexed by CacheKey.
+
+    get() and copy() look a key up, put() adds a file rendered for a key
+    and evict() enforces the age and size limits. The index is read on
+    the calling thread and written through the database writer.
+    """
+
+    def __init__(self, db, directory=REPORT_CACHE_DIR, max_bytes=REPORT_CACHE_BYTES,
+                 max_age=REPORT_CACHE_AGE):
+        self.db = db
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, report, start=None, end=None, department='All', status='All'):
+        """The key of report over start..end with the data as it is now"""
+        return CacheKey(report, start, end, str(department), str(status),
+                        data_version(self.db, start, end))
+
+    def path(self, key, extension='.pdf'):
+        """File the report for key is stored in"""
+        return os.path.join(self.directory, self._id(key) + extension)
+
+    def _lookup(self, key):
+        name = self.db.query_value("SELECT filename FROM report_cache WHERE key = ?", (self._id(key),))
+        path = os.path.join(self.directory, name) if name else None
+        return path if path is not None and os.path.exists(path) else None
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def get(self, key):
+        """Return the cached file for key, or None"""
+        path = self._lookup(key)
+        if path is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.submit(lambda c: c.execute("UPDATE report_cache SET used_at = ? WHERE key = ?",
+                                           (time.time(), self._id(key))))
+        return path
+
+    def copy(self, key, filename):
+        """Copy the cached file for key to filename; False on a miss"""
+        path = self.get(key)
+        if path is None:
+            return False
+        shutil.copyfile(path, filename)
+        return True
+
+    def put(self, key, filename):
+        """Add filename, rendered for key, to the cache and evict what no longer fits"""
+        size = os.path.getsize(filename)
+        path = self.path(key, os.path.splitext(filename)[1])
+        rendered_here = os.path.abspath(filename) == os.path.abspath(path)
+        if size > self.max_bytes or key.version != data_version(self.db, key.start, key.end):
+            # Too big to keep, or the data changed while it was rendered
+            if rendered_here:
+                os.remove(filename)
+            return None
+        if not rendered_here:
+            os.makedirs(self.directory, exist_ok=True)
+            shutil.copyfile(filename, path + ".part")
+            os.replace(path + ".part", path)
+        now = time.time()
+        self.db.execute(
+            """INSERT OR REPLACE INTO report_cache (key, filename, report, start_date, end_date, department,
+                                                    status, version, size, created_at, used_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (self._id(key), os.path.basename(path), key.report, key.start, key.end, key.department,
+             key.status, key.version, size, now, now))
+        self.evict()
+        return path
+
+    def evict(self, now=None):
+        """Delete stale, expired and least recently used files; return how many were deleted"""
+        now = time.time() if now is None else now
+        rows = self.db.query("""SELECT key, filename, start_date, end_date, version, size, created_at
+                                FROM report_cache ORDER BY used_at DESC""")
+        keep, drop = [], []
+        total = 0
+        for key, name, start, end, version, size, created_at in rows:
+            if (created_at < now - self.max_age or total + size > self.max_bytes
+                    or version != data_version(self.db, start, end)):
+                drop.append((key, name))
+            else:
+                keep.append(name)
+                total += size
+        if drop:
+            self.db.write(lambda c: c.executemany("DELETE FROM report_cache WHERE key = ?",
+                                                  [(key,) for key, name in drop]))
+
+        # Remove the dropped files, and any left behind by an interrupted
+        # render or put(); files not indexed yet may still be being written
+        deleted = 0
+        if os.path.isdir(self.directory):
+            keep = set(keep)
+            dropped = {name for key, name in drop}
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name in dropped or (name not in keep and os.path.getmtime(path) < now - ORPHAN_AGE):
+                    os.remove(path)
+                    deleted += 1
+        return deleted
+
+    def clear(self):
+        """Delete every cached file"""
+        self.db.execute("DELETE FROM report_cache")
+        return self.evict()
+
+    def _id(self, key):
+        digest = hashlib.sha1(repr(tuple(key)).encode()).hexdigest()[:24]
+        return f"{key.report.split()[0]}-{digest}"
+
+    def summary(self):
+        """Short description of the cache for the status bar"""
+        count, size = self.db.query_one("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM report_cache")
+        return (f"Report cache: {count} files, {size / 1048576:.1f} MiB, "
+                f"{self.hits} hits, {self.misses} misses")
@@ -0,0 +1,751 @@
+"""PDF reports rendered by a pool of worker processes.
+
+reportlab's layout is CPU-bound pure Python, so building a large report
+on the Tk thread (or any thread of the GUI process) holds the GIL and
+stalls the window and the scan pipeline. ReportJobs runs the report
+functions below in worker processes instead: each job opens its own
+Database on the same file, reports the pages rendered so far and can be
+cancelled while queued or running.
+
+Report functions take (db, filename, *args, progress=None). progress is
+called with the number of pages laid out and raises ReportCancelled when
+the job has been cancelled.
+
+Row tables are streamed: a StreamedTable reads rows from the cursor
+only as pages are laid out and emits one page-sized Table per page, all
+sharing one TableStyle and fixed row heights. reportlab's layout cost
+grows faster than linearly with the size of a single Table, and only one
+page of rows is in memory at a time.
+
+Given a ReportCache, ReportJobs copies a report already rendered over the
+current data instead of queueing it, and adds every rendered report to
+the cache. ReportScheduler fills the cache with the end-of-shift reports
+while nothing else is being rendered.
+"""
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.platypus import Flowable, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from stats import attendance_statistics, user_statistics
+
+# Worker processes rendering reports; one is enough to keep the GUI free
+REPORT_WORKERS = 2
+
+# Time of day (HH:MM) after which ReportScheduler pre-renders today's reports
+SHIFT_END = os.environ.get("ATTENDANCE_SHIFT_END", "18:00")
+
+# Seconds between ReportScheduler checks
+SCHEDULE_INTERVAL = 60
+
+# Rows fetched from the cursor at a time for streamed tables
+FETCH_ROWS = 500
+
+# Heights of the header and body rows of streamed tables (points)
+HEADER_ROW_HEIGHT = 27
+BODY_ROW_HEIGHT = 16
+
+# Style of the small summary tables
+SUMMARY_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 12),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+# Style shared by every chunk of a detail table
+DETAIL_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('FONTSIZE', (0, 1), (-1, -1), 8)
+])
+
+# Detail column widths as fractions of the frame width. Fixed widths keep
+# the columns aligned from one page to the next and spare reportlab
+# measuring every cell.
+DETAIL_COLUMNS = (0.26, 0.2, 0.12, 0.12, 0.16, 0.14)
+
+
+class ReportCancelled(Exception):
+    """Raised inside a report when its job has been cancelled"""
+
+
+class StreamedTable(Flowable):
+    """A table of any length laid out one page-sized Table at a time.
+
+    wrap() always asks for more space than is left in the frame, so
+    reportlab calls split(), which pulls just enough rows from the
+    iterator to fill that space and returns them as a Table followed by
+    the StreamedTable itself for the rest. Every chunk starts with the
+    header row. Rows have fixed heights so fitting a page needs no
+    measuring; cell text is not wrapped.
+    """
+
+    def __init__(self, header, rows, widths, style=DETAIL_TABLE_STYLE,
+                 header_height=HEADER_ROW_HEIGHT, row_height=BODY_ROW_HEIGHT):
+        Flowable.__init__(self)
+        self.header = header
+        self.rows = iter(rows)
+        self.widths = widths
+        self.style = style
+        self.header_height = header_height
+        self.row_height = row_height
+        self._next = next(self.rows, None)
+
+    def wrap(self, availWidth, availHeight):
+        if self._next is None:
+            return availWidth, 0
+        return availWidth, availHeight + 1
+
+    def split(self, availWidth, availHeight):
+        count = int((availHeight - self.header_height) // self.row_height)
+        if self._next is None or count < 1:
+            return []
+        chunk = [self._next] + list(itertools.islice(self.rows, count - 1))
+        self._next = next(self.rows, None)
+        # reportlab marks a flowable postponed to the next page and refuses
+        # to postpone it twice; the rest of the table is a new start
+        self.__dict__.pop('_postponed', None)
+        table = Table([self.header] + chunk, colWidths=[availWidth * fraction for fraction in self.widths],
+                      rowHeights=[self.header_height] + [self.row_height] * len(chunk), style=self.style)
+        return [table] if self._next is None else [table, self]
+
+    def draw(self):
+        pass
+
+
+def _stream(db, sql, params=()):
+    """Rows of sql read from the cursor FETCH_ROWS at a time"""
+    for chunk in db.stream(sql, params, FETCH_ROWS):
+        yield from chunk
+
+
+def _build(doc, story, progress):
+    """doc.build(story), calling progress(pages) as each page is finished"""
+    def on_page(canvas, doc):
+        if progress:
+            progress(doc.page)
+    doc.build(story, onFirstPage=on_page, onLaterPages=on_page)
+
+
+def daily_report(db, filename, progress=None):
+    """Today's attendance with summary statistics"""
+    # Today's attendance data, read while the table is laid out
+    today = date.today()
+    attendance_data = _stream(db, """SELECT u.name, u.department, a.check_in_time, a.check_out_time, a.status,
+                       CASE WHEN a.worked_seconds IS NOT NULL
+                           THEN printf('%.2f', a.worked_seconds / 3600.0)
+                           ELSE 'N/A' END as hours_worked
+                FROM users u
+                LEFT JOIN attendance a ON u.finger_id = a.finger_id AND a.date = ?
+                ORDER BY u.name""", (today,))
+
+    # Create PDF
+    doc = SimpleDocTemplate(filename, pagesize=A4)
+    story = []
+    styles = getSampleStyleSheet()
+
+    # Title
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=18,
+        spaceAfter=30,
+        alignment=1,
+        textColor=colors.darkblue
+    )
+
+    story.append(Paragraph("Daily Attendance Report", title_style))
+    story.append(Paragraph(f"Date: {today.strftime('%Y-%m-%d')}", styles['Normal']))
+    story.append(Paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['Normal']))
+    story.append(Spacer(1, 20))
+
+    # Summary statistics
+    stats = attendance_statistics(db, today)
+
+    summary_data = [
+        ['Metric', 'Count'],
+        ['Total Users', str(stats.total_users)],
+        ['Present Today', str(stats.present)],
+        ['Absent Today', str(stats.absent)],
+        ['Completed (Check-in + Check-out)', str(stats.completed)],
+        ['Attendance Rate', f"{stats.rate(stats.present):.1f}%"]
+    ]
+
+    summary_table = Table(summary_data, style=SUMMARY_TABLE_STYLE)
+
+    story.append(summary_table)
+    story.append(Spacer(1, 20))
+
+    # Detailed attendance table
+    story.append(Paragraph("Detailed Attendance", styles['Heading2']))
+
+    def table_rows():
+        for name, dept, check_in, check_out, status, hours in attendance_data:
+            check_in_display = check_in.split()[1][:5] if check_in else "Absent"
+            check_out_display = check_out.split()[1][:5] if check_out else "N/A"
+            status_display = "Completed" if status == "completed" else "Checked In" if status == "checked_in" else "Absent"
+            yield [name, dept or 'N/A', check_in_display, check_out_display, status_display, hours]
+
+    story.append(StreamedTable(['Name', 'Department', 'Check-in', 'Check-out', 'Status', 'Hours Worked'],
+                               table_rows(), DETAIL_COLUMNS))
+    _build(doc, story, progress)
+
+
+def datewise_report(db, filename, selected_date, selected_dept, selected_status, progress=None):
+    """Attendance of every user on selected_date, optionally for one department"""
+    # Get filtered data
+    query = """
+        SELECT u.name, u.department, a.date, a.check_in_time, a.check_out_time, a.status,
+               CASE WHEN a.worked_seconds IS NOT NULL
+                   THEN printf('%.2f', a.worked_seconds / 3600.0)
+                   ELSE 'N/A' END as hours_worked,
+               CASE WHEN a.finger_id IS NULL THEN 'Absent' ELSE COALESCE(a.status, 'Present') END as display_status
+        FROM users u
+        LEFT JOIN attendance a ON u.finger_id = a.finger_id AND a.date = ?
+    """
+    params = [selected_date]
+
+    if selected_dept != 'All':
+        query += " WHERE u.department = ?"
+        params.append(selected_dept)
+
+    query += " ORDER BY u.name"
+
+    rows = _stream(db, query, params)
+
+    # Create PDF
+    doc = SimpleDocTemplate(filename, pagesize=A4)
+    story = []
+    styles = getSampleStyleSheet()
+
+    # Title
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=18,
+        spaceAfter=30,
+        alignment=1,
+        textColor=colors.darkblue
+    )
+
+    story.append(Paragraph("Date-wise Attendance Report", title_style))
+    story.append(Paragraph(f"Date: {selected_date}", styles['Normal']))
+    story.append(Paragraph(f"Department Filter: {selected_dept}", styles['Normal']))
+    story.append(Paragraph(f"Status Filter: {selected_status}", styles['Normal']))
+    story.append(Paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['Normal']))
+    story.append(Spacer(1, 20))
+
+    # Statistics
+    stats = attendance_statistics(db, datetime.strptime(selected_date, '%Y-%m-%d').date(),
+                                  None if selected_dept == 'All' else selected_dept)
+
+    stats_data = [
+        ['Metric', 'Count'],
+        ['Total Users', str(stats.total_users)],
+        ['Present', str(stats.present)],
+        ['Absent', str(stats.absent)],
+        ['Completed (Check-in + Check-out)', str(stats.completed)],
+        ['Checked In Only', str(stats.checked_in)]
+    ]
+
+    stats_table = Table(stats_data, style=SUMMARY_TABLE_STYLE)
+    story.append(stats_table)
+    story.append(Spacer(1, 20))
+
+    # Detailed attendance table
+    story.append(Paragraph("Detailed Attendance Records", styles['Heading2']))
+
+    def table_rows():
+        for name, dept, date_val, check_in, check_out, status, hours, display_status in rows:
+            check_in_display = check_in.split()[1][:5] if check_in else "N/A"
+            check_out_display = check_out.split()[1][:5] if check_out else "N/A"
+            final_status = 'Completed' if status == 'completed' else 'Checked In' if status == 'checked_in' else 'Absent' if status is None else status
+            yield [name, dept or 'N/A', check_in_display, check_out_display, final_status, hours]
+
+    story.append(StreamedTable(['Name', 'Department', 'Check-in', 'Check-out', 'Status', 'Hours'],
+                               table_rows(), DETAIL_COLUMNS))
+    _build(doc, story, progress)
+
+
+def summary_report(db, filename, progress=None):
+    """Overall report: statistics, today's status, departments, users and recent records"""
+    # Basic statistics and all-time records per department
+    stats = attendance_statistics(db, history=True)
+    today = stats.day.strftime('%Y-%m-%d')
+
+    # Today's detailed status
+    today_status = db.query("""
+        SELECT u.name, u.department, a.check_in_time, a.check_out_time, a.status
+        FROM users u
+        LEFT JOIN attendance a ON u.finger_id = a.finger_id AND a.date = ?
+        ORDER BY u.name
+    """, (today,))
+
+    # Department wise attendance
+    dept_attendance = [(dept.department, dept.records) for dept in stats.departments if dept.records]
+
+    # User attendance summary
+    user_summary = user_statistics(db)
+
+    # Recent attendance records
+    recent_attendance = db.query("""
+        SELECT name, department, check_in_time, check_out_time, status, date
+        FROM attendance
+        ORDER BY check_in_time DESC
+        LIMIT 20
+    """)
+
+    # Create PDF document
+    doc = SimpleDocTemplate(filename, pagesize=A4)
+    story = []
+    styles = getSampleStyleSheet()
+
+    # Custom styles
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=18,
+        spaceAfter=30,
+        alignment=1,  # Center alignment
+        textColor=colors.darkblue
+    )
+
+    heading_style = ParagraphStyle(
+        'CustomHeading',
+        parent=styles['Heading2'],
+        fontSize=14,
+        spaceAfter=12,
+        textColor=colors.darkblue
+    )
+
+    # Title
+    story.append(Paragraph("Fingerprint Attendance System Report", title_style))
+    story.append(Paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['Normal']))
+    story.append(Spacer(1, 20))
+
+    # Summary Statistics
+    story.append(Paragraph("Summary Statistics", heading_style))
+    summary_data = [
+        ['Metric', 'Value'],
+        ['Total Registered Users', str(stats.total_users)],
+        ['Total Attendance Records', str(stats.total_records)],
+        ['Today\'s Attendance', str(stats.present)],
+        ['Today\'s Completed (Check-in + Check-out)', str(stats.completed)],
+        ['Today\'s Checked-in Only', str(stats.checked_in)],
+        ['Today\'s Absent', str(stats.absent)]
+    ]
+
+    summary_table = Table(summary_data)
+    summary_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    story.append(summary_table)
+    story.append(Spacer(1, 20))
+
+    # Today's Status
+    story.append(Paragraph("Today's Attendance Status", heading_style))
+    today_data = [['Name', 'Department', 'Check-in', 'Check-out', 'Status']]
+
+    for name, dept, check_in, check_out, status in today_status:
+        if name:  # Only show users with records
+            check_in_time = check_in.split()[1][:5] if check_in else "N/A"
+            check_out_time = check_out.split()[1][:5] if check_out else "N/A"
+            status_display = status if status else "Absent"
+            today_data.append([name, dept or "N/A", check_in_time, check_out_time, status_display])
+
+    if len(today_data) > 1:
+        today_table = Table(today_data)
+        today_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('FONTSIZE', (0, 1), (-1, -1), 8)
+        ]))
+        story.append(today_table)
+    else:
+        story.append(Paragraph("No attendance records for today.", styles['Normal']))
+    story.append(Spacer(1, 20))
+
+    # Department wise attendance
+    if dept_attendance:
+        story.append(Paragraph("Department-wise Attendance", heading_style))
+        dept_data = [['Department', 'Total Records']]
+        for dept, count in dept_attendance:
+            dept_data.append([dept or "N/A", str(count)])
+
+        dept_table = Table(dept_data)
+        dept_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ]))
+        story.append(dept_table)
+        story.append(Spacer(1, 20))
+
+    # User attendance summary
+    story.append(Paragraph("User Attendance Summary", heading_style))
+    user_data = [['Name', 'Department', 'Days Present', 'Days Completed', 'Avg Hours']]
+
+    for user in user_summary:
+        avg_hours_display = f"{user.avg_hours:.1f}" if user.avg_hours else "N/A"
+        user_data.append([
+            user.name,
+            user.department or "N/A",
+            str(user.days_present),
+            str(user.days_completed),
+            avg_hours_display
+        ])
+
+    user_table = Table(user_data)
+    user_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONTSIZE', (0, 1), (-1, -1), 8)
+    ]))
+    story.append(user_table)
+    story.append(Spacer(1, 20))
+
+    # Recent attendance records
+    story.append(Paragraph("Recent Attendance Records (Last 20)", heading_style))
+    recent_data = [['Name', 'Department', 'Date', 'Check-in', 'Check-out', 'Status']]
+
+    for name, dept, check_in, check_out, status, date_record in recent_attendance:
+        check_in_time = check_in.split()[1][:5] if check_in else "N/A"
+        check_out_time = check_out.split()[1][:5] if check_out else "N/A"
+        recent_data.append([
+            name,
+            dept or "N/A",
+            date_record,
+            check_in_time,
+            check_out_time,
+            status or "N/A"
+        ])
+
+    recent_table = Table(recent_data)
+    recent_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 9),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONTSIZE', (0, 1), (-1, -1), 7)
+    ]))
+    story.append(recent_table)
+
+    # Build PDF
+    _build(doc, story, progress)
+
+
+def cache_key(cache, report, *args):
+    """The ReportCache key of report(db, filename, *args) over the data as it is now"""
+    today = date.today().strftime('%Y-%m-%d')
+    if report is datewise_report:
+        selected_date, selected_dept, selected_status = args
+        return cache.key('datewise', selected_date, selected_date, selected_dept, selected_status)
+    if report is daily_report:
+        return cache.key('daily', today, today)
+    # The summary covers the whole history up to today
+    return cache.key(report.__name__, None, today)
+
+
+def render(report, db_path, filename, args, job_id=None, events=None, cancelled=None):
+    """Run report(db, filename, *args) in a worker process.
+
+    The PDF is written to filename.part and renamed once complete. Page
+    progress is put on the events queue as (job_id, pages); the job
+    stops with ReportCancelled once job_id is in the cancelled mapping.
+    """
+    from database import Database
+
+    def progress(pages):
+        if cancelled is not None and cancelled.get(job_id):
+            raise ReportCancelled()
+        if events is not None:
+            events.put((job_id, pages))
+
+    db = Database(db_path)
+    partial = filename + ".part"
+    try:
+        report(db, partial, *args, progress=progress)
+        os.replace(partial, filename)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        db.close()
+    return filename
+
+
+class ReportJob:
+    """A report submitted to ReportJobs.
+
+    state is one of 'queued', 'running', 'done', 'failed' or 'cancelled';
+    pages counts the pages laid out so far and error holds the exception
+    of a failed job. cached is set when the file was copied from the
+    report cache; background jobs fill the cache and are not listed.
+    """
+
+    def __init__(self, job_id, title, filename, key=None, background=False):
+        self.id = job_id
+        self.title = title
+        self.filename = filename
+        self.key = key
+        self.background = background
+        self.state = 'queued'
+        self.pages = 0
+        self.error = None
+        self.future = None
+        self.cached = False
+
+    @property
+    def finished(self):
+        return self.state in ('done', 'failed', 'cancelled')
+
+
+class ReportJobs:
+    """Queue of report jobs rendered by a process pool.
+
+    on_change(job) is called from a background thread whenever a job
+    starts, renders a page or finishes; the GUIs wrap it in root.after.
+    The pool, and the manager process carrying progress and cancel
+    flags, are started with the first submitted job.
+    """
+
+    def __init__(self, db_path, workers=REPORT_WORKERS, on_change=None, cache=None):
+        self.db_path = db_path
+        self.workers = workers
+        self.on_change = on_change
+        self.cache = cache
+        self.jobs = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._manager = None
+        self._events = None
+        self._cancelled = None
+        self._listener = None
+
+    def _start(self):
+        # spawn, not fork: the GUI process has sensor and database threads
+        context = multiprocessing.get_context("spawn")
+        self._manager = context.Manager()
+        self._events = self._manager.Queue()
+        self._cancelled = self._manager.dict()
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=context)
+        self._listener = threading.Thread(target=self._listen, name="report-events")
+        self._listener.daemon = True
+        self._listener.start()
+
+    def submit(self, title, report, filename, *args):
+        """Queue report(db, filename, *args) and return its ReportJob.
+
+        A report found in the cache is copied to filename and returned as
+        a job that is already done.
+        """
+        key = cache_key(self.cache, report, *args) if self.cache is not None else None
+        if key is not None and self.cache.copy(key, filename):
+            job = ReportJob(next(self._ids), title, filename, key)
+            job.state = 'done'
+            job.cached = True
+            with self._lock:
+                self.jobs.append(job)
+            self._changed(job)
+            return job
+        return self._submit(ReportJob(next(self._ids), title, filename, key), report, args)
+
+    def prerender(self, title, report, *args):
+        """Render report(db, filename, *args) into the cache unless it is there; return the job or None"""
+        key = cache_key(self.cache, report, *args)
+        if key in self.cache:
+            return None
+        os.makedirs(self.cache.directory, exist_ok=True)
+        job = ReportJob(next(self._ids), title, self.cache.path(key), key, background=True)
+        return self._submit(job, report, args)
+
+    def _submit(self, job, report, args):
+        with self._lock:
+            if self._pool is None:
+                self._start()
+            if not job.background:
+                self.jobs.append(job)
+            job.future = self._pool.submit(render, report, self.db_path, job.filename, args,
+                                           job.id, self._events, self._cancelled)
+        job.future.add_done_callback(lambda future: self._finished(job, future))
+        self._changed(job)
+        return job
+
+    def busy(self):
+        """True while a listed job is queued or running"""
+        return any(not job.finished for job in self.jobs)
+
+    def cancel(self, job):
+        """Cancel a queued job, or stop a running one at its next page"""
+        if job.finished:
+            return
+        if job.future.cancel():
+            return
+        self._cancelled[job.id] = True
+
+    def clear_finished(self):
+        """Forget finished jobs"""
+        with self._lock:
+            self.jobs = [job for job in self.jobs if not job.finished]
+
+    def _listen(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            job_id, pages = event
+            job = next((job for job in self.jobs if job.id == job_id), None)
+            if job is not None and not job.finished:
+                job.state = 'running'
+                job.pages = pages
+                self._changed(job)
+
+    def _finished(self, job, future):
+        try:
+            future.result()
+            job.state = 'done'
+        except (CancelledError, ReportCancelled):
+            job.state = 'cancelled'
+        except Exception as e:
+            job.state = 'failed'
+            job.error = e
+        if self._cancelled is not None:
+            self._cancelled.pop(job.id, None)
+        if job.state == 'done' and job.key is not None:
+            try:
+                self.cache.put(job.key, job.filename)
+            except Exception as e:
+                print(f"Report cache error: {e}")
+        self._changed(job)
+
+    def _changed(self, job):
+        if self.on_change and not job.background:
+            self.on_change(job)
+
+    def shutdown(self):
+        """Cancel queued jobs, wait for running ones and stop the workers"""
+        if self._pool is None:
+            return
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._events.put(None)
+        self._listener.join()
+        self._manager.shutdown()
+        self._pool = None
+
+
+class ReportScheduler:
+    """Pre-renders end-of-shift reports into the report cache while idle.
+
+    Every interval seconds the cache is evicted and, when no report job
+    is queued or running and idle() (if given) is true, one report that
+    is not cached yet is rendered in the background: yesterday's
+    date-wise report, and once the shift has ended today's date-wise,
+    daily or summary report, all for every department.
+    """
+
+    def __init__(self, jobs, reports=(datewise_report,), shift_end=SHIFT_END,
+                 interval=SCHEDULE_INTERVAL, idle=None, clock=datetime.now):
+        self.jobs = jobs
+        self.reports = reports
+        self.shift_end = shift_end
+        self.interval = interval
+        self.idle = idle
+        self.clock = clock
+        self._job = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def due(self, now=None):
+        """(title, report, args) of every report that should be cached at now"""
+        now = now or self.clock()
+        today = now.date()
+        shift_over = now.strftime('%H:%M') >= self.shift_end
+        due = []
+        for report in self.reports:
+            if report is datewise_report:
+                days = [today - timedelta(days=1)] + ([today] if shift_over else [])
+                due += [(f"Date-wise report {day}", report, (day.strftime('%Y-%m-%d'), 'All', 'All'))
+                        for day in days]
+            elif shift_over:
+                due.append(("Daily report" if report is daily_report else "Summary report", report, ()))
+        return due
+
+    def tick(self):
+        """Evict the cache and start the next missing report if idle; return its job or None"""
+        self.jobs.cache.evict()
+        if self._job is not None and not self._job.finished:
+            return None
+        if self.jobs.busy() or (self.idle is not None and not self.idle()):
+            return None
+        for title, report, args in self.due():
+            job = self.jobs.prerender(title, report, *args)
+            if job is not None:
+                self._job = job
+                return job
+        return None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="report-scheduler")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Report scheduler error: {e}")
@@ -0,0 +1,119 @@
+"""Rollup tables summarising the attendance history.
+
+    daily_attendance              one row per date
+    department_daily_attendance   one row per department and date
+    user_monthly_attendance       one row per user and month (YYYY-MM)
+
+Each holds the number of attendance records (present), how many of them
+are completed or only checked in, how many have both times (worked_days)
+and the hours worked. Triggers on the attendance table keep the rollups
+up to date on every insert, update and delete, so reports read a few
+rows per day, department or user instead of the whole history.
+
+Run ``python3 rollups.py rebuild`` to recompute them from the attendance
+table, e.g. after importing rows with the triggers disabled.
+"""
+import argparse
+
+# Rollup table, key columns and the expression for each key over an
+# attendance row ({row} is NEW or OLD in triggers, attendance otherwise)
+ROLLUPS = [
+    ('daily_attendance', ('date',), ('{row}.date',)),
+    ('department_daily_attendance', ('department', 'date'),
+     ("COALESCE({row}.department, '')", '{row}.date')),
+    ('user_monthly_attendance', ('finger_id', 'month'),
+     ('{row}.finger_id', 'substr({row}.date, 1, 7)')),
+]
+
+# Measure columns and what one attendance row adds to them
+MEASURES = [
+    ('present', '1'),
+    ('completed', "{row}.status IS 'completed'"),
+    ('checked_in', "{row}.status IS 'checked_in'"),
+    ('worked_days', '{row}.worked_seconds IS NOT NULL'),
+    ('worked_hours', 'COALESCE({row}.worked_seconds, 0) / 3600.0'),
+]
+
+# The measures before schema version 6 added worked_seconds, used by
+# migration 5
+TEXT_TIME_MEASURES = MEASURES[:3] + [
+    ('worked_days', '{row}.check_in_time IS NOT NULL AND {row}.check_out_time IS NOT NULL'),
+    ('worked_hours', 'COALESCE((julianday({row}.check_out_time) - julianday({row}.check_in_time)) * 24, 0)'),
+]
+
+TRIGGER_EVENTS = ('INSERT', 'DELETE', 'UPDATE')
+
+
+def _add(table, keys, key_exprs, row, measures):
+    columns = ", ".join(keys + tuple(name for name, expr in measures))
+    values = ", ".join([expr.format(row=row) for expr in key_exprs] +
+                       [expr.format(row=row) for name, expr in measures])
+    updates = ", ".join(f"{name} = {name} + excluded.{name}" for name, expr in measures)
+    return (f"INSERT INTO {table} ({columns}) VALUES ({values}) "
+            f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates};")
+
+
+def _subtract(table, keys, key_exprs, row, measures):
+    where = " AND ".join(f"{key} = {expr.format(row=row)}" for key, expr in zip(keys, key_exprs))
+    updates = ", ".join(f"{name} = {name} - ({expr.format(row=row)})" for name, expr in measures)
+    return (f"UPDATE {table} SET {updates} WHERE {where}; "
+            f"DELETE FROM {table} WHERE {where} AND present <= 0;")
+
+
+def create_rollups(c, measures=MEASURES):
+    """Create the rollup tables and (re)create the triggers maintaining them"""
+    for table, keys, key_exprs in ROLLUPS:
+        key_columns = ", ".join(f"{key} {'INTEGER' if key == 'finger_id' else 'TEXT'} NOT NULL" for key in keys)
+        columns = ", ".join(f"{name} {'REAL' if name == 'worked_hours' else 'INTEGER'} NOT NULL DEFAULT 0"
+                            for name, expr in measures)
+        c.execute(f"CREATE TABLE IF NOT EXISTS {table} ({key_columns}, {columns}, "
+                  f"PRIMARY KEY ({', '.join(keys)}))")
+
+    drop_rollup_triggers(c)
+    for event in TRIGGER_EVENTS:
+        statements = []
+        for rollup in ROLLUPS:
+            if event in ('DELETE', 'UPDATE'):
+                statements.append(_subtract(*rollup, 'OLD', measures))
+            if event in ('INSERT', 'UPDATE'):
+                statements.append(_add(*rollup, 'NEW', measures))
+        c.execute(f"CREATE TRIGGER attendance_rollups_{event.lower()} AFTER {event} ON attendance "
+                  f"BEGIN {' '.join(statements)} END")
+
+
+def drop_rollup_triggers(c):
+    """Stop maintaining the rollups, e.g. before rewriting every attendance row"""
+    for event in TRIGGER_EVENTS:
+        c.execute(f"DROP TRIGGER IF EXISTS attendance_rollups_{event.lower()}")
+
+
+def rebuild_rollups(c, measures=MEASURES):
+    """Recompute every rollup table from the attendance table"""
+    for table, keys, key_exprs in ROLLUPS:
+        groups = ", ".join(expr.format(row='attendance') for expr in key_exprs)
+        sums = ", ".join(f"SUM({expr.format(row='attendance')})" for name, expr in measures)
+        columns = ", ".join(keys + tuple(name for name, expr in measures))
+        c.execute(f"DELETE FROM {table}")
+        c.execute(f"INSERT INTO {table} ({columns}) SELECT {groups}, {sums} FROM attendance GROUP BY {groups}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Attendance rollup maintenance")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--db", help="database file (default: ATTENDANCE_DB or users.db)")
+    args = parser.parse_args()
+
+    from database import DB_PATH, Database
+    from migrations import migrate
+
+    db = Database(args.db or DB_PATH)
+    with db.transaction() as c:
+        migrate(c)
+        rebuild_rollups(c)
+        count = c.execute("SELECT COUNT(*) FROM daily_attendance").fetchone()[0]
+    db.close()
+    print(f"Rebuilt rollups for {count} days")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+"""Scanning daemon: owns the fingerprint sensor and records attendance.
+
+Run it as a service next to the database, then start the GUI as usual:
+
+    python3 scan_daemon.py --db users.db
+
+The daemon runs the ScanPipeline, writes check-ins and check-outs and
+enrolls new fingers, in a process of its own. A GUI that finds it
+listening on SCAN_SOCKET does not open the sensor; it becomes a client
+that shows the daemon's events and sends it commands. Report rendering,
+a frozen window or a restart of the GUI therefore never delays or loses
+a scan, and capture does not share a GIL with Tk.
+
+The protocol is one JSON object per line over a Unix socket.
+
+Commands (client to daemon):
+    {"command": "status"}
+    {"command": "start"} / {"command": "stop"}      start or stop scanning
+    {"command": "enroll", "finger_id", "name", "age", "department"}
+    {"command": "user_changed", "finger_id"}        after an edit or delete
+
+Events (daemon to every client), each with "event" and "time":
+    status        scanning, sensor_ready, enrolling, sensor, counts,
+                  readers (counts per reader name)
+    recorded      finger_id, attendance (the fields of an events.AttendanceEvent)
+    unknown       finger_id
+    no_match, image_failed
+    error         message
+    enroll        finger_id, message, done, ok
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+from attendance import TodayAttendance
+from cache import UserCache
+from events import AttendanceEvent, record_attendance
+from journal import JOURNAL_PATH, ScanJournal
+from scanner import ScanPipeline
+from sensor import SENSOR_PORT, copy_template, enroll
+from sync import SYNC_URL, SyncAgent
+
+# Unix socket the daemon listens on; override with ATTENDANCE_SCAN_SOCKET
+SCAN_SOCKET = os.environ.get("ATTENDANCE_SCAN_SOCKET", os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(), "attendance-scan.sock"))
+
+# Seconds a send to a client may block before the client is dropped, so
+# a stalled GUI cannot hold up the notify stage
+SEND_TIMEOUT = 1.0
+
+# Seconds between a client's attempts to reach a stopped daemon
+RECONNECT_INTERVAL = 2.0
+
+
+def _line(message):
+    return (json.dumps(message, separators=(',', ':')) + "\n").encode()
+
+
+class ScanDaemon:
+    """ScanPipeline plus a Unix socket server broadcasting its outcomes.
+
+    finger is one sensor or, for several readers, a dict mapping reader
+    names to sensors; fingers are enrolled on the first and copied to
+    the others. With a journal every match is journaled before it is
+    recorded (see journal.py).
+    """
+
+    def __init__(self, db, finger, path=SCAN_SOCKET, sensor_status="Fingerprint sensor connected", journal=None):
+        self.db = db
+        self.fingers = finger if isinstance(finger, dict) else {None: finger} if finger is not None else {}
+        self.finger = next(iter(self.fingers.values()), None)
+        self.path = path
+        self.sensor_status = sensor_status
+        self.user_cache = UserCache(db)
+        self.user_cache.load()
+        self.today_attendance = TodayAttendance(db)
+        self.today_attendance.load()
+        self.pipeline = (ScanPipeline(finger, self.record, self.notify, journal=journal)
+                         if self.finger is not None else None)
+        self.enrolling = False
+        self._clients = []
+        self._clients_lock = threading.Lock()
+        self._sensor_lock = threading.Lock()
+        self._server = None
+
+    def start(self, scanning=True):
+        """Listen on the socket and, unless scanning is False, start capturing"""
+        if os.path.exists(self.path):
+            # A daemon that died without cleaning up leaves its socket behind
+            if daemon_running(self.path):
+                raise RuntimeError(f"A scanning daemon is already listening on {self.path}")
+            os.remove(self.path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen()
+        thread = threading.Thread(target=self._accept, name="scan-daemon-accept")
+        thread.daemon = True
+        thread.start()
+        if scanning:
+            self.start_scanning()
+        return self
+
+    def stop(self):
+        """Stop capturing, close every connection and remove the socket"""
+        self.stop_scanning(wait=True)
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        with self._clients_lock:
+            clients, self._clients = self._clients, []
+        for client in clients:
+            client.close()
+
+    @property
+    def scanning(self):
+        return self.pipeline is not None and self.pipeline.running
+
+    def start_scanning(self):
+        with self._sensor_lock:
+            if self.pipeline is not None and not self.pipeline.running and not self.enrolling:
+                self.pipeline.start()
+        self.broadcast(self.status())
+
+    def stop_scanning(self, wait=False):
+        with self._sensor_lock:
+            if self.scanning:
+                self.pipeline.stop(wait)
+        self.broadcast(self.status())
+
+    def status(self):
+        return {'event': 'status', 'scanning': self.scanning, 'sensor_ready': self.finger is not None,
+                'enrolling': self.enrolling, 'sensor': self.sensor_status,
+                'counts': dict(self.pipeline.counts) if self.pipeline is not None else {},
+                'readers': self.pipeline.metrics() if self.pipeline is not None else {}}
+
+    def record(self, finger_id, confidence, reader=None, scanned_at=None):
+        """Record attendance for a matched fingerprint (pipeline record stage)"""
+        user = self.user_cache.get(finger_id)
+        if not user:
+            return None
+        return record_attendance(self.today_attendance, user, reader, scanned_at)
+
+    def notify(self, kind, data):
+        """Broadcast the outcome of a scan (pipeline notify stage)"""
+        event = {'event': kind}
+        if kind == 'recorded':
+            finger_id, attendance = data
+            event.update(finger_id=finger_id, attendance=attendance._asdict())
+        elif kind == 'unknown':
+            event['finger_id'] = data
+        elif kind == 'error':
+            event['message'] = str(data)
+        self.broadcast(event)
+
+    def broadcast(self, event):
+        """Send event to every client, dropping clients that do not keep up"""
+        event.setdefault('time', time.time())
+        line = _line(event)
+        with self._clients_lock:
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.sendall(line)
+            except OSError:
+                self._drop(client)
+
+    def user_changed(self, finger_id):
+        """Reload a user after the GUI edited or deleted it"""
+        row = self.db.query_one("SELECT finger_id, name, age, department FROM users WHERE finger_id = ?",
+                                (finger_id,))
+        if row:
+            self.user_cache.put(*row)
+            return
+        # Host-side matching keeps the templates in memory as well
+        matcher = getattr(self.finger, "matcher", None)
+        if matcher is not None:
+            matcher.remove(finger_id)
+        self.user_cache.remove(finger_id)
+        self.today_attendance.forget(finger_id)
+
+    def enroll(self, finger_id, name, age, department):
+        """Enroll a finger and register its user, pausing the scan pipeline meanwhile"""
+        def step(message):
+            self.broadcast({'event': 'enroll', 'finger_id': finger_id, 'message': message,
+                            'done': False, 'ok': False})
+
+        def done(ok, message):
+            self.enrolling = False
+            self.broadcast({'event': 'enroll', 'finger_id': finger_id, 'message': message,
+                            'done': True, 'ok': ok})
+            if resume:
+                self.start_scanning()
+            else:
+                self.broadcast(self.status())
+
+        with self._sensor_lock:
+            if self.finger is None or self.enrolling:
+                self.broadcast({'event': 'enroll', 'finger_id': finger_id, 'done': True, 'ok': False,
+                                'message': "Sensor busy" if self.enrolling else "Sensor not connected"})
+                return
+            self.enrolling = True
+            resume = self.scanning
+            if self.pipeline is not None:
+                # Enrollment and the sensor stage share the sensor's buffers;
+                # this also waits for a run stopped without waiting
+                self.pipeline.stop(wait=True)
+        self.broadcast(self.status())
+        try:
+            if not enroll(self.finger, finger_id, step):
+                done(False, "Fingerprint enrollment failed")
+                return
+            failed = copy_template(self.finger, list(self.fingers.values())[1:], finger_id)
+            if failed:
+                print(f"Template {finger_id} not copied to {len(failed)} readers")
+            self.db.execute("INSERT OR REPLACE INTO users (finger_id, name, age, department) VALUES (?, ?, ?, ?)",
+                            (finger_id, name, age, department))
+            self.user_cache.put(finger_id, name, age, department)
+        except Exception as e:
+            done(False, f"Error: {e}")
+            return
+        done(True, "User registered successfully!")
+
+    def _accept(self):
+        while True:
+            try:
+                client, address = self._server.accept()
+            except OSError:
+                return
+            client.settimeout(SEND_TIMEOUT)
+            with self._clients_lock:
+                self._clients.append(client)
+            thread = threading.Thread(target=self._serve, args=(client,), name="scan-daemon-client")
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, client):
+        try:
+            client.sendall(_line(dict(self.status(), time=time.time())))
+            buffer = b""
+            while True:
+                try:
+                    data = client.recv(4096)
+                except socket.timeout:
+                    continue
+                if not data:
+                    break
+                buffer += data
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    if line.strip():
+                        self._command(json.loads(line))
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._drop(client)
+
+    def _command(self, message):
+        command = message.get('command')
+        if command == 'start':
+            self.start_scanning()
+        elif command == 'stop':
+            self.stop_scanning()
+        elif command == 'status':
+            self.broadcast(self.status())
+        elif command == 'user_changed':
+            self.user_changed(int(message['finger_id']))
+        elif command == 'enroll':
+            thread = threading.Thread(target=self.enroll, name="scan-daemon-enroll",
+                                      args=(int(message['finger_id']), message['name'],
+                                            message.get('age'), message.get('department')))
+            thread.daemon = True
+            thread.start()
+
+    def _drop(self, client):
+        with self._clients_lock:
+            if client in self._clients:
+                self._clients.remove(client)
+        client.close()
+
+
+def daemon_running(path=SCAN_SOCKET):
+    """True if a scanning daemon accepts connections on path"""
+    if not os.path.exists(path):
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+            return True
+        except OSError:
+            return False
+
+
+class ScanClient:
+    """A GUI's connection to the scanning daemon.
+
+    on_event(kind, data) is called from the client's thread for every
+    event, with the same (kind, data) pairs as ScanPipeline's notify()
+    (data of 'recorded' is (finger_id, AttendanceEvent)), plus
+    ('status', event), ('enroll', event) and ('disconnected', None) when
+    the daemon goes away. event_time is the daemon's time.time() of the
+    event being handled. The client keeps reconnecting until closed, so
+    the daemon and the GUI can be restarted independently.
+    """
+
+    def __init__(self, on_event, path=SCAN_SOCKET, reconnect=RECONNECT_INTERVAL):
+        self.on_event = on_event
+        self.path = path
+        self.reconnect = reconnect
+        self.connected = False
+        self.event_time = None
+        self._socket = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name="scan-client")
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def send(self, command, **fields):
+        """Send a command to the daemon; False if it is not connected"""
+        with self._lock:
+            if self._socket is None:
+                return False
+            try:
+                self._socket.sendall(_line(dict(fields, command=command)))
+                return True
+            except OSError:
+                return False
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            if self._socket is not None:
+                self._socket.close()
+
+    def _run(self):
+        while not self._closed.is_set():
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                conn.connect(self.path)
+            except OSError:
+                conn.close()
+                self._closed.wait(self.reconnect)
+                continue
+            with self._lock:
+                self._socket = conn
+            self.connected = True
+            try:
+                for line in conn.makefile('rb'):
+                    self._dispatch(json.loads(line))
+            except (OSError, ValueError):
+                pass
+            finally:
+                with self._lock:
+                    self._socket = None
+                conn.close()
+                self.connected = False
+            if not self._closed.is_set():
+                self._emit('disconnected', None)
+                self._closed.wait(self.reconnect)
+
+    def _dispatch(self, event):
+        kind = event['event']
+        self.event_time = event.get('time')
+        if kind == 'recorded':
+            self._emit(kind, (event['finger_id'], AttendanceEvent(**event['attendance'])))
+        elif kind == 'unknown':
+            self._emit(kind, event['finger_id'])
+        elif kind == 'error':
+            self._emit(kind, event['message'])
+        elif kind in ('status', 'enroll'):
+            self._emit(kind, event)
+        else:
+            self._emit(kind, None)
+
+    def _emit(self, kind, data):
+        try:
+            self.on_event(kind, data)
+        except Exception as e:
+            print(f"Scan event error: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fingerprint scanning daemon")
+    parser.add_argument("--db", help="database file (default: ATTENDANCE_DB or users.db)")
+    parser.add_argument("--socket", default=SCAN_SOCKET, help="Unix socket to listen on")
+    parser.add_argument("--sensor", default=SENSOR_PORT, help="sensor port (default: FINGERPRINT_SENSOR)")
+    parser.add_argument("--no-scan", action="store_true", help="wait for a client's start command")
+    parser.add_argument("--simulate-users", type=int, metavar="N",
+                        help="with a simulated sensor, enroll finger IDs 0..N-1 and present them "
+                             "one after another (load testing)")
+    parser.add_argument("--journal", default=JOURNAL_PATH, metavar="PATH",
+                        help="scan journal file (default: ATTENDANCE_JOURNAL or scan_journal.bin)")
+    parser.add_argument("--no-journal", action="store_true", help="record scans without journaling them first")
+    parser.add_argument("--sync", default=SYNC_URL, metavar="URL",
+                        help="aggregator to replicate attendance to (default: ATTENDANCE_SYNC_URL)")
+    args = parser.parse_args()
+
+    from database import DB_PATH, Database
+    from migrations import migrate
+    from sensor import SimulatedSensor, open_readers, reader_ports, reader_status
+
+    db = Database(args.db or DB_PATH)
+    with db.transaction() as c:
+        migrate(c)
+
+    simulators = {}
+    if args.simulate_users:
+        # Each simulated reader presents everyone, starting at a different person
+        names = [name for name, port in reader_ports(args.sensor) if port == "simulated"]
+        for index, name in enumerate(names):
+            simulator = SimulatedSensor(enrolled=range(args.simulate_users), dwell=0.3)
+            start = index * args.simulate_users // len(names)
+            simulator.present(*[(start + i) % args.simulate_users for i in range(1000000)])
+            simulators[name] = simulator
+    readers = open_readers(args.sensor, simulators, db=db)
+    status = reader_status(readers)
+    if any(reader.finger is None for reader in readers):
+        print(status)
+    finger = {reader.name: reader.finger for reader in readers if reader.finger is not None}
+    if len(readers) == 1:
+        finger = readers[0].finger
+
+    journal = None if args.no_journal else ScanJournal(args.journal)
+    daemon = ScanDaemon(db, finger, args.socket, status, journal).start(scanning=not args.no_scan)
+    agent = SyncAgent(db, args.sync).start() if args.sync else None
+    print(f"Scanning daemon listening on {args.socket}", flush=True)
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    try:
+        while not stopped.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+        if agent is not None:
+            agent.stop()
+        if journal is not None:
+            journal.close()
+        db.close()
+        for reader in readers:
+            if reader.uart:
+                reader.uart.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from journal import JournalFull
+
+# Ignore repeat matches of the same finger within this many seconds
+DEBOUNCE_SECONDS = 3.0
+
+# Poll interval bounds while waiting for a finger. The interval starts at
+# MIN_POLL_INTERVAL after activity and backs off to MAX_POLL_INTERVAL
+# while the sensor stays idle.
+MIN_POLL_INTERVAL = 0.02
+MAX_POLL_INTERVAL = 0.2
+POLL_BACKOFF = 1.5
+
+# Matches waiting for the record stage before the sensor stage blocks
+RECORD_QUEUE_SIZE = 32
+
+# Seconds before a journaled scan whose database write failed is tried
+# again, doubling up to RETRY_MAX while the failures last
+RETRY_INTERVAL = 0.5
+RETRY_MAX = 30
+
+_STOP = object()
+
+
+class ScanPipeline:
+    """Fingerprint scanning split into sensor, record and notify stages.
+
+    The sensor stage captures an image, converts it and searches the
+    sensor library. These three commands share the module's image and
+    character buffers, so they run back to back in one thread. Matches
+    are handed to the record stage, which calls record(finger_id,
+    confidence, reader, scanned_at) and is where the database write
+    happens; scanned_at is the datetime of the match. Every
+    outcome is then passed to notify(kind, data) on the notify stage, so
+    neither a slow write nor a UI update delays the next capture.
+
+    finger is one sensor, or a dict mapping reader names to sensors for
+    a site with several readers. Each reader gets a sensor stage thread
+    of its own; they all feed the one record stage, so scans are
+    recorded one at a time in the order they were matched, and the
+    debounce is shared: the same finger seen at two readers within
+    debounce seconds is recorded once. reader is None for a single
+    sensor. counts totals every reader; reader_counts has the same
+    figures, plus errors, per reader.
+
+    With a journal (journal.ScanJournal) the sensor stage appends each
+    match to it instead of handing it over in memory, and the record
+    stage applies the journal in order, marking each entry applied once
+    recorded. A record() that fails with sqlite3.OperationalError
+    ("database is locked", a full disk, an I/O error) or OSError is
+    tried again after retry seconds, doubling while it keeps failing,
+    instead of losing the scan; other errors would fail again and are
+    reported and skipped. A full journal holds up the sensor stages until
+    there is room again, as a full record queue does without one.
+    Entries still pending when the pipeline stops, or left by a crash,
+    are recorded when a pipeline on the same journal starts.
+
+    notify() receives one of:
+        ('recorded', (finger_id, result))  record() returned a result
+        ('unknown', finger_id)            record() returned None
+        ('no_match', None)                finger not found in the library
+        ('image_failed', None)            image could not be converted
+        ('error', exception)              sensor or record error
+    """
+
+    def __init__(self, finger, record, notify, debounce=DEBOUNCE_SECONDS,
+                 min_poll=MIN_POLL_INTERVAL, max_poll=MAX_POLL_INTERVAL, journal=None,
+                 retry=RETRY_INTERVAL):
+        self.readers = finger if isinstance(finger, dict) else {None: finger}
+        self.finger = finger
+        self.record = record
+        self.notify = notify
+        self.debounce = debounce
+        self.min_poll = min_poll
+        self.max_poll = max_poll
+        self.journal = journal
+        self.retry = retry
+        self.running = False
+        self.counts = {"captured": 0, "matched": 0, "debounced": 0, "recorded": 0}
+        self.reader_counts = {name: dict(self.counts, errors=0) for name in self.readers}
+        self._last_seen = {}
+        self._sensors_running = 0
+        self._lock = threading.Lock()
+        self._record_queue = queue.Queue(maxsize=RECORD_QUEUE_SIZE)
+        self._notify_queue = queue.Queue()
+        self._threads = []
+
+    def start(self):
+        """Start the sensor stage threads and the record and notify stages"""
+        # A run stopped without waiting finishes first, so its threads do
+        # not share the queues and counters with the new ones
+        for thread in self._threads:
+            thread.join()
+        self.running = True
+        self._threads = []
+        self._sensors_running = len(self.readers)
+        stages = [((lambda name=name, finger=finger: self._sensor_stage(name, finger)),
+                   "scan-sensor" if name is None else f"scan-sensor-{name}")
+                  for name, finger in self.readers.items()]
+        stages += [(self._record_stage if self.journal is None else self._journal_stage, "scan-record"),
+                   (self._notify_stage, "scan-notify")]
+        for target, name in stages:
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, wait=False):
+        """Stop capturing; queued matches are still recorded and notified"""
+        self.running = False
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def finished(self):
+        """Whether every stage of the last run has exited"""
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def metrics(self):
+        """Per-reader counts, keyed by reader name"""
+        with self._lock:
+            return {name: dict(counts) for name, counts in self.reader_counts.items()}
+
+    def summary(self):
+        """Short per-reader description for the status bar"""
+        return "Readers: " + ", ".join(f"{name} {counts['recorded']} recorded, {counts['errors']} errors"
+                                       for name, counts in self.metrics().items())
+
+    def _count(self, reader, name):
+        with self._lock:
+            self.counts[name] += 1
+            # A replayed journal entry may come from a reader no longer configured
+            if reader in self.reader_counts:
+                self.reader_counts[reader][name] += 1
+
+    def _sensor_stage(self, reader, finger):
+        interval = self.min_poll
+        while self.running:
+            try:
+                if finger.get_image() != 0:
+                    # No finger on the sensor: back off gradually
+                    time.sleep(interval)
+                    interval = min(interval * POLL_BACKOFF, self.max_poll)
+                    continue
+
+                interval = self.min_poll
+                self._count(reader, "captured")
+                if finger.image_2_tz(1) != 0:
+                    self._notify_queue.put(("image_failed", None))
+                    continue
+                if finger.finger_search() != 0:
+                    self._notify_queue.put(("no_match", None))
+                    continue
+
+                finger_id = finger.finger_id
+                now = time.monotonic()
+                with self._lock:
+                    self.counts["matched"] += 1
+                    self.reader_counts[reader]["matched"] += 1
+                    # Same finger still on a sensor, scanned twice in a
+                    # row or at two readers at once
+                    debounced = now - self._last_seen.get(finger_id, -self.debounce) < self.debounce
+                    self._last_seen[finger_id] = now
+                    if debounced:
+                        self.counts["debounced"] += 1
+                        self.reader_counts[reader]["debounced"] += 1
+                if debounced:
+                    continue
+                scanned_at = time.time()
+                if self.journal is not None:
+                    self._journal_append(finger_id, finger.confidence, reader, scanned_at)
+                else:
+                    self._record_queue.put((finger_id, finger.confidence, reader, scanned_at))
+            except Exception as e:
+                with self._lock:
+                    self.reader_counts[reader]["errors"] += 1
+                self._notify_queue.put(("error", e))
+                time.sleep(self.max_poll)
+        with self._lock:
+            self._sensors_running -= 1
+        # The journal stage watches _sensors_running instead; nothing
+        # reads the record queue then
+        if self.journal is None:
+            self._record_queue.put(_STOP)
+
+    def _journal_append(self, finger_id, confidence, reader, scanned_at):
+        # A full journal holds up capturing until the record stage makes
+        # room, rather than the scan being dropped; only a stop gives up
+        reported = False
+        while True:
+            try:
+                self.journal.append(finger_id, confidence, reader, scanned_at, timeout=self.max_poll)
+                return
+            except JournalFull as e:
+                if not self.running:
+                    raise
+                if not reported:
+                    self._notify_queue.put(("error", e))
+                    reported = True
+
+    def _record_stage(self):
+        running = len(self.readers)
+        while running:
+            item = self._record_queue.get()
+            if item is _STOP:
+                running -= 1
+                continue
+            finger_id, confidence, reader, scanned_at = item
+            try:
+                result = self.record(finger_id, confidence, reader, datetime.fromtimestamp(scanned_at))
+            except Exception as e:
+                self._notify_queue.put(("error", e))
+                continue
+            self._recorded(finger_id, reader, result)
+        self._notify_queue.put(_STOP)
+
+    def _recorded(self, finger_id, reader, result):
+        if result is None:
+            self._notify_queue.put(("unknown", finger_id))
+        else:
+            self._count(reader, "recorded")
+            self._notify_queue.put(("recorded", (finger_id, result)))
+
+    def _journal_stage(self):
+        retry = self.retry
+        while True:
+            entries = self.journal.pending()
+            if not entries:
+                with self._lock:
+                    if not self._sensors_running:
+                        break
+                self.journal.wait(self.max_poll)
+                continue
+            for entry in entries:
+                try:
+                    result = self.record(entry.finger_id, entry.confidence, entry.reader,
+                                         datetime.fromtimestamp(entry.scanned_at))
+                except (sqlite3.OperationalError, OSError) as e:
+                    # Locked, full or failing storage: keep the scan and try again
+                    self._notify_queue.put(("error", e))
+                    with self._lock:
+                        if not self._sensors_running:
+                            # Stopping; the journal keeps it for the next start
+                            self._notify_queue.put(_STOP)
+                            return
+                    # Pause, but not past a stop()
+                    waited = 0
+                    while self.running and waited < retry:
+                        time.sleep(self.max_poll)
+                        waited += self.max_poll
+                    retry = min(retry * 2, RETRY_MAX)
+                    break
+                except Exception as e:
+                    # Anything else, such as a constraint violation, would
+                    # fail again: report it and move on
+                    self._notify_queue.put(("error", e))
+                    self.journal.mark_applied(entry.seq)
+                    continue
+                retry = self.retry
+                self.journal.mark_applied(entry.seq)
+                self._recorded(entry.finger_id, entry.reader, result)
+        self._notify_queue.put(_STOP)
+
+    def _notify_stage(self):
+        while True:
+            item = self._notify_queue.get()
+            if item is _STOP:
+                break
+            try:
+                self.notify(*item)
+            except Exception as e:
+                print(f"Scan notify error: {e}")
@@ -0,0 +1,616 @@
+"""Fingerprint sensor backends.
+
+Every backend exposes the subset of the Adafruit_Fingerprint interface the
+application uses: get_image(), image_2_tz(slot), finger_search(),
+create_model(), store_model(location, slot), delete_model(location),
+count_templates(), read_templates(), get_fpdata("char", slot),
+send_fpdata(data, "char", slot), compare_templates() and the finger_id /
+confidence / template_count / templates attributes. Methods return R307
+confirmation codes (OK on success).
+
+open_sensor() picks a backend from a port name:
+
+    /dev/serial0, /dev/ttyUSB0, ...  real R307 over pyserial
+    simulated                        in-process SimulatedSensor
+    simulated-pty                    SimulatedSensor behind a pseudo
+                                     terminal speaking the R307 packet
+                                     protocol, driven by Adafruit_Fingerprint
+
+Serial ports are driven by Adafruit_Fingerprint, or with
+FINGERPRINT_DRIVER=asyncio by r307.BlockingR307, which does the serial
+I/O of every sensor on one event loop.
+
+A site with several entrances lists one reader per port, optionally
+named, separated by commas (FINGERPRINT_SENSOR="front=/dev/ttyUSB0,
+back=/dev/ttyUSB1"); open_readers() opens them all. Every reader keeps
+its own library in sensor matching mode, so copy_template() stores a
+finger enrolled on one reader on the others as well.
+
+With FINGERPRINT_MATCHING=host the sensor is wrapped in a
+matcher.HostMatchingSensor, which keeps templates in the database and
+matches on the host instead of in the sensor's 128-slot library.
+"""
+import collections
+import os
+import random
+import struct
+import threading
+import time
+import tty
+
+# Sensor used by the GUI, or several as [name=]port,[name=]port,...;
+# override with FINGERPRINT_SENSOR
+SENSOR_PORT = os.environ.get("FINGERPRINT_SENSOR", "/dev/serial0")
+SENSOR_BAUDRATE = 57600
+
+# 'sensor' searches the R307's own library; 'host' matches templates
+# stored in the database (see matcher.py)
+MATCHING = os.environ.get("FINGERPRINT_MATCHING", "sensor")
+
+# 'adafruit' uses the blocking Adafruit_Fingerprint driver; 'asyncio'
+# the non-blocking driver in r307.py
+DRIVER = os.environ.get("FINGERPRINT_DRIVER", "adafruit")
+
+# Confirmation codes returned by the R307 and adafruit_fingerprint
+OK = 0x00
+PACKETRECIEVEERR = 0x01
+NOFINGER = 0x02
+IMAGEFAIL = 0x03
+IMAGEMESS = 0x06
+FEATUREFAIL = 0x07
+NOMATCH = 0x08
+NOTFOUND = 0x09
+ENROLLMISMATCH = 0x0A
+BADLOCATION = 0x0B
+DELETEFAIL = 0x10
+PASSFAIL = 0x13
+INVALIDREG = 0x1A
+
+# R307 packet protocol
+STARTCODE = 0xEF01
+DEFAULT_ADDRESS = [0xFF, 0xFF, 0xFF, 0xFF]
+COMMANDPACKET = 0x01
+DATAPACKET = 0x02
+ACKPACKET = 0x07
+ENDDATAPACKET = 0x08
+
+GETIMAGE = 0x01
+IMAGE2TZ = 0x02
+COMPARE = 0x03
+FINGERPRINTSEARCH = 0x04
+REGMODEL = 0x05
+STORE = 0x06
+UPLOAD = 0x08
+DOWNLOAD = 0x09
+DELETE = 0x0C
+EMPTY = 0x0D
+READSYSPARA = 0x0F
+VERIFYPASSWORD = 0x13
+HISPEEDSEARCH = 0x1B
+TEMPLATECOUNT = 0x1D
+TEMPLATEREAD = 0x1F
+
+LIBRARY_SIZE = 128
+HOST_LIBRARY_SIZE = 10000
+TEMPLATE_SIZE = 512
+DATA_PACKET_SIZE = 128
+
+# Highest finger ID that can be registered with the configured matching
+MAX_FINGER_ID = (HOST_LIBRARY_SIZE if MATCHING == "host" else LIBRARY_SIZE) - 1
+
+# Templates uploaded from simulators, remembered so that a template
+# downloaded into another simulator is recognised as the same finger
+TRANSFERRED_TEMPLATES = 4096
+_transferred = collections.OrderedDict()
+_transferred_lock = threading.Lock()
+
+Reader = collections.namedtuple('Reader', 'name port uart finger error')
+
+
+def build_packet(packet_type, payload, address=DEFAULT_ADDRESS):
+    """Frame payload bytes as an R307 packet"""
+    length = len(payload) + 2
+    body = [packet_type, length >> 8, length & 0xFF] + list(payload)
+    checksum = sum(body) & 0xFFFF
+    return bytes([STARTCODE >> 8, STARTCODE & 0xFF] + list(address) + body
+                 + [checksum >> 8, checksum & 0xFF])
+
+
+def parse_packet(buffer):
+    """Split the first complete packet off buffer.
+
+    Returns (packet_type, payload, address, rest) or None when buffer
+    does not hold a whole packet yet. Bytes before the start code are
+    skipped; a checksum mismatch raises ValueError.
+    """
+    start = buffer.find(bytes([STARTCODE >> 8, STARTCODE & 0xFF]))
+    if start < 0 or len(buffer) - start < 9:
+        return None
+    buffer = buffer[start:]
+    address = list(buffer[2:6])
+    packet_type, length = struct.unpack(">BH", buffer[6:9])
+    if len(buffer) < 9 + length:
+        return None
+    payload = buffer[9:7 + length]
+    checksum = struct.unpack(">H", buffer[7 + length:9 + length])[0]
+    if checksum != sum(buffer[6:7 + length]) & 0xFFFF:
+        raise ValueError("R307 packet checksum mismatch")
+    return packet_type, bytes(payload), address, buffer[9 + length:]
+
+
+class SimulatedSensor:
+    """Software R307 with configurable latency, match rate and failures.
+
+    A finger is any hashable identity. Fingers queued with present() are
+    placed on the sensor one after another; each stays for dwell seconds
+    from the moment it is first imaged, followed by gap seconds with no
+    finger. image_2_tz() copies the finger into a character buffer,
+    create_model()/store_model() enroll it into a library slot and
+    finger_search() looks it up, so enrollment and identification behave
+    like the real module. enrolled maps library slots to identities
+    (a plain iterable enrolls identity N in slot N).
+
+    Each capture also produces TEMPLATE_SIZE bytes of characteristic
+    data: a fixed pattern per identity with template_noise of the bytes
+    randomised, which get_fpdata()/send_fpdata() transfer and
+    compare_templates() scores by the share of matching bytes.
+
+    Failure injection:
+        match_rate        chance an enrolled finger is found by a search
+        image_fail_rate   chance get_image() reports IMAGEFAIL
+        convert_fail_rate chance image_2_tz() reports IMAGEMESS
+        error_rate        chance any command raises RuntimeError, as the
+                          Adafruit driver does on a serial failure
+    """
+
+    def __init__(self, enrolled=(), library_size=LIBRARY_SIZE, dwell=0.5, gap=0.0,
+                 capture_latency=0.05, convert_latency=0.1, search_latency=0.15,
+                 store_latency=0.05, transfer_latency=0.09, template_noise=0.05,
+                 match_rate=1.0, image_fail_rate=0.0, convert_fail_rate=0.0,
+                 error_rate=0.0, seed=None):
+        self.library_size = library_size
+        self.dwell = dwell
+        self.gap = gap
+        self.capture_latency = capture_latency
+        self.convert_latency = convert_latency
+        self.search_latency = search_latency
+        self.store_latency = store_latency
+        self.transfer_latency = transfer_latency
+        self.template_noise = template_noise
+        self.match_rate = match_rate
+        self.image_fail_rate = image_fail_rate
+        self.convert_fail_rate = convert_fail_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+        if not isinstance(enrolled, dict):
+            enrolled = {slot: slot for slot in enrolled}
+        self.library = dict(enrolled)
+        self.finger_id = None
+        self.confidence = None
+        self.template_count = len(self.library)
+        self.templates = []
+        self.commands = 0
+
+        self._waiting = collections.deque()
+        self._current = None
+        self._placed_at = None
+        self._lifted_at = None
+        self._image = None
+        self._char_buffers = {1: None, 2: None}
+        self._char_data = {1: None, 2: None}
+        self._lock = threading.Lock()
+
+    def present(self, *fingers):
+        """Queue fingers to be placed on the sensor one after another"""
+        with self._lock:
+            self._waiting.extend(fingers)
+
+    def _finger_on_sensor(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._current is not None and now - self._placed_at > self.dwell:
+                self._current = None
+                self._lifted_at = self._placed_at + self.dwell
+            if (self._current is None and self._waiting
+                    and (self._lifted_at is None or now - self._lifted_at >= self.gap)):
+                self._current = self._waiting.popleft()
+                self._placed_at = now
+            return self._current
+
+    def template(self, identity):
+        """Characteristic data for one capture of identity"""
+        data = bytearray(random.Random(f"template:{identity}").randbytes(TEMPLATE_SIZE))
+        for index in self.random.sample(range(TEMPLATE_SIZE), int(TEMPLATE_SIZE * self.template_noise)):
+            data[index] = self.random.randrange(256)
+        return bytes(data)
+
+    def _command(self, latency):
+        """Account for one command: sleep for its latency and maybe fail"""
+        self.commands += 1
+        if latency:
+            time.sleep(latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise RuntimeError("Failed to read data from sensor")
+
+    def get_image(self):
+        self._command(self.capture_latency)
+        self._image = self._finger_on_sensor()
+        if self._image is None:
+            return NOFINGER
+        if self.image_fail_rate and self.random.random() < self.image_fail_rate:
+            self._image = None
+            return IMAGEFAIL
+        return OK
+
+    def image_2_tz(self, slot=1):
+        self._command(self.convert_latency)
+        if self._image is None:
+            return FEATUREFAIL
+        if self.convert_fail_rate and self.random.random() < self.convert_fail_rate:
+            return IMAGEMESS
+        self._char_buffers[slot] = self._image
+        self._char_data[slot] = self.template(self._image)
+        return OK
+
+    def create_model(self):
+        self._command(self.convert_latency)
+        if self._char_buffers[1] is None or self._char_buffers[1] != self._char_buffers[2]:
+            return ENROLLMISMATCH
+        return OK
+
+    def store_model(self, location, slot=1):
+        self._command(self.store_latency)
+        if not 0 <= location < self.library_size:
+            return BADLOCATION
+        self.library[location] = self._char_buffers[slot]
+        self.template_count = len(self.library)
+        return OK
+
+    def delete_model(self, location):
+        self._command(self.store_latency)
+        if self.library.pop(location, None) is None:
+            return DELETEFAIL
+        self.template_count = len(self.library)
+        return OK
+
+    def empty_library(self):
+        self._command(self.store_latency)
+        self.library.clear()
+        self.template_count = 0
+        return OK
+
+    def finger_search(self):
+        self._command(self.search_latency)
+        target = self._char_buffers[1]
+        self.finger_id = 0
+        self.confidence = 0
+        for location, identity in self.library.items():
+            if identity == target and target is not None:
+                if self.random.random() >= self.match_rate:
+                    break
+                self.finger_id = location
+                self.confidence = self.random.randint(50, 250)
+                return OK
+        return NOTFOUND
+
+    finger_fast_search = finger_search
+
+    def get_fpdata(self, sensorbuffer="char", slot=1):
+        self._command(self.transfer_latency)
+        data = self._char_data[slot] or b""
+        if data and self._char_buffers[slot] is not None:
+            with _transferred_lock:
+                _transferred[data] = self._char_buffers[slot]
+                while len(_transferred) > TRANSFERRED_TEMPLATES:
+                    _transferred.popitem(last=False)
+        return list(data)
+
+    def send_fpdata(self, data, sensorbuffer="char", slot=1):
+        self._command(self.transfer_latency)
+        with _transferred_lock:
+            self._char_buffers[slot] = _transferred.get(bytes(data))
+        self._char_data[slot] = bytes(data)
+        return True
+
+    def compare_templates(self):
+        self._command(self.search_latency)
+        first, second = self._char_data[1], self._char_data[2]
+        if not first or not second:
+            self.confidence = 0
+            return NOMATCH
+        same = sum(a == b for a, b in zip(first, second)) / max(len(first), len(second))
+        self.confidence = int(same * 300)
+        return OK if same >= 0.5 else NOMATCH
+
+    def count_templates(self):
+        self._command(0)
+        self.template_count = len(self.library)
+        return OK
+
+    def read_templates(self):
+        self._command(0)
+        self.templates = sorted(self.library)
+        return OK
+
+
+class PtySensorServer:
+    """Serve a SimulatedSensor over a pseudo terminal using the R307 protocol.
+
+    The slave side of the pty (port) can be opened with pyserial and
+    driven by Adafruit_Fingerprint or any other R307 driver. Commands
+    that raise in the simulator get no reply, which the driver sees as a
+    serial timeout, just as with a flaky cable.
+    """
+
+    def __init__(self, sensor, address=DEFAULT_ADDRESS, password=(0, 0, 0, 0)):
+        self.sensor = sensor
+        self.address = list(address)
+        self.password = list(password)
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+        self.running = False
+        self._thread = None
+        self._upload = None
+        self._download = None
+
+    def start(self):
+        """Start answering commands in a background thread"""
+        self.running = True
+        self._thread = threading.Thread(target=self._serve, name="r307-pty")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the pty"""
+        self.running = False
+        for fd in (self.slave_fd, self.master_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _serve(self):
+        buffer = b""
+        while self.running:
+            try:
+                data = os.read(self.master_fd, 4096)
+            except OSError:
+                break
+            if not data:
+                break
+            buffer += data
+            while True:
+                try:
+                    packet = parse_packet(buffer)
+                except ValueError:
+                    # Corrupt packet: reply with a receive error and resync
+                    os.write(self.master_fd, build_packet(ACKPACKET, [PACKETRECIEVEERR], self.address))
+                    buffer = buffer[2:]
+                    continue
+                if packet is None:
+                    break
+                packet_type, payload, address, buffer = packet
+                if packet_type in (DATAPACKET, ENDDATAPACKET) and self._download:
+                    # Template data sent after a DOWNLOAD command
+                    slot, data = self._download
+                    data += payload
+                    if packet_type == ENDDATAPACKET:
+                        self._download = None
+                        self.sensor.send_fpdata(bytes(data), "char", slot)
+                    continue
+                if packet_type != COMMANDPACKET or not payload:
+                    continue
+                try:
+                    reply = self.handle(payload[0], payload[1:])
+                except RuntimeError:
+                    continue
+                os.write(self.master_fd, build_packet(ACKPACKET, reply, self.address))
+                if self._upload is not None:
+                    self._send_data(self._upload)
+                    self._upload = None
+
+    def _send_data(self, data):
+        """Send data as DATA packets followed by an END DATA packet"""
+        chunks = [data[i:i + DATA_PACKET_SIZE] for i in range(0, len(data), DATA_PACKET_SIZE)] or [b""]
+        for index, chunk in enumerate(chunks):
+            packet_type = ENDDATAPACKET if index == len(chunks) - 1 else DATAPACKET
+            os.write(self.master_fd, build_packet(packet_type, chunk, self.address))
+
+    def handle(self, instruction, params):
+        """Run one command on the simulator and return the reply payload"""
+        sensor = self.sensor
+        if instruction == VERIFYPASSWORD:
+            return [OK if list(params[:4]) == self.password else PASSFAIL]
+        if instruction == READSYSPARA:
+            return [OK] + list(struct.pack(">HHHH", 0, 0x0009, sensor.library_size, 3)) \
+                + self.address + list(struct.pack(">HH", 2, SENSOR_BAUDRATE // 9600))
+        if instruction == GETIMAGE:
+            return [sensor.get_image()]
+        if instruction == IMAGE2TZ:
+            return [sensor.image_2_tz(params[0] if params else 1)]
+        if instruction == REGMODEL:
+            return [sensor.create_model()]
+        if instruction == STORE:
+            slot, location = struct.unpack(">BH", params[:3])
+            return [sensor.store_model(location, slot)]
+        if instruction == DELETE:
+            location = struct.unpack(">H", params[:2])[0]
+            return [sensor.delete_model(location)]
+        if instruction == EMPTY:
+            return [sensor.empty_library()]
+        if instruction == UPLOAD:
+            self._upload = bytes(sensor.get_fpdata("char", params[0] if params else 1))
+            return [OK]
+        if instruction == DOWNLOAD:
+            self._download = (params[0] if params else 1, bytearray())
+            return [OK]
+        if instruction == COMPARE:
+            code = sensor.compare_templates()
+            return [code] + list(struct.pack(">H", sensor.confidence or 0))
+        if instruction in (FINGERPRINTSEARCH, HISPEEDSEARCH):
+            code = sensor.finger_search()
+            return [code] + list(struct.pack(">HH", sensor.finger_id or 0, sensor.confidence or 0))
+        if instruction == TEMPLATECOUNT:
+            code = sensor.count_templates()
+            return [code] + list(struct.pack(">H", sensor.template_count))
+        if instruction == TEMPLATEREAD:
+            page = params[0] if params else 0
+            sensor.read_templates()
+            bitmap = [0] * 32
+            for location in sensor.templates:
+                index = location - page * 256
+                if 0 <= index < 256:
+                    bitmap[index // 8] |= 1 << (index % 8)
+            return [OK] + bitmap
+        return [INVALIDREG]
+
+
+def open_sensor(port=SENSOR_PORT, simulator=None, matching=MATCHING, db=None, matcher=None, driver=DRIVER):
+    """Open the fingerprint sensor named by port and return (uart, finger).
+
+    simulator supplies the SimulatedSensor used by the simulated ports;
+    a blank one is created when it is omitted. With matching='host' the
+    sensor is wrapped to match against the templates stored in db, or
+    against matcher, a TemplateMatcher shared by several readers.
+    driver='asyncio' drives serial ports with r307.BlockingR307, which
+    is then returned as the uart as well.
+    """
+    if port == "simulated":
+        uart, finger = None, simulator or SimulatedSensor()
+    else:
+        if port == "simulated-pty":
+            port = PtySensorServer(simulator or SimulatedSensor()).start().port
+        if driver == "asyncio":
+            from r307 import BlockingR307
+
+            uart = finger = BlockingR307(port, SENSOR_BAUDRATE)
+        else:
+            # pyserial and adafruit_fingerprint are only needed for serial ports
+            import serial
+            from adafruit_fingerprint import Adafruit_Fingerprint
+
+            uart = serial.Serial(port, baudrate=SENSOR_BAUDRATE, timeout=1)
+            finger = Adafruit_Fingerprint(uart)
+
+    if matching == "host":
+        # numpy is only needed for host-side matching
+        from matcher import HostMatchingSensor, TemplateMatcher
+        finger = HostMatchingSensor(finger, matcher or TemplateMatcher.from_db(db), db)
+    return uart, finger
+
+
+def reader_ports(spec=SENSOR_PORT):
+    """Split a FINGERPRINT_SENSOR value into (name, port) pairs.
+
+    Readers without a name are named after their port, numbered when
+    several share one (e.g. simulated-1, simulated-2).
+    """
+    pairs = []
+    for item in spec.split(","):
+        item = item.strip()
+        if item:
+            name, _, port = item.rpartition("=")
+            pairs.append((name.strip(), port.strip()))
+    ports = [port for name, port in pairs]
+    named = []
+    for index, (name, port) in enumerate(pairs):
+        if not name:
+            name = os.path.basename(port)
+            if ports.count(port) > 1:
+                name += f"-{ports[:index + 1].count(port)}"
+        named.append((name, port))
+    return named
+
+
+def open_readers(spec=SENSOR_PORT, simulators=None, matching=MATCHING, db=None):
+    """Open every reader of spec and return a list of Readers.
+
+    simulators maps reader names to the SimulatedSensors of simulated
+    ports. A reader that fails to open is returned with finger None and
+    the exception as error, so the others can still be used. With
+    matching='host' all readers share one TemplateMatcher.
+    """
+    matcher = None
+    if matching == "host":
+        from matcher import TemplateMatcher
+        matcher = TemplateMatcher.from_db(db)
+    readers = []
+    for name, port in reader_ports(spec):
+        try:
+            uart, finger = open_sensor(port, (simulators or {}).get(name), matching, db, matcher)
+            readers.append(Reader(name, port, uart, finger, None))
+        except Exception as e:
+            readers.append(Reader(name, port, None, None, e))
+    return readers
+
+
+def reader_status(readers):
+    """Status bar text for the Readers returned by open_readers()"""
+    failed = [reader for reader in readers if reader.finger is None]
+    if len(readers) == 1:
+        return f"Sensor not connected: {failed[0].error}" if failed else "Fingerprint sensor connected"
+    text = f"{len(readers) - len(failed)} of {len(readers)} fingerprint readers connected"
+    if failed:
+        text += " (" + ", ".join(f"{reader.name}: {reader.error}" for reader in failed) + ")"
+    return text
+
+
+def copy_template(source, targets, location, slot=1):
+    """Store the template in source's char buffer slot at location on every target sensor.
+
+    Used after enrolling on one reader in sensor matching mode, where
+    each reader searches its own library; host matching readers share
+    their library and are left alone. Returns the targets that failed.
+    """
+    if getattr(source, "matcher", None) is not None or not targets:
+        return []
+    data = source.get_fpdata("char", slot)
+    failed = []
+    for target in targets:
+        try:
+            target.send_fpdata(list(data), "char", slot)
+            if target.store_model(location, slot) != OK:
+                failed.append(target)
+        except Exception as e:
+            print(f"Template copy error: {e}")
+            failed.append(target)
+    return failed
+
+
+def _wait_for(finger, placed, timeout, poll):
+    """Poll get_image() until a finger is (or is no longer) on the sensor"""
+    deadline = time.monotonic() + timeout
+    while (finger.get_image() == OK) != placed:
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(poll)
+    return True
+
+
+def enroll(finger, location, step=None, timeout=10, poll=0.1):
+    """Enroll a finger into library slot location from two captures.
+
+    step(message) is called before each stage with the prompt to show.
+    Returns True once the model is stored.
+    """
+    step = step or (lambda message: None)
+    step("Place finger on sensor...")
+    if not _wait_for(finger, True, timeout, poll):
+        step("Timeout waiting for finger")
+        return False
+    if finger.image_2_tz(1) != OK:
+        return False
+
+    step("Remove finger...")
+    _wait_for(finger, False, timeout / 2, poll)
+    time.sleep(1)
+
+    step("Place same finger again...")
+    if not _wait_for(finger, True, timeout, poll):
+        step("Timeout waiting for finger")
+        return False
+    return (finger.image_2_tz(2) == OK and finger.create_model() == OK
+            and finger.store_model(location) == OK)
@@ -0,0 +1,195 @@
+"""Attendance statistics computed in SQL.
+
+attendance_statistics() returns every figure shown on the Reports tab
+and in the PDF reports (today, this week, this month and per department)
+from one aggregate pass over the users table and the day's rollup rows,
+plus one more query when all-time record counts are wanted.
+user_statistics() returns the per-user summary.
+
+The day's figures and the all-time ones are read from the rollup tables
+(see rollups.py) and the week and month figures probe the (finger_id,
+date) index once per user, so the cost depends on the number of users,
+departments and months rather than on the number of attendance rows.
+
+LiveStatistics keeps an AttendanceStats current from attendance events
+(see events.py) without querying again.
+"""
+import collections
+from datetime import date, timedelta
+
+DATE_FORMAT = '%Y-%m-%d'
+
+DepartmentStats = collections.namedtuple(
+    'DepartmentStats', 'department users present completed checked_in present_week present_month records')
+
+UserStats = collections.namedtuple(
+    'UserStats', 'finger_id name department days_present days_completed avg_hours')
+
+
+class AttendanceStats(collections.namedtuple('AttendanceStats', [
+        'day', 'department', 'total_users', 'present', 'completed', 'checked_in',
+        'present_week', 'present_month', 'total_records', 'departments'])):
+    """Attendance figures for one day.
+
+    present/completed/checked_in count users for day, present_week and
+    present_month count distinct users from the start of day's week and
+    month up to day. total_records and DepartmentStats.records are only
+    filled in when history was requested (None otherwise).
+    """
+
+    @property
+    def absent(self):
+        return self.total_users - self.present
+
+    def rate(self, count):
+        """count as a percentage of the registered users"""
+        return count / self.total_users * 100 if self.total_users else 0.0
+
+
+def attendance_statistics(db, day=None, department=None, history=False):
+    """Return AttendanceStats for day (default: today), optionally for one department"""
+    day = day or date.today()
+    week_start = day - timedelta(days=day.weekday())
+    month_start = day.replace(day=1)
+    params = {
+        'day': day.strftime(DATE_FORMAT),
+        'week': week_start.strftime(DATE_FORMAT),
+        'month': month_start.strftime(DATE_FORMAT),
+        'department': department,
+    }
+    user_filter = "WHERE u.department = :department" if department else ""
+
+    # One pass over the users: whether each came in between the start of
+    # the day's week or month and the day itself, through the
+    # (finger_id, date) index, so the cost does not grow with history.
+    # These count distinct people, which the rollups cannot: they hold
+    # records per day, and the monthly one cannot stop at the day.
+    rows = db.query(f"""
+        SELECT u.department, COUNT(*),
+               SUM(EXISTS (SELECT 1 FROM attendance w
+                           WHERE w.finger_id = u.finger_id AND w.date BETWEEN :week AND :day)),
+               SUM(EXISTS (SELECT 1 FROM attendance m
+                           WHERE m.finger_id = u.finger_id AND m.date BETWEEN :month AND :day))
+        FROM users u
+        {user_filter}
+        GROUP BY u.department
+        ORDER BY u.department""", params)
+
+    # The day's records per department and in total from the rollups
+    department_filter = "AND department = :department" if department else ""
+    today = {row[0]: row[1:] for row in db.query(f"""
+        SELECT NULLIF(department, ''), present, completed, checked_in FROM department_daily_attendance
+        WHERE date = :day {department_filter}""", params)}
+    if department:
+        totals = next(iter(today.values()), (0, 0, 0))
+    else:
+        totals = db.query_one("SELECT present, completed, checked_in FROM daily_attendance WHERE date = :day",
+                              params) or (0, 0, 0)
+
+    records = {}
+    if history:
+        records = dict(db.query(f"""
+            SELECT NULLIF(department, ''), SUM(present) FROM department_daily_attendance
+            {"WHERE department = :department" if department else ""}
+            GROUP BY department""", params))
+
+    departments = [DepartmentStats(name, users, *today.pop(name, (0, 0, 0)), week, month,
+                                   records.pop(name, 0) if history else None)
+                   for name, users, week, month in rows]
+    # Departments that only appear in the day's or older records (e.g.
+    # renamed since)
+    departments += [DepartmentStats(name, 0, *today.get(name, (0, 0, 0)), 0, 0,
+                                    records.get(name, 0) if history else None)
+                    for name in sorted(today.keys() | records.keys(), key=lambda name: name or "")]
+    present, completed, checked_in = totals
+
+    return AttendanceStats(
+        day=day,
+        department=department,
+        total_users=sum(d.users for d in departments),
+        present=present,
+        completed=completed,
+        checked_in=checked_in,
+        present_week=sum(d.present_week for d in departments),
+        present_month=sum(d.present_month for d in departments),
+        total_records=sum(d.records for d in departments) if history else None,
+        departments=tuple(departments),
+    )
+
+
+class LiveStatistics:
+    """AttendanceStats of one day kept current from attendance events.
+
+    load() runs attendance_statistics() and reads which users already
+    came in this week and month; apply(event) then counts a check-in or
+    check-out in memory. apply() returns False for an event it cannot
+    apply (another day, or a department the figures do not list yet),
+    after which the caller should load() again.
+    """
+
+    def __init__(self, db, department=None, history=False):
+        self.db = db
+        self.department = department
+        self.history = history
+        self.stats = None
+        self._week = set()
+        self._month = set()
+
+    def load(self, day=None):
+        """Query the figures of day (default: today)"""
+        self.stats = attendance_statistics(self.db, day, self.department, self.history)
+        day = self.stats.day
+        self._week = {row[0] for row in self.db.query(
+            "SELECT DISTINCT finger_id FROM attendance WHERE date BETWEEN ? AND ?",
+            ((day - timedelta(days=day.weekday())).strftime(DATE_FORMAT), day.strftime(DATE_FORMAT)))}
+        self._month = {row[0] for row in self.db.query(
+            "SELECT DISTINCT finger_id FROM attendance WHERE date BETWEEN ? AND ?",
+            (day.replace(day=1).strftime(DATE_FORMAT), day.strftime(DATE_FORMAT)))}
+        return self.stats
+
+    def apply(self, event):
+        """Count event in the figures; False if it needs a load() instead"""
+        if event.kind not in ('check_in', 'check_out') or self.stats is None:
+            return True
+        if event.date != self.stats.day.strftime(DATE_FORMAT):
+            return False
+        if self.department and event.department != self.department:
+            return True
+        departments = list(self.stats.departments)
+        index = next((i for i, d in enumerate(departments) if d.department == event.department), None)
+        if index is None:
+            return False
+
+        stats, department = self.stats, departments[index]
+        if event.kind == 'check_in':
+            week = event.finger_id not in self._week
+            month = event.finger_id not in self._month
+            self._week.add(event.finger_id)
+            self._month.add(event.finger_id)
+            counts = {'present': 1, 'checked_in': 1, 'present_week': int(week), 'present_month': int(month)}
+            if self.history:
+                counts['records'] = 1
+        else:
+            counts = {'checked_in': -1, 'completed': 1}
+        departments[index] = department._replace(
+            **{name: getattr(department, name) + count for name, count in counts.items()})
+        counts.pop('records', None)
+        if self.history:
+            counts['total_records'] = 1 if event.kind == 'check_in' else 0
+        self.stats = stats._replace(departments=tuple(departments),
+                                    **{name: getattr(stats, name) + count for name, count in counts.items()})
+        return True
+
+
+def user_statistics(db):
+    """Return UserStats for every user, most days present first"""
+    rows = db.query("""
+        SELECT u.finger_id, u.name, u.department,
+               COALESCE(SUM(r.present), 0) as days_present,
+               COALESCE(SUM(r.completed), 0) as days_completed,
+               SUM(r.worked_hours) / NULLIF(SUM(r.worked_days), 0) as avg_hours
+        FROM users u
+        LEFT JOIN user_monthly_attendance r ON u.finger_id = r.finger_id
+        GROUP BY u.finger_id
+        ORDER BY days_present DESC""")
+    return [UserStats(*row) for row in rows]
@@ -0,0 +1,445 @@
+"""Replicate attendance from many kiosks to a central store.
+
+Each kiosk logs its changes in the sync_outbox table: triggers on the
+attendance and users tables append one row per insert, update and
+delete, holding the row as JSON, in the same transaction as the change.
+A scan therefore costs one more small insert and never waits on the
+network. The triggers are only created, and the existing rows logged,
+when a SyncAgent first starts on the database (enable_sync), so a
+kiosk that never syncs keeps no outbox.
+
+SyncAgent ships the outbox in batches of up to SYNC_BATCH changes, as
+gzipped JSON, to an aggregator and records the last change acknowledged
+in sync_state, deleting the acknowledged rows. While the aggregator is
+unreachable the agent retries with backoff and the outbox grows, so a
+kiosk can be offline for days and catch up from where it stopped.
+
+The aggregator keeps one central database with the users and attendance
+of every site, keyed by the site id each kiosk generates once. Changes
+are applied idempotently. The aggregator remembers the last change
+number applied per site and skips anything at or below it, so a batch
+sent again after a lost acknowledgement changes nothing. Each central
+row also keeps the number of the change that wrote it, so an older
+change never overwrites a newer one: the last write at the kiosk wins,
+in the kiosk's own order, whatever its clock says. Deleting a user or
+their attendance at a kiosk marks the central rows deleted instead of
+removing them, and registering the finger ID again revives the user row
+with the new details.
+
+Run ``python3 sync.py serve --db central.db`` for the aggregator and
+``python3 sync.py agent --db users.db --url http://central:8090`` on each
+kiosk (or pass --sync to scan_daemon.py).
+"""
+import argparse
+import gzip
+import io
+import json
+import os
+import threading
+import time
+import urllib.request
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Aggregator the kiosks sync to; override with ATTENDANCE_SYNC_URL
+SYNC_URL = os.environ.get("ATTENDANCE_SYNC_URL")
+
+# Readable name sent along with the site id; defaults to the host name
+SITE_NAME = os.environ.get("ATTENDANCE_SITE_NAME") or os.uname().nodename
+
+# Address the aggregator listens on by default
+SYNC_HOST = "0.0.0.0"
+SYNC_PORT = 8090
+
+# Most changes sent in one request
+SYNC_BATCH = 500
+
+# Seconds between syncs once the outbox is empty, and the longest wait
+# between retries while the aggregator is unreachable
+SYNC_INTERVAL = 30
+MAX_BACKOFF = 600
+
+# Seconds to wait for the aggregator to answer
+SYNC_TIMEOUT = 30
+
+# Largest decompressed batch the aggregator accepts (bytes)
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+
+# Columns copied to the outbox per table, and the ones identifying a row
+# across sites
+SYNCED_TABLES = {
+    'users': (('finger_id',), ('name', 'age', 'department')),
+    'attendance': (('finger_id', 'date'),
+                   ('name', 'department', 'check_in_time', 'check_out_time', 'check_in_epoch',
+                    'check_out_epoch', 'worked_seconds', 'status', 'check_in_reader', 'check_out_reader')),
+}
+
+
+def _json_row(table, row):
+    keys, columns = SYNCED_TABLES[table]
+    return "json_object(" + ", ".join(f"'{column}', {row}.{column}" for column in keys + columns) + ")"
+
+
+def _log(table, op, row, where=""):
+    # Appends the row NEW or OLD of table to the outbox
+    return (f"INSERT INTO sync_outbox (entity, op, data, changed_at) "
+            f"SELECT '{table}', '{op}', {_json_row(table, row)}, CAST(strftime('%s', 'now') AS INTEGER){where};")
+
+
+def create_outbox(c):
+    """Create the sync_outbox and sync_state tables"""
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_outbox (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity TEXT NOT NULL,
+        op TEXT NOT NULL,
+        data TEXT NOT NULL,
+        changed_at INTEGER NOT NULL)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_state (
+        name TEXT PRIMARY KEY,
+        value TEXT)''')
+    c.execute("INSERT OR IGNORE INTO sync_state VALUES ('site', lower(hex(randomblob(8))))")
+    c.execute("INSERT OR IGNORE INTO sync_state VALUES ('acked', '0')")
+
+
+def enable_sync(c):
+    """Create the triggers filling the outbox; the first time, log every existing row as well"""
+    for table, (keys, columns) in SYNCED_TABLES.items():
+        # An update that changes the key also removes the row under its old key
+        moved = " OR ".join(f"OLD.{key} IS NOT NEW.{key}" for key in keys)
+        statements = [
+            ('INSERT', _log(table, 'upsert', 'NEW')),
+            ('UPDATE', _log(table, 'delete', 'OLD', f" WHERE {moved}") + " " + _log(table, 'upsert', 'NEW')),
+            ('DELETE', _log(table, 'delete', 'OLD')),
+        ]
+        for event, statement in statements:
+            c.execute(f"DROP TRIGGER IF EXISTS {table}_sync_{event.lower()}")
+            c.execute(f"CREATE TRIGGER {table}_sync_{event.lower()} AFTER {event} ON {table} "
+                      f"BEGIN {statement} END")
+    if c.execute("SELECT 1 FROM sync_state WHERE name = 'enabled'").fetchone() is None:
+        # The first sync sends the whole history
+        for table in SYNCED_TABLES:
+            c.execute(_log(table, 'upsert', table, f" FROM {table}"))
+        c.execute("INSERT INTO sync_state VALUES ('enabled', CAST(strftime('%s', 'now') AS TEXT))")
+
+
+def _acknowledge(c, seq):
+    # Never backwards: the rows up to the old value are already deleted
+    acked = int(c.execute("SELECT value FROM sync_state WHERE name = 'acked'").fetchone()[0])
+    if seq <= acked:
+        return
+    c.execute("UPDATE sync_state SET value = ? WHERE name = 'acked'", (str(seq),))
+    c.execute("DELETE FROM sync_outbox WHERE seq <= ?", (seq,))
+
+
+class SyncAgent:
+    """Ships a kiosk's outbox to the aggregator at url from a background thread.
+
+    Reads use the thread's own database connection and the
+    acknowledgements go through the writer queue like any other write,
+    so scans are never held up by the network. Creating an agent
+    enables the outbox on db (see enable_sync).
+    """
+
+    def __init__(self, db, url=SYNC_URL, site_name=SITE_NAME, batch=SYNC_BATCH, interval=SYNC_INTERVAL,
+                 timeout=SYNC_TIMEOUT):
+        self.db = db
+        self.url = url.rstrip("/") + "/sync"
+        self.site_name = site_name
+        self.batch = batch
+        self.interval = interval
+        self.timeout = timeout
+        with db.transaction() as c:
+            enable_sync(c)
+        self.site = db.query_value("SELECT value FROM sync_state WHERE name = 'site'")
+        self.sent = 0
+        self.bytes_sent = 0
+        self.last_sync = None
+        self.last_error = None
+        self._stopped = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sync-agent")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def sync_now(self):
+        """Wake the agent to sync without waiting for the interval"""
+        self._wake.set()
+
+    def acked(self):
+        return int(self.db.query_value("SELECT value FROM sync_state WHERE name = 'acked'"))
+
+    def pending(self):
+        """Number of changes not yet acknowledged by the aggregator"""
+        return self.db.query_value("SELECT COUNT(*) FROM sync_outbox WHERE seq > ?", (self.acked(),))
+
+    def sync_once(self):
+        """Send one batch and return the number of changes acknowledged (0 when up to date)"""
+        acked = self.acked()
+        rows = self.db.query("""SELECT seq, entity, op, data, changed_at FROM sync_outbox
+                                WHERE seq > ? ORDER BY seq LIMIT ?""", (acked, self.batch))
+        if not rows:
+            return 0
+        body = json.dumps({'site': self.site, 'name': self.site_name,
+                           'changes': [[seq, entity, op, json.loads(data), changed_at]
+                                       for seq, entity, op, data, changed_at in rows]}).encode()
+        body = gzip.compress(body)
+        request = urllib.request.Request(self.url, body, method="POST", headers={
+            'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            applied = json.load(response)['applied']
+        if applied < acked:
+            # The central database was reset or restored from a backup;
+            # the changes up to acked have been pruned here and are not resent
+            print(f"Sync warning: aggregator has applied up to {applied}, "
+                  f"below the {acked} it acknowledged before")
+        # The aggregator has everything up to applied, even if this batch
+        # was a repeat of one whose acknowledgement got lost
+        self.db.write(_acknowledge, min(applied, rows[-1][0]))
+        self.sent += len(rows)
+        self.bytes_sent += len(body)
+        self.last_sync = time.time()
+        self.last_error = None
+        return len(rows)
+
+    def _run(self):
+        backoff = self.interval
+        while not self._stopped.is_set():
+            try:
+                while self.sync_once() == self.batch and not self._stopped.is_set():
+                    pass
+                backoff = self.interval
+            except Exception as e:
+                print(f"Sync error: {e}")
+                self.last_error = str(e)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+            self._wake.wait(backoff)
+            self._wake.clear()
+
+
+def create_central(c):
+    """Create the aggregator's tables"""
+    c.execute('''CREATE TABLE IF NOT EXISTS sites (
+        site TEXT PRIMARY KEY,
+        name TEXT,
+        applied INTEGER NOT NULL DEFAULT 0,
+        last_seen REAL)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS site_users (
+        site TEXT NOT NULL,
+        finger_id INTEGER NOT NULL,
+        name TEXT,
+        age INTEGER,
+        department TEXT,
+        deleted INTEGER NOT NULL DEFAULT 0,
+        seq INTEGER NOT NULL,
+        changed_at INTEGER,
+        PRIMARY KEY (site, finger_id))''')
+    c.execute('''CREATE TABLE IF NOT EXISTS site_attendance (
+        site TEXT NOT NULL,
+        finger_id INTEGER NOT NULL,
+        date DATE NOT NULL,
+        name TEXT,
+        department TEXT,
+        check_in_time TIMESTAMP,
+        check_out_time TIMESTAMP,
+        check_in_epoch INTEGER,
+        check_out_epoch INTEGER,
+        worked_seconds INTEGER,
+        status TEXT,
+        check_in_reader TEXT,
+        check_out_reader TEXT,
+        deleted INTEGER NOT NULL DEFAULT 0,
+        seq INTEGER NOT NULL,
+        changed_at INTEGER,
+        PRIMARY KEY (site, finger_id, date))''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_site_attendance_date ON site_attendance (date)")
+
+
+def _upsert(c, table, site, seq, changed_at, data):
+    keys, columns = SYNCED_TABLES[table]
+    names = ("site",) + keys + columns + ("deleted", "seq", "changed_at")
+    updates = ", ".join(f"{name} = excluded.{name}" for name in columns + ("deleted", "seq", "changed_at"))
+    c.execute(f"INSERT INTO site_{table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))}) "
+              f"ON CONFLICT (site, {', '.join(keys)}) DO UPDATE SET {updates} "
+              f"WHERE excluded.seq > site_{table}.seq",
+              [site] + [data.get(name) for name in keys + columns] + [0, seq, changed_at])
+
+
+def _delete(c, table, site, seq, changed_at, data):
+    keys, columns = SYNCED_TABLES[table]
+    where = " AND ".join(f"{key} = ?" for key in keys)
+    c.execute(f"UPDATE site_{table} SET deleted = 1, seq = ?, changed_at = ? "
+              f"WHERE site = ? AND {where} AND seq < ?",
+              [seq, changed_at, site] + [data.get(key) for key in keys] + [seq])
+
+
+def _check_batch(batch):
+    """Raise ValueError unless batch has the shape SyncAgent sends"""
+    if not isinstance(batch, dict) or not isinstance(batch.get('site'), str) or not batch['site']:
+        raise ValueError("site missing")
+    if not isinstance(batch.get('changes'), list):
+        raise ValueError("changes missing")
+    for change in batch['changes']:
+        if not (isinstance(change, list) and len(change) == 5 and isinstance(change[0], int)
+                and isinstance(change[1], str) and change[2] in ('upsert', 'delete')
+                and isinstance(change[3], dict) and isinstance(change[4], (int, type(None)))):
+            raise ValueError(f"malformed change: {str(change)[:100]}")
+
+
+class Aggregator:
+    """The central store the kiosks' agents sync to"""
+
+    def __init__(self, db):
+        self.db = db
+        with db.transaction() as c:
+            create_central(c)
+
+    def apply(self, batch):
+        """Apply a batch sent by a SyncAgent and return the last change applied for its site"""
+        site = batch['site']
+        with self.db.transaction() as c:
+            c.execute("INSERT OR IGNORE INTO sites (site) VALUES (?)", (site,))
+            applied = c.execute("SELECT applied FROM sites WHERE site = ?", (site,)).fetchone()[0]
+            for seq, entity, op, data, changed_at in batch['changes']:
+                if seq <= applied:
+                    continue
+                if entity in SYNCED_TABLES:
+                    (_delete if op == 'delete' else _upsert)(c, entity, site, seq, changed_at, data)
+                applied = seq
+            c.execute("UPDATE sites SET name = ?, applied = ?, last_seen = ? WHERE site = ?",
+                      (batch.get('name'), applied, time.time(), site))
+        return applied
+
+    def sites(self):
+        """Every site with its name, last change applied, last contact and attendance rows"""
+        return self.db.query("""SELECT s.site, s.name, s.applied, s.last_seen,
+                                       (SELECT COUNT(*) FROM site_attendance a WHERE a.site = s.site AND NOT deleted)
+                                FROM sites s ORDER BY s.name""")
+
+
+class AggregatorHandler(BaseHTTPRequestHandler):
+    """POST /sync applies a batch; GET /sites lists the sites"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        if self.path != "/sync":
+            return self._reply(HTTPStatus.NOT_FOUND, {'error': f"no such resource: {self.path}"})
+        # Check the length before reading anything; the unread body means
+        # the connection cannot be reused after a rejection
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self.close_connection = True
+            return self._reply(HTTPStatus.LENGTH_REQUIRED, {'error': "Content-Length required"})
+        if not (length.isascii() and length.isdigit()):
+            self.close_connection = True
+            return self._reply(HTTPStatus.BAD_REQUEST, {'error': f"invalid Content-Length: {length[:20]}"})
+        if int(length) > MAX_BATCH_BYTES:
+            self.close_connection = True
+            return self._reply(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': "batch too large"})
+        try:
+            body = self.rfile.read(int(length))
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.GzipFile(fileobj=io.BytesIO(body)).read(MAX_BATCH_BYTES + 1)
+            if len(body) > MAX_BATCH_BYTES:
+                return self._reply(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': "batch too large"})
+            batch = json.loads(body)
+            _check_batch(batch)
+        except (ValueError, OSError) as e:
+            return self._reply(HTTPStatus.BAD_REQUEST, {'error': f"invalid batch: {e}"})
+        self._reply(HTTPStatus.OK, {'site': batch['site'], 'applied': self.server.aggregator.apply(batch)})
+
+    def do_GET(self):
+        if self.path != "/sites":
+            return self._reply(HTTPStatus.NOT_FOUND, {'error': f"no such resource: {self.path}"})
+        self._reply(HTTPStatus.OK, [dict(zip(('site', 'name', 'applied', 'last_seen', 'attendance'), row))
+                                    for row in self.server.aggregator.sites()])
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(aggregator, host=SYNC_HOST, port=SYNC_PORT):
+    """Return an HTTP server for aggregator; call serve_forever() on it"""
+    server = ThreadingHTTPServer((host, port), AggregatorHandler)
+    server.daemon_threads = True
+    server.aggregator = aggregator
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Attendance replication to a central store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    p = subparsers.add_parser("serve", help="run the aggregator")
+    p.add_argument("--db", default="central.db", help="central database file")
+    p.add_argument("--host", default=SYNC_HOST)
+    p.add_argument("--port", type=int, default=SYNC_PORT)
+    p = subparsers.add_parser("agent", help="sync a kiosk database to the aggregator")
+    p.add_argument("--db", help="database file (default: ATTENDANCE_DB or users.db)")
+    p.add_argument("--url", default=SYNC_URL, required=SYNC_URL is None, help="aggregator URL")
+    p.add_argument("--once", action="store_true", help="send everything pending, then exit")
+    p = subparsers.add_parser("status", help="show what a kiosk has not synced yet")
+    p.add_argument("--db", help="database file (default: ATTENDANCE_DB or users.db)")
+    args = parser.parse_args()
+
+    from database import DB_PATH, Database
+    from migrations import migrate
+
+    if args.command == "serve":
+        db = Database(args.db)
+        server = serve(Aggregator(db), args.host, args.port)
+        print(f"Aggregator listening on http://{args.host}:{args.port}", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            db.close()
+        return
+
+    db = Database(args.db or DB_PATH)
+    with db.transaction() as c:
+        migrate(c)
+    try:
+        if args.command == "status":
+            site = db.query_value("SELECT value FROM sync_state WHERE name = 'site'")
+            acked = db.query_value("SELECT value FROM sync_state WHERE name = 'acked'")
+            pending = db.query_value("SELECT COUNT(*) FROM sync_outbox WHERE seq > ?", (int(acked),))
+            print(f"site {site}: {pending} changes pending, acknowledged up to {acked}")
+        elif args.once:
+            agent = SyncAgent(db, args.url)
+            while agent.sync_once():
+                pass
+            print(f"Sent {agent.sent} changes")
+        else:
+            agent = SyncAgent(db, args.url).start()
+            print(f"Syncing site {agent.site} to {args.url}", flush=True)
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                agent.stop()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+# The modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+DEPARTMENTS = ["Engineering", "Sales", "HR", "Finance", "Operations"]
+USERS = 50
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A migrated database file with USERS registered users"""
+    path = str(tmp_path / "users.db")
+    db = Database(path)
+    with db.transaction() as c:
+        migrate(c)
+        c.executemany("INSERT INTO users VALUES (?, ?, ?, ?)",
+                      [(i, f"User {i}", 20 + i % 40, DEPARTMENTS[i % len(DEPARTMENTS)]) for i in range(USERS)])
+    db.close()
+    return path
+
+
+@pytest.fixture
+def db(db_path):
+    db = Database(db_path)
+    yield db
+    db.close()
@@ -0,0 +1,126 @@
+"""TodayAttendance decisions across restarts and midnight, on an injected clock"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from attendance import TodayAttendance
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock(datetime(2024, 3, 4, 8, 0))
+
+
+@pytest.fixture
+def users(db):
+    return db.query("SELECT * FROM users ORDER BY finger_id")
+
+
+def day_rows(db, day):
+    return db.query("""SELECT finger_id, check_in_time, check_out_time, status FROM attendance
+                       WHERE date = ? ORDER BY finger_id""", (day,))
+
+
+def scan_all(today_attendance, clock, people, expected):
+    for user in people:
+        clock.now += timedelta(seconds=1)
+        assert today_attendance.record(user) == expected, f"{user[0]} at {clock.now}"
+
+
+def open_table(db, clock):
+    today_attendance = TodayAttendance(db, clock=clock)
+    today_attendance.load()
+    return today_attendance
+
+
+@pytest.fixture
+def half_done(db, clock, users):
+    """Everyone checked in on 2024-03-04 and the first half checked out"""
+    first = open_table(db, clock)
+    scan_all(first, clock, users, 'check_in')
+    scan_all(first, clock, users[:len(users) // 2], 'check_out')
+    return first
+
+
+def test_first_second_and_third_scans(db, clock, users, half_done):
+    half = len(users) // 2
+    scan_all(half_done, clock, users[:half], 'already_checked_out')
+    rows = day_rows(db, '2024-03-04')
+    assert len(rows) == len(users)
+    assert sum(row[3] == 'completed' for row in rows) == half
+
+
+def test_restart_mid_day_reloads_state(db, clock, users, half_done):
+    half = len(users) // 2
+    clock.now = datetime(2024, 3, 4, 13, 0)
+    restarted = open_table(db, clock)
+    assert all(restarted.state(user[0]) == 'completed' for user in users[:half])
+    assert all(restarted.state(user[0]) == 'checked_in' for user in users[half:])
+    scan_all(restarted, clock, users[:half], 'already_checked_out')
+    scan_all(restarted, clock, users[half:], 'check_out')
+    assert len(day_rows(db, '2024-03-04')) == len(users)
+
+
+def test_stale_table_in_second_process(db, clock, users, half_done):
+    half = len(users) // 2
+    stale = open_table(db, clock)
+    # Checked out elsewhere since the stale table was loaded
+    scan_all(half_done, clock, users[half:half + 1], 'check_out')
+    scan_all(stale, clock, users[half:half + 1], 'already_checked_out')
+    # Checked in elsewhere: the stale table checks out instead of inserting
+    stale.forget(users[half + 1][0])
+    scan_all(stale, clock, users[half + 1:half + 2], 'check_out')
+    assert len(day_rows(db, '2024-03-04')) == len(users)
+
+
+def test_replayed_scan_time_is_recorded_once(db, clock, users, half_done):
+    user = users[-1]
+    replayed = datetime(2024, 3, 4, 13, 30)
+    assert half_done.record(user, replayed) == 'check_out'
+    before = day_rows(db, '2024-03-04')
+    assert half_done.record(user, replayed) == 'already_recorded'
+    assert day_rows(db, '2024-03-04') == before
+    assert half_done.record(user, replayed + timedelta(seconds=5)) == 'already_checked_out'
+
+
+def test_midnight_rollover(db, clock, users, half_done):
+    before = day_rows(db, '2024-03-04')
+    clock.now = datetime(2024, 3, 4, 23, 59, 58)
+    assert half_done.state(users[0][0]) == 'completed'
+    clock.now = datetime(2024, 3, 5, 0, 0, 0)
+    assert half_done.state(users[0][0]) == 'absent'
+    scan_all(half_done, clock, users, 'check_in')
+    scan_all(half_done, clock, users[:1], 'check_out')
+    assert [row[:2] for row in day_rows(db, '2024-03-04')] == [row[:2] for row in before]
+    assert len(day_rows(db, '2024-03-05')) == len(users)
+
+
+def test_scan_stamped_before_midnight_goes_on_its_own_day(db, clock, users, half_done):
+    clock.now = datetime(2024, 3, 5, 0, 0, 10)
+    scan_all(half_done, clock, users[1:2], 'check_in')
+    # Matched just before midnight, recorded after it
+    assert half_done.record(users[1], datetime(2024, 3, 4, 23, 59, 59)) == 'already_checked_out'
+    assert half_done.record(users[-1], datetime(2024, 3, 4, 23, 59, 59)) == 'check_out'
+    assert half_done.record(users[1], datetime(2024, 3, 5, 0, 0, 30)) == 'check_out'
+    assert day_rows(db, '2024-03-05')[0][0] == users[1][0]
+
+
+def test_restart_the_next_day(db, clock, users, half_done):
+    clock.now = datetime(2024, 3, 5, 9, 0)
+    next_day = open_table(db, clock)
+    assert next_day.state(users[0][0]) == 'absent'
+    scan_all(next_day, clock, users[:1], 'check_in')
+    scan_all(next_day, clock, users[:1], 'check_out')
+    scan_all(next_day, clock, users[1:2], 'check_in')
+    restarted = open_table(db, clock)
+    assert restarted.state(users[0][0]) == 'completed'
+    assert restarted.state(users[1][0]) == 'checked_in'
+    assert restarted.state(users[2][0]) == 'absent'
@@ -0,0 +1,178 @@
+"""ScanJournal recovery and journaled pipelines, including processes killed mid-scan"""
+import multiprocessing
+import os
+import random
+import signal
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from attendance import TodayAttendance
+from cache import UserCache
+from conftest import USERS
+from database import Database
+from events import record_attendance
+from journal import ENTRY, HEADER_SIZE, PAYLOAD, JournalFull, ScanJournal
+from scanner import RECORD_QUEUE_SIZE, ScanPipeline
+from sensor import SimulatedSensor
+
+CRASHES = 8
+MAX_RUN = 1.0           # most seconds a process scans before it is killed
+FAIL_RATE = 0.2         # share of record() calls failing as "database is locked"
+READERS = 4
+
+
+def recorder(db):
+    user_cache = UserCache(db)
+    user_cache.load()
+    today_attendance = TodayAttendance(db)
+    today_attendance.load()
+    return lambda finger_id, confidence, reader, scanned_at: record_attendance(
+        today_attendance, user_cache.get(finger_id), reader, scanned_at)
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    path = str(tmp_path / "journal.bin")
+    journal = ScanJournal(path, capacity=4096)
+    entries = [journal.append(i, 100, "reader-1") for i in range(40)]
+    journal.close()
+    # Corrupt the payload of the last entry, as a write cut short would
+    with open(path, "r+b") as f:
+        f.seek(HEADER_SIZE + (ENTRY.size + PAYLOAD.size + len("reader-1")) * (len(entries) - 1) + ENTRY.size)
+        f.write(b"\xff" * 4)
+    journal = ScanJournal(path)
+    assert journal.pending() == entries[:-1]
+    journal.append(99, 100)
+    journal.close()
+    journal = ScanJournal(path)
+    assert [entry.finger_id for entry in journal.pending()][-2:] == [38, 99]
+    journal.close()
+
+
+def test_full_journal_raises_or_waits_for_room(tmp_path):
+    journal = ScanJournal(str(tmp_path / "journal.bin"), capacity=256)
+    entries = []
+    with pytest.raises(JournalFull):
+        while True:
+            entries.append(journal.append(len(entries), 100, timeout=0))
+    assert entries
+    # Appending waits until the record stage applies what is there
+    threading.Timer(0.1, journal.mark_applied, (entries[-1].seq,)).start()
+    assert journal.append(99, 100, timeout=5).finger_id == 99
+    journal.close()
+
+
+def test_pipeline_restarts_more_often_than_the_record_queue_holds(tmp_path):
+    journal = ScanJournal(str(tmp_path / "journal.bin"))
+    pipeline = ScanPipeline({"reader-1": SimulatedSensor(enrolled=range(USERS))},
+                            lambda *scan: None, lambda kind, data: None, journal=journal)
+    for cycle in range(RECORD_QUEUE_SIZE + 8):
+        pipeline.start()
+        # In a daemon thread, so a pipeline that never stops fails the
+        # test instead of hanging it
+        stopping = threading.Thread(target=pipeline.stop, kwargs={"wait": True}, daemon=True)
+        stopping.start()
+        stopping.join(5)
+        assert pipeline.finished(), f"pipeline did not stop in restart {cycle + 1}"
+    journal.close()
+
+
+def scan_until_killed(path, journal_path, out):
+    """Scan with a journal until killed, writing each acknowledged append and record attempt to out"""
+
+    def report(kind, finger_id, scanned_at):
+        os.write(out, f"{kind} {finger_id} {scanned_at!r}\n".encode())
+
+    db = Database(path)
+    record = recorder(db)
+    journal = ScanJournal(journal_path)
+    append = journal.append
+
+    def acknowledged_append(finger_id, confidence, reader=None, scanned_at=None, wait=True, timeout=0):
+        entry = append(finger_id, confidence, reader, scanned_at, wait, timeout)
+        report("acked", finger_id, entry.scanned_at)
+        return entry
+
+    journal.append = acknowledged_append
+    failures = random.Random(os.getpid())
+
+    def failing_record(finger_id, confidence, reader, scanned_at):
+        report("attempt", finger_id, scanned_at.timestamp())
+        if failures.random() < FAIL_RATE:
+            raise sqlite3.OperationalError("database is locked")
+        return record(finger_id, confidence, reader, scanned_at)
+
+    sensors = {}
+    for index in range(READERS):
+        simulator = SimulatedSensor(enrolled=range(USERS), dwell=0.05, capture_latency=0, convert_latency=0,
+                                    search_latency=0)
+        people = list(range(USERS))
+        random.Random(os.getpid() + index).shuffle(people)
+        simulator.present(*people)
+        sensors[f"reader-{index + 1}"] = simulator
+    ScanPipeline(sensors, failing_record, lambda kind, data: None, journal=journal, retry=0.05).start()
+    while True:
+        time.sleep(1)
+
+
+def stamp(scanned_at):
+    """scanned_at as the attendance table stores it"""
+    return datetime.fromtimestamp(scanned_at).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def test_no_acknowledged_scan_is_lost_across_crashes(db_path, tmp_path):
+    journal_path = str(tmp_path / "journal.bin")
+    context = multiprocessing.get_context("fork")
+    acked, seen = set(), set()
+    timing = random.Random(1)
+    for crash in range(CRASHES):
+        read_end, write_end = os.pipe()
+        child = context.Process(target=scan_until_killed, args=(db_path, journal_path, write_end))
+        child.start()
+        os.close(write_end)
+        chunks = []
+        reader = threading.Thread(target=lambda: chunks.extend(iter(lambda: os.read(read_end, 65536), b"")))
+        reader.start()
+        time.sleep(timing.uniform(0.2, MAX_RUN))
+        os.kill(child.pid, signal.SIGKILL)
+        child.join()
+        reader.join()
+        os.close(read_end)
+        for line in b"".join(chunks).decode().splitlines():
+            kind, finger_id, scanned_at = line.split()
+            scan = (int(finger_id), stamp(float(scanned_at)))
+            seen.add(scan)
+            if kind == "acked":
+                acked.add(scan)
+        journal = ScanJournal(journal_path)
+        seen.update((entry.finger_id, stamp(entry.scanned_at)) for entry in journal.pending())
+        journal.close()
+    assert acked, "no scan was acknowledged"
+
+    # The next start applies whatever the last crash left
+    db = Database(db_path)
+    journal = ScanJournal(journal_path)
+    pipeline = ScanPipeline({}, recorder(db), lambda kind, data: None, journal=journal)
+    pipeline.start()
+    pipeline.stop(wait=True)
+    assert not journal.pending(), "journal not drained"
+    journal.close()
+    rows = db.query("SELECT finger_id, check_in_time, check_out_time FROM attendance")
+    db.close()
+
+    assert len({row[0] for row in rows}) == len(rows), "several rows for one person"
+    by_person = {row[0]: row for row in rows}
+    # Every acknowledged scan is in the database: as the check-in, the
+    # check-out, or after both as a duplicate
+    for finger_id, timestamp in acked:
+        row = by_person.get(finger_id)
+        assert row is not None, f"scan of {finger_id} at {timestamp} lost"
+        assert timestamp in row[1:] or (row[2] is not None and row[2] < timestamp), \
+            f"scan of {finger_id} at {timestamp} lost"
+    # and nothing was recorded that was never scanned
+    for finger_id, check_in, check_out in rows:
+        assert (finger_id, check_in) in seen, f"check-in of {finger_id} matches no scan"
+        assert check_out is None or (finger_id, check_out) in seen, f"check-out of {finger_id} matches no scan"
@@ -0,0 +1,128 @@
+"""Incremental updates for ttk.Treeview tables.
+
+Rebuilding a Treeview by deleting every item and inserting the rows one
+by one blocks the Tk main loop for as long as that takes, which with
+thousands of rows is long enough to freeze the window after every scan.
+TreeUpdater keeps track of what the tree shows and applies only the
+difference to the new rows.
+"""
+
+# Refresh requests arriving within this many milliseconds are merged
+FRAME_MS = 16
+
+# New items inserted per idle callback
+CHUNK_SIZE = 250
+
+
+class TreeUpdater:
+    """Keyed diffing updater for a ttk.Treeview.
+
+    update(rows) takes (key, values) pairs in display order. Items whose
+    key is gone are deleted in one call, items whose values changed are
+    edited in place, new items are inserted CHUNK_SIZE at a time from
+    after_idle callbacks and items are only moved when out of order.
+    request(load) coalesces refreshes: load() runs once per frame no
+    matter how many requests arrived in it. put() and remove() change
+    single rows, for updates that arrive as events rather than as a new
+    set of rows.
+    """
+
+    def __init__(self, tree, chunk_size=CHUNK_SIZE, delay=FRAME_MS):
+        self.tree = tree
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self._rows = {}
+        self._load = None
+        self._scheduled = None
+        self._inserting = None
+
+    def request(self, load):
+        """Refresh from load() on the next frame"""
+        self._load = load
+        if self._scheduled is None:
+            self._scheduled = self.tree.after(self.delay, self._run)
+
+    def _run(self):
+        self._scheduled = None
+        load, self._load = self._load, None
+        if load is not None:
+            self.update(load())
+
+    def update(self, rows):
+        """Make the tree show rows, a sequence of (key, values) pairs"""
+        if self._inserting is not None:
+            # A newer update supersedes inserts still queued from the last one
+            self.tree.after_cancel(self._inserting)
+            self._inserting = None
+
+        rows = [(str(key), tuple(values)) for key, values in rows]
+        wanted = dict(rows)
+
+        removed = [key for key in self._rows if key not in wanted]
+        if removed:
+            self.tree.delete(*removed)
+            for key in removed:
+                del self._rows[key]
+
+        pending = []
+        for key, values in rows:
+            current = self._rows.get(key)
+            if current is None:
+                pending.append((key, values))
+            elif current != values:
+                self.tree.item(key, values=values)
+                self._rows[key] = values
+
+        order = [key for key, values in rows]
+        self._insert(pending, order)
+
+    def put(self, key, values, index=0):
+        """Edit the row with key in place, or insert it at index"""
+        key, values = str(key), tuple(values)
+        current = self._rows.get(key)
+        if current is None:
+            self.tree.insert('', index, iid=key, values=values)
+            self._rows[key] = values
+        elif current != values:
+            self.tree.item(key, values=values)
+            self._rows[key] = values
+
+    def remove(self, *keys):
+        """Delete the rows with keys"""
+        keys = [str(key) for key in keys if str(key) in self._rows]
+        if keys:
+            self.tree.delete(*keys)
+            for key in keys:
+                del self._rows[key]
+
+    def keys(self):
+        """Keys of the rows shown, in display order"""
+        return list(self.tree.get_children())
+
+    def _insert(self, pending, order):
+        chunk, pending = pending[:self.chunk_size], pending[self.chunk_size:]
+        for key, values in chunk:
+            if key in self._rows:
+                # Put in the meantime
+                continue
+            self.tree.insert('', 'end', iid=key, values=values)
+            self._rows[key] = values
+        if pending:
+            self._inserting = self.tree.after_idle(self._insert, pending, order)
+        else:
+            self._inserting = None
+            self._reorder(order)
+
+    def _reorder(self, order):
+        children = list(self.tree.get_children())
+        if children == order:
+            return
+        for index, key in enumerate(order):
+            if children[index] != key:
+                self.tree.move(key, '', index)
+                children.remove(key)
+                children.insert(index, key)
+
+    def clear(self):
+        """Remove every item"""
+        self.update([])
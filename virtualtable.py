@@ -0,0 +1,229 @@
+"""Virtual-scrolling tables backed by SQLite.
+
+VirtualTable shows a window of rows in a ttk.Treeview that only ever
+holds the visible items. The rows come from a KeysetSource, which reads
+the query one page at a time in SQL sort order, so memory and render time
+stay flat however many rows the query returns.
+"""
+import collections
+import tkinter as tk
+from tkinter import ttk
+
+from treeview import TreeUpdater
+
+# Rows read from the database per query
+PAGE_SIZE = 100
+
+# Pages kept in memory by a KeysetSource
+CACHED_PAGES = 8
+
+# Treeview row height used to work out how many rows fit the widget
+ROW_HEIGHT = 20
+HEADING_HEIGHT = 25
+
+
+class KeysetSource:
+    """Rows of a SELECT statement read a page at a time with keyset pagination.
+
+    sql is any SELECT returning the columns named in columns plus key, a
+    column that is unique per row. Pages are fetched in ORDER BY sort,
+    key with a WHERE (sort, key) > (last sort, last key) condition
+    instead of OFFSET, so reading page n costs the same as reading page
+    0. To jump straight into the middle of the result the first key of
+    every page is read once per sort order with a single window-function
+    query (one tuple per page). Columns used for sorting must not be
+    NULL; wrap them in COALESCE in sql.
+    """
+
+    def __init__(self, db, sql, params=(), columns=(), key='finger_id', sort=None,
+                 descending=False, page_size=PAGE_SIZE, cached_pages=CACHED_PAGES):
+        self.db = db
+        self.sql = sql
+        self.params = tuple(params)
+        self.columns = tuple(columns)
+        self.key = key
+        self.sort = sort or key
+        self.descending = descending
+        self.page_size = page_size
+        self.cached_pages = cached_pages
+        self.reset()
+
+    def reset(self):
+        """Forget cached pages, e.g. after the underlying rows changed"""
+        self._count = None
+        self._bookmarks = None
+        self._pages = collections.OrderedDict()
+
+    def patch(self, key, values):
+        """Change the cached row with key without a query; values maps column names to new values.
+
+        Returns False if the row is not in a cached page. A patched row
+        keeps its place and the row count stays as it was until reset(),
+        even if the new values would move it or filter it out.
+        """
+        names = (self.key,) + self.columns + (self.sort,)
+        found = False
+        for rows in self._pages.values():
+            for index, row in enumerate(rows):
+                if row[0] == key:
+                    rows[index] = tuple(values.get(name, value) for name, value in zip(names, row))
+                    found = True
+        return found
+
+    def sort_by(self, column, descending=False):
+        """Change the sort order"""
+        self.sort = column
+        self.descending = descending
+        self.reset()
+
+    def count(self):
+        """Number of rows the query returns"""
+        if self._count is None:
+            self._count = self.db.query_value(f"SELECT COUNT(*) FROM ({self.sql})", self.params)
+        return self._count
+
+    def rows(self, offset, limit):
+        """Return up to limit (key, values) pairs starting at row offset"""
+        rows = []
+        page = offset // self.page_size
+        skip = offset % self.page_size
+        while len(rows) < limit and page * self.page_size < self.count():
+            rows.extend(self._page(page)[skip:])
+            skip = 0
+            page += 1
+        return [(row[0], row[1:-1]) for row in rows[:limit]]
+
+    def _order(self):
+        direction = "DESC" if self.descending else "ASC"
+        return f'ORDER BY "{self.sort}" {direction}, "{self.key}" {direction}'
+
+    def _page(self, page):
+        if page in self._pages:
+            self._pages.move_to_end(page)
+            return self._pages[page]
+
+        columns = ", ".join(f'"{column}"' for column in (self.key,) + self.columns + (self.sort,))
+        where, params = "", ()
+        previous = self._pages.get(page - 1)
+        if page and previous:
+            # Continue after the last row of the previous page
+            where = f'WHERE ("{self.sort}", "{self.key}") {"<" if self.descending else ">"} (?, ?)'
+            params = (previous[-1][-1], previous[-1][0])
+        elif page:
+            # Start from the page's first key
+            where = f'WHERE ("{self.sort}", "{self.key}") {"<=" if self.descending else ">="} (?, ?)'
+            params = self._bookmark(page)
+        rows = self.db.query(f"SELECT {columns} FROM ({self.sql}) {where} {self._order()} LIMIT ?",
+                             self.params + params + (self.page_size,))
+
+        self._pages[page] = rows
+        while len(self._pages) > self.cached_pages:
+            self._pages.popitem(last=False)
+        return rows
+
+    def _bookmark(self, page):
+        if self._bookmarks is None:
+            self._bookmarks = self.db.query(f"""
+                SELECT sort_value, key_value FROM (
+                    SELECT "{self.sort}" AS sort_value, "{self.key}" AS key_value,
+                           ROW_NUMBER() OVER ({self._order()}) - 1 AS row_number
+                    FROM ({self.sql}))
+                WHERE row_number % ? = 0""", self.params + (self.page_size,))
+        return tuple(self._bookmarks[page])
+
+
+class VirtualTable(tk.Frame):
+    """Scrollable table that only creates Treeview items for visible rows.
+
+    columns is a list of (column, heading, width) tuples, column naming
+    an output column of the source query. Clicking a heading sorts by
+    that column in SQL (clicking again reverses the order). The inner
+    Treeview is available as .tree for selection handling.
+    """
+
+    def __init__(self, parent, columns, **kwargs):
+        tk.Frame.__init__(self, parent, **kwargs)
+        self.columns = [column for column, heading, width in columns]
+        self.source = None
+        self.offset = 0
+        self.visible = 1
+
+        self.tree = ttk.Treeview(self, columns=self.columns, show='headings', selectmode='browse')
+        for column, heading, width in columns:
+            self.tree.heading(column, text=heading, command=lambda c=column: self.sort_by(c))
+            if width:
+                self.tree.column(column, width=width)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.tree.pack(side=tk.LEFT, fill='both', expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.updater = TreeUpdater(self.tree)
+
+        self.tree.bind('<Configure>', self._on_resize)
+        self.tree.bind('<MouseWheel>', lambda e: self.scroll(-1 if e.delta > 0 else 1, 'units'))
+        self.tree.bind('<Button-4>', lambda e: self.scroll(-1, 'units'))
+        self.tree.bind('<Button-5>', lambda e: self.scroll(1, 'units'))
+        self.tree.bind('<Prior>', lambda e: self.scroll(-1, 'pages'))
+        self.tree.bind('<Next>', lambda e: self.scroll(1, 'pages'))
+
+    def set_source(self, source):
+        """Show the rows of a KeysetSource from the top"""
+        self.source = source
+        self.offset = 0
+        self.render()
+
+    def refresh(self):
+        """Re-read the current window after the underlying rows changed"""
+        if self.source is not None:
+            self.source.reset()
+            self.render()
+
+    def patch(self, key, values):
+        """Show new values for the row with key if it is loaded, without a query (see KeysetSource.patch)"""
+        if self.source is not None and self.source.patch(key, values):
+            self.render()
+
+    def sort_by(self, column):
+        if self.source is None:
+            return
+        descending = self.source.sort == column and not self.source.descending
+        self.source.sort_by(column, descending)
+        self.offset = 0
+        self.render()
+
+    def scroll(self, number, what):
+        step = self.visible if what == 'pages' else 1
+        self.scroll_to(self.offset + int(number) * step)
+        return 'break'
+
+    def scroll_to(self, offset):
+        total = self.source.count() if self.source else 0
+        offset = max(0, min(offset, total - self.visible))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+
+    def render(self):
+        """Fill the Treeview with the rows of the current window"""
+        if self.source is None:
+            return
+        total = self.source.count()
+        self.offset = max(0, min(self.offset, total - self.visible))
+        self.updater.update(self.source.rows(self.offset, self.visible))
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self.visible) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _on_scrollbar(self, action, number, what=None):
+        if action == 'moveto':
+            total = self.source.count() if self.source else 0
+            self.scroll_to(int(float(number) * total))
+        else:
+            self.scroll(number, what)
+
+    def _on_resize(self, event):
+        rowheight = int(ttk.Style().lookup('Treeview', 'rowheight') or ROW_HEIGHT)
+        visible = max(1, (event.height - HEADING_HEIGHT) // rowheight)
+        if visible != self.visible:
+            self.visible = visible
+            self.render()